@@ -1,8 +1,14 @@
 import logging
-from typing import Generic, List, Optional, TypeVar
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, Generic, Iterator, List, Optional, TypeVar
 
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.concurrency import iterate_in_threadpool
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 import subprocess
@@ -49,13 +55,26 @@ class RunShSubprocessResponse(BaseModel):
     stderr: str
 
 
+def start_command(cmd: List[str]) -> subprocess.Popen:
+    # In its own session, so a timeout kills the compiled program and not only run.sh
+    return subprocess.Popen(cmd, text=True, encoding='utf-8', start_new_session=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+
+
+def kill_command(cmd_process: subprocess.Popen) -> None:
+    try:
+        os.killpg(cmd_process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    cmd_process.wait()
+
+
 @app.post("/v1/run", tags=["Run"])
 def run_sh_subprocess(body: RunShSubprocess) -> Result[RunShSubprocessResponse]:
+    cmd_process = None
     try:
         logger.info(f"Running command: {body.cmd}")
-        cmd = body.cmd
-        cmd_process = subprocess.Popen(cmd, text=True, encoding='utf-8',
-                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+        cmd_process = start_command(body.cmd)
         stdout, stderr = cmd_process.communicate(input=body.stdin, timeout=body.timeout)
         result = RunShSubprocessResponse(
             returncode=cmd_process.returncode,
@@ -66,7 +85,142 @@ def run_sh_subprocess(body: RunShSubprocess) -> Result[RunShSubprocessResponse]:
         return Result(ok=result)
     except subprocess.TimeoutExpired as e:
         logger.error(f"TimeoutExpired: {e}")
+        if cmd_process is not None:
+            kill_command(cmd_process)
         return Result(error=f'TimeoutExpired after {e.timeout} seconds')
     except Exception as e:
         logger.error(f"Exception: {e}")
         return Result(error=str(e))
+
+
+# Live events of /v1/run/stream, one JSON object per line:
+#   {"type": "events", "events": [<event>, ...]}   while the program runs
+#   {"type": "result", "result": <Result>}         last line, same as the body of /v1/run
+OUTS = Path('outs')
+POLL_SECONDS = 0.05
+MAX_BATCH_BYTES = 256 * 1024
+
+
+class OutsTail:
+    # Reads the complete lines appended to the files of the inspector (outs/<pid>.json).
+    # Files not written since the run started are left by the previous run, run.sh removes
+    # them once it starts.
+    def __init__(self, outs: Path) -> None:
+        self.outs = outs
+        self.started_ns = time.time_ns()
+        self.offsets: Dict[Path, int] = {}
+
+    def read(self) -> List[str]:
+        lines: List[str] = []
+        size = 0
+        for file in sorted(self.outs.glob('*')):
+            offset = self.offsets.get(file)
+            if offset is None:
+                try:
+                    if file.stat().st_mtime_ns < self.started_ns:
+                        continue
+                except FileNotFoundError:
+                    continue
+                offset = 0
+            try:
+                f = file.open('rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n') or size >= MAX_BATCH_BYTES:
+                        break
+                    offset += len(line)
+                    text = line.decode('utf-8', errors='replace').strip()
+                    if text:
+                        lines.append(text)
+                        size += len(text)
+            self.offsets[file] = offset
+        return lines
+
+
+def events_frame(lines: List[str]) -> str:
+    # The inspector already writes JSON objects, they are not parsed again
+    return '{"type": "events", "events": [' + ','.join(lines) + ']}\n'
+
+
+def _read_all(stream, into: List[str]) -> threading.Thread:
+    thread = threading.Thread(target=lambda: into.append(stream.read()), daemon=True)
+    thread.start()
+    return thread
+
+
+def _write_all(stream, text: str) -> threading.Thread:
+    # A program that does not read its stdin would block the stream on a full pipe
+    def write() -> None:
+        try:
+            stream.write(text)
+            stream.close()
+        except OSError:
+            pass
+
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    return thread
+
+
+def stream_run(body: RunShSubprocess, started: List[subprocess.Popen]) -> Iterator[str]:
+    tail = OutsTail(OUTS)
+    result: Result[RunShSubprocessResponse]
+    cmd_process = None
+    try:
+        logger.info(f"Streaming command: {body.cmd}")
+        cmd_process = start_command(body.cmd)
+        started.append(cmd_process)
+        deadline = time.monotonic() + body.timeout
+        stdout: List[str] = []
+        stderr: List[str] = []
+        readers = [_read_all(cmd_process.stdout, stdout), _read_all(cmd_process.stderr, stderr)]
+        _write_all(cmd_process.stdin, body.stdin or '')
+        while cmd_process.poll() is None:
+            if time.monotonic() > deadline:
+                kill_command(cmd_process)
+                raise subprocess.TimeoutExpired(body.cmd, body.timeout)
+            lines = tail.read()
+            if lines:
+                # The response is flow controlled, a slow client pauses the tail and not the program
+                yield events_frame(lines)
+            else:
+                time.sleep(POLL_SECONDS)
+        while lines := tail.read():
+            yield events_frame(lines)
+        for reader in readers:
+            reader.join()
+        result = Result(ok=RunShSubprocessResponse(
+            returncode=cmd_process.returncode,
+            stdout=''.join(stdout),
+            stderr=''.join(stderr),
+        ))
+    except subprocess.TimeoutExpired as e:
+        logger.error(f"TimeoutExpired: {e}")
+        result = Result(error=f'TimeoutExpired after {e.timeout} seconds')
+    except Exception as e:
+        logger.error(f"Exception: {e}")
+        result = Result(error=str(e))
+    finally:
+        if cmd_process is not None and cmd_process.poll() is None:
+            kill_command(cmd_process)
+    yield '{"type": "result", "result": ' + result.model_dump_json() + '}\n'
+
+
+@app.post("/v1/run/stream", tags=["Run"])
+def run_sh_subprocess_stream(body: RunShSubprocess) -> StreamingResponse:
+    started: List[subprocess.Popen] = []
+
+    async def frames() -> AsyncIterator[str]:
+        try:
+            async for frame in iterate_in_threadpool(stream_run(body, started)):
+                yield frame
+        finally:
+            # A client gone mid-stream cancels the response and leaves stream_run() suspended
+            for cmd_process in started:
+                if cmd_process.poll() is None:
+                    kill_command(cmd_process)
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
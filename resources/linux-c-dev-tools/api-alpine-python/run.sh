@@ -4,11 +4,15 @@ mkdir -p ./outs
 mkdir -p ./results/tmp
 mkdir -p ./results/data
 
-PROG=`basename ${1%.*}`
+# Path relative to the files mount, it keeps the shard directories of the storage layout
+NAME=${1%.*}
+PROG=`basename $NAME`
+# Remaining arguments are options of outs-concat (compaction and limits)
+shift
 
-JSON_PATH="/mnt/files/$PROG.json"
+JSON_PATH="/mnt/files/$NAME.json"
 EXECUTABLE_PATH="./results/tmp/$PROG"
-TRANSFORMED_PATH="/mnt/files/$PROG.c"
+TRANSFORMED_PATH="/mnt/files/$NAME.c"
 EXECUTABLE_PATH="./$PROG"
 
 echo -e "INFO: Removing outs"
@@ -23,7 +27,7 @@ $EXECUTABLE_PATH
 echo -e "===============================================================\n"
 
 echo -e "INFO: Concatenating outs"
-python /app/scripts.py outs-concat --output ./results/data.json
+python /app/scripts.py outs-concat --output ./results/data.json "$@"
 
 echo -e "INFO: Renaming result"
 mv ./results/data.json $JSON_PATH
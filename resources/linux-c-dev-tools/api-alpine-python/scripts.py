@@ -1,22 +1,209 @@
+import json
+import sys
+import time
+
+from collections import deque
 from pathlib import Path
 
 
+# Events buffered while looking for the end of a loop iteration
+MAX_ITERATION_EVENTS = 1000
+
+
+class TraceLimitExceeded(Exception):
+    pass
+
+
+class TraceWriter:
+    def __init__(self, fout, max_bytes=None, max_seconds=None):
+        self.fout = fout
+        self.index = 0
+        self.size = 0
+        self.last_line = None
+        self.max_bytes = max_bytes
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+
+    def write(self, line):
+        if self.max_bytes is not None and self.size + len(line) > self.max_bytes:
+            raise TraceLimitExceeded(f'Trace bigger than {self.max_bytes} bytes')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TraceLimitExceeded('Trace merge timed out')
+        if self.index == 0:
+            self.fout.write('\n  ')
+        else:
+            self.fout.write(',\n  ')
+        self.fout.write(line)
+        self.size += len(line)
+        self.index += 1
+        self.last_line = line
+
+    def truncate(self, reason):
+        # Keep the trace a valid array, the limits only apply to the events
+        self.max_bytes = None
+        self.deadline = None
+        event = json.loads(self.last_line) if self.last_line else {
+            'time': 0, 'depth': 0, 'pid': 0, 'parent_pid': 0, 'function': '', 'line': 0}
+        event['type'] = 'trace_truncated'
+        event['payload'] = {'reason': reason}
+        self.write(json.dumps(event))
+
+
+class LoopCompactor:
+    # An iteration is every event from a `condition` event up to the next event of the same
+    # condition. Runs of iterations with the same (function, type, line) sequence keep the
+    # first and last `keep` iterations, two or more in between are replaced by one
+    # `loop_compacted` event with the number of iterations and events per iteration.
+    def __init__(self, writer, keep):
+        self.writer = writer
+        self.keep = keep
+        self.head = None
+        self.pending = []
+        self.signature = None
+        self.count = 0
+        self.skipped = 0
+        self.skipped_first = None
+        self.tail = deque()
+
+    def add(self, line):
+        event = json.loads(line)
+        key = (event['function'], event['type'], event['line'])
+        if event['type'] == 'condition':
+            if self.head is None:
+                self._flush_pending()
+                self.head = key
+            elif key == self.head:
+                self._iteration(self.pending)
+                self.pending = []
+        self.pending.append((line, event, key))
+        if len(self.pending) > MAX_ITERATION_EVENTS:
+            self._end_run()
+            self._flush_pending()
+            self.head = None
+
+    def close(self):
+        self._end_run()
+        self._flush_pending()
+        self.head = None
+
+    def _iteration(self, iteration):
+        signature = tuple(key for _line, _event, key in iteration)
+        if signature != self.signature:
+            self._end_run()
+            self.signature = signature
+        self.count += 1
+        if self.count <= self.keep:
+            self._write(iteration)
+            return
+        self.tail.append(iteration)
+        if len(self.tail) > self.keep:
+            skipped = self.tail.popleft()
+            if self.skipped_first is None:
+                self.skipped_first = skipped
+            self.skipped += 1
+
+    def _end_run(self):
+        if self.skipped == 1:
+            # Nothing to gain, and with keep 0 a lone iteration would be lost
+            self._write(self.skipped_first)
+        elif self.skipped:
+            event = dict(self.skipped_first[0][1])
+            event['type'] = 'loop_compacted'
+            event['payload'] = {
+                'iterations': self.skipped,
+                'events_per_iteration': len(self.signature),
+            }
+            self.writer.write(json.dumps(event))
+        for iteration in self.tail:
+            self._write(iteration)
+        self.tail.clear()
+        self.signature = None
+        self.count = 0
+        self.skipped = 0
+        self.skipped_first = None
+
+    def _flush_pending(self):
+        self._write(self.pending)
+        self.pending = []
+
+    def _write(self, events):
+        for line, _event, _key in events:
+            self.writer.write(line)
+
+
+def first_event(file):
+    with file.open('r') as fin:
+        for line in fin:
+            line = line.strip()
+            if line:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    return {}
+                return event if isinstance(event, dict) else {}
+    return {}
+
+
+def ordered_outs(outs):
+    # One file per process. The blocks go in fork order, not in directory order, so two runs
+    # of the same program merge the same way: a process, then the processes it forked, depth
+    # first. Siblings go by the time of their first event, then by pid.
+    starts = {}
+    for file in outs.glob('*'):
+        event = first_event(file)
+        pid = event.get('pid') if isinstance(event.get('pid'), int) else None
+        started = event.get('time') if isinstance(event.get('time'), (int, float)) else float('inf')
+        starts[file] = (pid, event.get('parent_pid'), started)
+    pids = {pid for pid, _parent, _started in starts.values() if pid is not None}
+    children = {}
+    for file, (pid, parent, _started) in starts.items():
+        key = parent if parent in pids and parent != pid else None
+        children.setdefault(key, []).append(file)
+
+    def order(file):
+        pid, _parent, started = starts[file]
+        return (started, pid if pid is not None else float('inf'), file.name)
+
+    ordered = []
+    visited = set()
+    stack = sorted(children.get(None, []), key=order, reverse=True)
+    while stack:
+        file = stack.pop()
+        if file in visited:
+            continue
+        visited.add(file)
+        ordered.append(file)
+        pid = starts[file][0]
+        if pid is not None:
+            stack.extend(sorted(children.get(pid, []), key=order, reverse=True))
+    # Processes in a pid cycle (pid reuse) are not reachable from a root
+    ordered += sorted((file for file in starts if file not in visited), key=order)
+    return ordered
+
+
 def command_outs_concat(args):
     output = Path(args.output)
     outs = Path('outs')
-    index = 0
 
     with output.open('w') as fout:
         fout.write('[')
-        for file in outs.glob('*'):
-            with file.open('r') as fin:
-                for line in fin:
-                    if index == 0:
-                        fout.write('\n  ')
-                    else:
-                        fout.write(',\n  ')
-                    fout.write(line.strip())
-                    index += 1
+        writer = TraceWriter(fout, max_bytes=args.max_bytes, max_seconds=args.max_seconds)
+        try:
+            for file in ordered_outs(outs):
+                compactor = LoopCompactor(writer, args.compact_keep) if args.compact_keep is not None else None
+                with file.open('r') as fin:
+                    for line in fin:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        if compactor is None:
+                            writer.write(line)
+                        else:
+                            compactor.add(line)
+                if compactor is not None:
+                    compactor.close()
+        except TraceLimitExceeded as e:
+            print(f'WARNING: {e}, trace truncated', file=sys.stderr)
+            writer.truncate(str(e))
         fout.write('\n]')
 
 
@@ -40,6 +227,10 @@ def get_parse_args():
     outs_concat_cmd = subparsers.add_parser(
         'outs-concat', help='Concatenate all output files')
     outs_concat_cmd.add_argument('-o', '--output', type=is_json, required=True)
+    outs_concat_cmd.add_argument('--compact-keep', type=int,
+                                 help='Compact repeated loop iterations keeping the first and last N')
+    outs_concat_cmd.add_argument('--max-bytes', type=int, help='Truncate the trace after N bytes')
+    outs_concat_cmd.add_argument('--max-seconds', type=float, help='Truncate the trace after N seconds')
 
     subparsers.add_parser(
         'outs-remove', help='Remove all output files')
@@ -6,7 +6,7 @@ import glob
 import argparse
 import subprocess
 import sys
-from typing import Callable, Optional
+from typing import Callable, List, Optional
 
 
 @dataclass
@@ -18,6 +18,15 @@ class Args:
     recursive: Optional[bool] = False
     dev: Optional[bool] = False
     port: Optional[int] = None
+    source: Optional[str] = None
+    target: Optional[str] = None
+    dry_run: Optional[bool] = False
+    grace: Optional[float] = None
+    rows: Optional[int] = None
+    logins: Optional[int] = None
+    seconds: Optional[float] = None
+    requests: Optional[int] = None
+    metrics_port: Optional[int] = None
     parser: Optional[argparse.ArgumentParser] = None
     func: Optional[Callable] = None
 
@@ -128,6 +137,262 @@ async def command_test(_args: Args) -> None:
     cmd_run(["pytest", "tests/"])
 
 
+async def command_storage_migrate(args: Args) -> None:
+    "Move the artifacts of the code flows to another storage layout"
+    from server.storage.artifact_storage import create_artifact_storage, migrate_artifacts
+    source = create_artifact_storage(args.source)
+    target = create_artifact_storage(args.target)
+    moved = migrate_artifacts(source, target)
+    print(f"Moved {moved} files from '{args.source}' to '{args.target}' layout")
+    print(f"Set ARTIFACT_STORAGE={args.target} before starting the server")
+
+
+async def command_artifact_gc(args: Args) -> None:
+    "Delete the artifacts that do not belong to any code flow"
+    from server.database.connection import DatabaseSingleton
+    from server.env import env
+    from server.jobs.artifact_gc_job import ArtifactGcJob
+    from server.repositories.code_flow_repository import CodeFlowRepository
+    from server.storage.artifact_storage import get_artifact_storage
+    database = DatabaseSingleton()
+    try:
+        job = ArtifactGcJob(
+            CodeFlowRepository(await database.get_instance()),
+            get_artifact_storage(),
+            grace_seconds=args.grace if args.grace is not None else env.artifact_gc_grace_seconds,
+            dry_run=bool(args.dry_run),
+        )
+        report = await job.sweep()
+    finally:
+        await database.close_instance()
+    action = "Would delete" if args.dry_run else "Deleted"
+    print(f"{action} {report.deleted} of {report.scanned} files, {report.reclaimed_bytes} bytes")
+
+
+async def command_worker(args: Args) -> None:
+    "Process the queued code flows, next to API processes started with JOB_EMBEDDED_WORKER=false"
+    import logging
+    import signal
+    from server.container import Container
+    from server.database.connection import DatabaseSingleton, ReadDatabaseSingleton
+    from server.database.init_database import init_database
+    from server.jobs.code_flow_queue import worker_name
+
+    async def serve_metrics(container: Container, port: int) -> None:
+        import uvicorn
+        from fastapi import FastAPI
+        from server.controllers.metrics_controller import router
+
+        class MetricsServer(uvicorn.Server):
+            def install_signal_handlers(self) -> None:
+                # The worker stops on the signals
+                pass
+
+        app = FastAPI()
+        app.state.container = container
+        app.include_router(router)
+        await MetricsServer(uvicorn.Config(app, host="0.0.0.0", port=port, log_level="warning")).serve()
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s: [%(asctime)s] %(name)s: %(message)s")
+    database = DatabaseSingleton()
+    try:
+        connection = await database.get_instance()
+        await init_database(connection)
+        container = Container(connection, await ReadDatabaseSingleton().get_instance())
+        logging.getLogger(__name__).info(f"Worker {worker_name()} started")
+        job = asyncio.create_task(container.process_code_flow_job.run())
+        # Sends the job events to the API processes and gets the watches of the live traces
+        job_relay = asyncio.create_task(container.job_relay.run())
+        metrics_server = None
+        if args.metrics_port is not None:
+            metrics_server = asyncio.create_task(serve_metrics(container, args.metrics_port))
+        # A job cut short is claimed again once its lease expires
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(signum, job.cancel)
+        try:
+            await job
+        except asyncio.CancelledError:
+            pass
+        job_relay.cancel()
+        if metrics_server is not None:
+            metrics_server.cancel()
+    finally:
+        await ReadDatabaseSingleton().close_instance()
+        await database.close_instance()
+
+
+async def command_benchmark_list(args: Args) -> None:
+    "Compare the per row cost of the code flow list serialization paths"
+    import json
+    import os
+    import tempfile
+    import time
+    from databases import Database
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from typing import List
+    from server.database.init_database import init_database
+    from server.mappers import CodeFlowIndexMapper, CodeFlowShowMapper
+    from server.models import CodeFlowShow
+    from server.repositories.code_flow_repository import CodeFlowFilter, CodeFlowRepository
+
+    rows = args.rows or 10_000
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database("sqlite+aiosqlite:///" + os.path.join(tmp, "benchmark.sqlite"))
+        await database.connect()
+        await init_database(database)
+        await database.execute_many("""
+            INSERT INTO code_flow (name, file_id, processed, flow_error, user_id, private, input, flow_event_count, flow_size)
+            VALUES (:name, :file_id, TRUE, NULL, 1, FALSE, :input, 1000, 65536)
+        """, [{"name": f"flow_{i:06}.c", "file_id": f"{i:032x}", "input": "1 2 3"} for i in range(rows)])
+        repository = CodeFlowRepository(database)
+        adapter = TypeAdapter(List[CodeFlowShow])
+
+        def report(label: str, fetch: float, serialize: float) -> None:
+            print(f"{label:<8} fetch {fetch * 1e6 / rows:6.2f} us/row, "
+                  f"serialize {serialize * 1e6 / rows:6.2f} us/row, total {(fetch + serialize) * 1e3:8.2f} ms")
+
+        # Previous path: Record -> CodeFlowIndex -> CodeFlowShow -> response model -> JSON
+        start = time.perf_counter()
+        records = await database.fetch_all("""
+            SELECT c.*, u.username AS username FROM code_flow c
+            LEFT JOIN users u ON c.user_id = u.id ORDER BY c.name, c.id
+        """)
+        fetched = time.perf_counter()
+        items = CodeFlowShowMapper.from_all_indexes(CodeFlowIndexMapper.from_all_records(records))
+        old = json.dumps(jsonable_encoder(adapter.validate_python(items)), ensure_ascii=False,
+                         allow_nan=False, indent=None, separators=(",", ":")).encode()
+        report("models", fetched - start, time.perf_counter() - fetched)
+
+        start = time.perf_counter()
+        records = await repository.get_page_records(CodeFlowFilter(), rows)
+        fetched = time.perf_counter()
+        new = CodeFlowShowMapper.json_from_records(records)
+        report("orjson", fetched - start, time.perf_counter() - fetched)
+
+        await database.disconnect()
+        print("Same output:", json.loads(old) == json.loads(new))
+
+
+async def command_benchmark_login(args: Args) -> None:
+    "Measure the latency of other requests during a login storm, bcrypt on and off the event loop"
+    import os
+    import tempfile
+    import time
+
+    logins = args.logins or 20
+    seconds = args.seconds or 5
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + os.path.join(tmp, "benchmark.sqlite")
+        import httpx
+        from server.env import env
+        from server.main import app, lifespan
+        from server.services.crypt_service import CryptService, CryptServiceSingleton
+
+        async def storm(client: httpx.AsyncClient, headers: dict) -> None:
+            stop = time.perf_counter() + seconds
+            counts = {"logins": 0, "rejected": 0}
+
+            async def login() -> None:
+                while time.perf_counter() < stop:
+                    response = await client.post(
+                        "/auth/login", data={"username": "admin", "password": env.admin_password})
+                    if response.status_code == 503:
+                        counts["rejected"] += 1
+                        await asyncio.sleep(0.05)
+                    else:
+                        counts["logins"] += 1
+
+            async def probe() -> List[float]:
+                latencies = []
+                while time.perf_counter() < stop:
+                    start = time.perf_counter()
+                    await client.get("/user/me", headers=headers)
+                    latencies.append(time.perf_counter() - start)
+                    await asyncio.sleep(0.01)
+                return sorted(latencies)
+
+            latencies, *_ = await asyncio.gather(probe(), *[login() for _ in range(logins)])
+
+            def percentile(p: float) -> float:
+                return latencies[int(p * (len(latencies) - 1))] * 1e3
+
+            print(f"  GET /user/me: {len(latencies)} requests, p50 {percentile(0.5):7.1f} ms, "
+                  f"p99 {percentile(0.99):7.1f} ms, max {latencies[-1] * 1e3:7.1f} ms")
+            print(f"  POST /auth/login: {counts['logins']} done, {counts['rejected']} rejected with 503")
+
+        services = [
+            ("blocking", CryptService(0, 0)),
+            (f"pool ({env.crypt_workers} workers, queue {env.crypt_queue_size})",
+             CryptService(env.crypt_workers, env.crypt_queue_size)),
+        ]
+        transport = httpx.ASGITransport(app=app)
+        for label, service in services:
+            # The container of the lifespan takes the service of the singleton
+            CryptServiceSingleton.instance = service
+            async with lifespan(app), httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                response = await client.post("/auth/login", data={"username": "admin", "password": env.admin_password})
+                headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+                print(f"{label}, {logins} concurrent logins for {seconds} s")
+                await storm(client, headers)
+
+
+async def command_benchmark_dependencies(args: Args) -> None:
+    "Measure the time and memory spent resolving the dependencies of a request"
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+
+    count = args.requests or 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + os.path.join(tmp, "benchmark.sqlite")
+        import httpx
+        from fastapi.dependencies.utils import solve_dependencies
+        from fastapi.routing import APIRoute
+        from starlette.background import BackgroundTasks
+        from starlette.requests import Request
+        from server.env import env
+        from server.main import app, lifespan
+
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                response = await client.post("/auth/login", data={"username": "admin", "password": env.admin_password})
+            authorization = f"Bearer {response.json()['access_token']}".encode()
+
+            routes = {(route.path, method): route for route in app.routes if isinstance(route, APIRoute)
+                      for method in route.methods}
+            for path, path_params in [("/user/me", {}), ("/code-flow/", {}), ("/code-flow/{id}/", {"id": "1"})]:
+                route = routes[(path, "GET")]
+                scope = {
+                    "type": "http", "method": "GET", "path": path, "query_string": b"", "app": app,
+                    "headers": [(b"authorization", authorization)], "path_params": path_params,
+                }
+
+                async def solve() -> None:
+                    await solve_dependencies(request=Request(scope), dependant=route.dependant,
+                                             background_tasks=BackgroundTasks(), dependency_overrides_provider=app)
+
+                await solve()
+                start = time.perf_counter()
+                for _ in range(count):
+                    await solve()
+                elapsed = time.perf_counter() - start
+
+                tracemalloc.start()
+                peaks = []
+                for _ in range(100):
+                    tracemalloc.reset_peak()
+                    before, _ = tracemalloc.get_traced_memory()
+                    await solve()
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+                tracemalloc.stop()
+                print(f"GET {path:<18} {elapsed * 1e6 / count:8.1f} us/request, "
+                      f"peak {sum(peaks) / len(peaks) / 1024:6.1f} KiB/request")
+
+
 def parse_args():
     def from_command(func: Callable) -> argparse.ArgumentParser:
         prefix = "command_"
@@ -159,6 +424,27 @@ def parse_args():
 
     sp = from_command(command_install)
 
+    sp = from_command(command_storage_migrate)
+    sp.add_argument('--source', default="flat", help="Current layout (flat, sharded)")
+    sp.add_argument('--target', default="sharded", help="New layout (flat, sharded)")
+
+    sp = from_command(command_worker)
+    sp.add_argument('--metrics-port', type=int, help="Serve the /metrics of the worker on this port")
+
+    sp = from_command(command_benchmark_list)
+    sp.add_argument('--rows', type=int, help="Number of code flows (default 10000)")
+
+    sp = from_command(command_benchmark_login)
+    sp.add_argument('--logins', type=int, help="Concurrent login clients (default 20)")
+    sp.add_argument('--seconds', type=float, help="Duration of each storm (default 5)")
+
+    sp = from_command(command_benchmark_dependencies)
+    sp.add_argument('--requests', type=int, help="Resolutions per route (default 2000)")
+
+    sp = from_command(command_artifact_gc)
+    sp.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+    sp.add_argument('--grace', type=float, help="Keep files modified in the last seconds")
+
     options, args = parser.parse_known_args()
     args = Args(
         program=sys.argv[0],
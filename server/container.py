@@ -0,0 +1,94 @@
+from databases import Database
+
+from .env import env
+from .jobs.code_flow_queue import CodeFlowQueue, worker_name
+from .jobs.job_events import get_job_event_broker
+from .jobs.job_relay import JobRelay
+from .jobs.live_trace import get_live_trace_registry
+from .jobs.process_code_flow_job import ProcessCodeFlowJob
+from .repositories.code_flow_job_message_repository import CodeFlowJobMessageRepository
+from .repositories.code_flow_job_repository import CodeFlowJobRepository
+from .repositories.code_flow_repository import CodeFlowRepository
+from .repositories.code_flow_trace_repository import CodeFlowTraceRepository
+from .repositories.user_repository import UserRepository
+from .services.artifact_cache import get_artifact_cache
+from .services.auth_service import AuthService
+from .services.code_flow_service import CodeFlowService
+from .services.crypt_service import get_crypt_service
+from .services.jwt_service import JwtService
+from .services.static_file_service import StaticFileService
+from .services.user_cache import get_user_cache
+from .services.user_service import UserService
+from .storage.artifact_storage import get_artifact_storage
+from .use_cases.store_code_flow_use_case import StoreCodeFlowUseCase
+
+
+class Container:
+    """Repositories, services and the job of the application, built once in its lifespan
+    (or by `scripts.py worker`).
+
+    None of them keeps request state (the replica pinning is a context variable), so the
+    get_* dependencies return these instances instead of building the graph per request.
+    Only the tokens are resolved per request.
+    """
+
+    def __init__(self, database: Database, read_database: Database) -> None:
+        self.database = database
+        self.read_database = read_database
+
+        self.crypt_service = get_crypt_service()
+        self.user_cache = get_user_cache()
+        self.artifact_cache = get_artifact_cache()
+        self.artifact_storage = get_artifact_storage()
+        self.job_event_broker = get_job_event_broker()
+        self.live_traces = get_live_trace_registry()
+
+        self.user_repository = UserRepository(database, read_database)
+        self.code_flow_repository = CodeFlowRepository(database, read_database)
+        self.code_flow_trace_repository = CodeFlowTraceRepository(database, read_database)
+        self.code_flow_job_repository = CodeFlowJobRepository(database)
+        self.code_flow_job_message_repository = CodeFlowJobMessageRepository(database)
+
+        # Runs next to the worker, and in every API process for the workers of the others
+        self.job_relay = JobRelay(
+            database,
+            self.code_flow_job_message_repository,
+            self.job_event_broker,
+            self.live_traces,
+            worker_name(),
+            env.job_relay_poll_interval,
+        )
+        queue = CodeFlowQueue(
+            database,
+            self.code_flow_job_repository,
+            self.code_flow_repository,
+            worker_name(),
+            env.job_poll_interval,
+            env.job_lease_seconds,
+        )
+        self.process_code_flow_job = ProcessCodeFlowJob(
+            self.code_flow_repository,
+            self.code_flow_trace_repository,
+            self.artifact_cache,
+            self.artifact_storage,
+            self.job_relay,
+            self.live_traces,
+            queue,
+        )
+
+        self.user_service = UserService(self.crypt_service, self.user_repository, self.user_cache)
+        self.jwt_service = JwtService(self.user_repository, self.user_cache)
+        self.auth_service = AuthService(self.user_service, self.jwt_service)
+        self.code_flow_service = CodeFlowService(
+            self.code_flow_repository,
+            self.code_flow_trace_repository,
+            self.process_code_flow_job,
+            self.artifact_cache,
+            self.artifact_storage,
+            self.job_event_broker,
+            self.job_relay,
+            self.live_traces,
+        )
+        self.static_file_service = StaticFileService(self.artifact_cache, self.artifact_storage)
+        self.store_code_flow_use_case = StoreCodeFlowUseCase(
+            self.code_flow_repository, self.process_code_flow_job, self.artifact_storage)
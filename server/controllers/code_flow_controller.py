@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, File, UploadFile
+from fastapi import APIRouter, Depends, File, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 
-from ..models import CodeFlowShow, UserRole
-from ..repositories.code_flow_repository import CodeFlowUpdate
+from ..models import CodeFlowBulkResult, CodeFlowChanges, CodeFlowDiff, CodeFlowPage, CodeFlowShow, CodeFlowState, CodeFlowStatus, CodeFlowVariable, CodeFlowVariableHistory, UserRole
+from ..repositories.code_flow_repository import CodeFlowSelection, CodeFlowUpdate
 from ..services.code_flow_service import CodeFlowService, get_code_flow_service
-from ..services.jwt_service import TokenData, get_required_token, get_token, get_token_with_role
+from ..services.jwt_service import TokenData, get_required_token, get_stream_token, get_token, get_token_with_role
 from ..use_cases.store_code_flow_use_case import StoreCodeFlowUseCase, get_store_code_flow_use_case
 
 
@@ -15,6 +16,93 @@ router = APIRouter(
 get_token_with_router_roles = get_token_with_role(UserRole.ADMIN, UserRole.PROFESSOR)
 
 
+def page_response(page: CodeFlowPage) -> Response:
+    # Already serialized, skips the validation of the response model
+    response = Response(page.content, media_type="application/json")
+    if page.next_cursor is not None:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if page.total is not None:
+        response.headers["X-Total-Count"] = str(page.total)
+    return response
+
+
+@router.get("/diff", description="Compare the flows of two code flows")
+async def code_flow_diff(
+    a: int,
+    b: int,
+    service: CodeFlowService = Depends(get_code_flow_service),
+    token: TokenData = Depends(get_required_token),
+) -> CodeFlowDiff:
+    return await service.code_flow_diff(a, b, token.user)
+
+
+@router.get("/search", description="Search code flows by name and owner, best matches first",
+            response_model=List[CodeFlowShow])
+async def code_flow_search(
+    q: str = Query(min_length=3, max_length=200),
+    cursor: Optional[str] = Query(default=None, description="X-Next-Cursor header of the previous page"),
+    limit: int = Query(default=50, ge=1, le=500),
+    total: bool = Query(default=False, description="Count the matching code flows in X-Total-Count"),
+    token: Optional[TokenData] = Depends(get_token),
+    service: CodeFlowService = Depends(get_code_flow_service),
+) -> Response:
+    page = await service.code_flow_search(token.user if token else None, q, cursor, limit, total)
+    return page_response(page)
+
+
+@router.get("/changes", description="Code flows changed since the last sync, without since every visible one",
+            response_model=CodeFlowChanges)
+async def code_flow_changes(
+    since: Optional[str] = Query(default=None, description="next_cursor of the previous sync"),
+    limit: int = Query(default=500, ge=1, le=1000),
+    token: Optional[TokenData] = Depends(get_token),
+    service: CodeFlowService = Depends(get_code_flow_service),
+) -> Response:
+    content = await service.code_flow_changes(token.user if token else None, since, limit)
+    return Response(content, media_type="application/json")
+
+
+@router.get("/events", description="Server-sent events of the job status (queued, running, processed, failed)")
+async def code_flow_events(
+    id: List[int] = Query(default=[], description="Only these code flows, their current status is sent first"),
+    token: Optional[TokenData] = Depends(get_stream_token),
+    service: CodeFlowService = Depends(get_code_flow_service),
+) -> StreamingResponse:
+    return StreamingResponse(
+        service.code_flow_events(token.user if token else None, id),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+
+@router.put("/bulk/visibility", description="Make the selected code flows of the user public or private")
+async def code_flow_bulk_visibility(
+    selection: CodeFlowSelection,
+    private: bool,
+    token: TokenData = Depends(get_token_with_router_roles),
+    service: CodeFlowService = Depends(get_code_flow_service),
+) -> CodeFlowBulkResult:
+    return await service.code_flow_bulk_visibility(token.user, selection, private)
+
+
+@router.post("/bulk/reprocess", description="Process again the selected code flows of the user")
+async def code_flow_bulk_reprocess(
+    selection: CodeFlowSelection,
+    token: TokenData = Depends(get_token_with_router_roles),
+    service: CodeFlowService = Depends(get_code_flow_service),
+) -> CodeFlowBulkResult:
+    return await service.code_flow_bulk_reprocess(token.user, selection)
+
+
+@router.post("/bulk/delete", description="Delete the selected code flows of the user and their files")
+async def code_flow_bulk_delete(
+    selection: CodeFlowSelection,
+    token: TokenData = Depends(get_token_with_router_roles),
+    service: CodeFlowService = Depends(get_code_flow_service),
+) -> CodeFlowBulkResult:
+    return await service.code_flow_bulk_delete(token.user, selection)
+
+
 @router.get("/{id}/", description="Show code and flow files")
 async def code_flow_show(
     id: int,
@@ -24,14 +112,76 @@ async def code_flow_show(
     return await service.code_flow_show(id, token.user)
 
 
-@router.get("/", description="List code and flow files")
+@router.get("/{id}/live", description="Server-sent events of the trace while the program is running")
+async def code_flow_live(
+    id: int,
+    token: Optional[TokenData] = Depends(get_stream_token),
+    service: CodeFlowService = Depends(get_code_flow_service),
+) -> StreamingResponse:
+    return StreamingResponse(
+        await service.code_flow_live(id, token.user if token else None),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+
+@router.get("/{id}/state", description="Show variables and call stack of every process at a flow step")
+async def code_flow_state(
+    id: int,
+    step: int,
+    service: CodeFlowService = Depends(get_code_flow_service),
+    token: TokenData = Depends(get_required_token),
+) -> CodeFlowState:
+    return await service.code_flow_state(id, token.user, step)
+
+
+@router.get("/{id}/variables", description="List variables assigned during a flow")
+async def code_flow_variables(
+    id: int,
+    service: CodeFlowService = Depends(get_code_flow_service),
+    token: TokenData = Depends(get_required_token),
+) -> List[CodeFlowVariable]:
+    return await service.code_flow_variables(id, token.user)
+
+
+@router.get("/{id}/variables/{function}/{name}", description="Show the value timeline of a variable")
+async def code_flow_variable_history(
+    id: int,
+    function: str,
+    name: str,
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+    limit: int = Query(default=1000, ge=1, le=10_000),
+    service: CodeFlowService = Depends(get_code_flow_service),
+    token: TokenData = Depends(get_required_token),
+) -> CodeFlowVariableHistory:
+    return await service.code_flow_variable_history(id, token.user, function, name, cursor, limit)
+
+
+@router.get("/", description="List code and flow files", response_model=List[CodeFlowShow])
 async def code_flow_index(
     public: Optional[bool] = None,
     private: Optional[bool] = None,
+    user_id: Optional[int] = Query(default=None, description="Only the code flows of this owner"),
+    status: Optional[CodeFlowStatus] = None,
+    cursor: Optional[str] = Query(default=None, description="X-Next-Cursor header of the previous page"),
+    limit: int = Query(default=50, ge=1, le=500),
+    descending: bool = False,
+    total: bool = Query(default=False, description="Count the matching code flows in X-Total-Count"),
     token: Optional[TokenData] = Depends(get_token),
     service: CodeFlowService = Depends(get_code_flow_service),
-) -> List[CodeFlowShow]:
-    return await service.code_flow_index(user=token.user if token else None, public=public, private=private)
+) -> Response:
+    page = await service.code_flow_index(
+        user=token.user if token else None,
+        public=public,
+        private=private,
+        owner_id=user_id,
+        status=status,
+        cursor=cursor,
+        limit=limit,
+        descending=descending,
+        total=total,
+    )
+    return page_response(page)
 
 
 @router.post("/", description="Store code and flow files")
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends, Response
+
+from .. import metrics
+from ..repositories.code_flow_job_repository import CodeFlowJobRepository, get_code_flow_job_repository
+
+
+router = APIRouter(
+    include_in_schema=False,
+)
+
+
+@router.get("/metrics")
+async def metrics_show(
+    job_repository: CodeFlowJobRepository = Depends(get_code_flow_job_repository),
+) -> Response:
+    # The queue is shared by every process, it is read from the database
+    metrics.JOB_QUEUE_DEPTH.labels().set(await job_repository.count())
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
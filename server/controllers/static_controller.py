@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, Request, Response
+
+from ..models import UserRole
+from ..services.artifact_cache import ArtifactCache, ArtifactCacheStats, get_artifact_cache
+from ..services.jwt_service import TokenData, get_token_with_role
+from ..services.static_file_service import StaticFileService, get_static_file_service
+
+
+router = APIRouter(
+    prefix="/static",
+    include_in_schema=False,
+)
+
+
+@router.api_route("/files/{file_path:path}", methods=["GET", "HEAD"])
+async def static_file_show(
+    file_path: str,
+    request: Request,
+    service: StaticFileService = Depends(get_static_file_service),
+) -> Response:
+    return await service.static_file_show(file_path, request.headers, request.method)
+
+
+@router.get("/cache")
+async def static_cache_stats(
+    artifact_cache: ArtifactCache = Depends(get_artifact_cache),
+    _: TokenData = Depends(get_token_with_role(UserRole.ADMIN)),
+) -> ArtifactCacheStats:
+    return artifact_cache.stats()
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends
 
 from ..models import UserModel, UserRole
 from ..services.jwt_service import TokenData, get_required_token, get_token_with_role
+from ..services.user_cache import UserCache, UserCacheStats, get_user_cache
 from ..services.user_service import UserService, UserStore, UserUpdateDiff, get_user_service
 
 
@@ -32,3 +33,11 @@ async def user_update(
 @router.get("/me")
 async def user_me(token: TokenData = Depends(get_required_token)) -> UserModel:
     return token.user.redact()
+
+
+@router.get("/cache")
+async def user_cache_stats(
+    user_cache: UserCache = Depends(get_user_cache),
+    _: TokenData = Depends(get_token_with_role(UserRole.ADMIN)),
+) -> UserCacheStats:
+    return user_cache.stats()
@@ -1,13 +1,28 @@
 import asyncio
+import logging
+from contextvars import ContextVar
 from typing import Optional
 from asyncpg import CannotConnectNowError
 from databases import Database
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from ..env import env
+from .sqlite_database import SQLiteDatabase, SQLiteProfile
 
 
-async def connect_to_database() -> Database:
-    database = Database(env.database_url)
+def create_database(url: str) -> Database:
+    if env.database_engine == "sqlite":
+        return SQLiteDatabase(url, SQLiteProfile(
+            read_connections=env.sqlite_read_connections,
+            busy_timeout=env.sqlite_busy_timeout,
+            cache_size=env.sqlite_cache_size,
+            mmap_size=env.sqlite_mmap_size,
+        ))
+    return Database(url)
+
+
+async def connect_to_database(url: str = env.database_url) -> Database:
+    database = create_database(url)
 
     # https://stackoverflow.com/questions/69381579/unable-to-start-fastapi-server-with-postgresql-using-docker-compose
     max_tries = 5
@@ -58,3 +73,55 @@ async def get_database() -> Database:
     return database
 
 
+class ReadDatabaseSingleton:
+    # Connection to the read replica, the primary one when DATABASE_READ_URL is not set
+    instance: Optional[Database] = None
+
+    async def get_instance(self) -> Database:
+        if ReadDatabaseSingleton.instance is not None:
+            return ReadDatabaseSingleton.instance
+        if env.database_read_url and env.database_engine == "sqlite":
+            logging.getLogger(__name__).warning("DATABASE_READ_URL is ignored with SQLite")
+        if env.database_read_url and env.database_engine != "sqlite":
+            ReadDatabaseSingleton.instance = await connect_to_database(env.database_read_url)
+        else:
+            ReadDatabaseSingleton.instance = await DatabaseSingleton().get_instance()
+        return ReadDatabaseSingleton.instance
+
+    async def close_instance(self) -> None:
+        if ReadDatabaseSingleton.instance is not None:
+            if ReadDatabaseSingleton.instance is not DatabaseSingleton.instance:
+                await close_database(ReadDatabaseSingleton.instance)
+            ReadDatabaseSingleton.instance = None
+
+
+async def get_read_database() -> Database:
+    database = await ReadDatabaseSingleton().get_instance()
+    return database
+
+
+# Reads of the current request go to the primary, the replica may not have its writes yet
+_pinned_to_primary: ContextVar[bool] = ContextVar("pinned_to_primary", default=False)
+
+
+def pin_to_primary() -> None:
+    _pinned_to_primary.set(True)
+
+
+def is_pinned_to_primary() -> bool:
+    return _pinned_to_primary.get()
+
+
+class ReadPrimaryMiddleware:
+    """Pins the requests with a truthy X-Read-Primary header to the primary database."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"x-read-primary" and value.lower() in (b"1", b"true", b"yes"):
+                    pin_to_primary()
+                    break
+        await self.app(scope, receive, send)
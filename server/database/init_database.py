@@ -1,19 +1,36 @@
 import logging
 from databases import Database
+from typing import Dict
 
 from ..env import env
 from ..exceptions import AlreadyExistsError, NotFoundError
 from ..models import UserRole
-from ..repositories.user_repository import get_user_repository
+from ..repositories.code_flow_repository import now_ms
+from ..repositories.user_repository import UserRepository
 from ..services.crypt_service import get_crypt_service
-from ..services.user_service import UserUpdateDiff, get_user_service, UserStore
+from ..services.user_cache import get_user_cache
+from ..services.user_service import UserService, UserUpdateDiff, UserStore
 
 logger = logging.getLogger(__name__)
 
+
+async def add_missing_columns(database: Database, table: str, columns: Dict[str, str]) -> None:
+    # CREATE TABLE IF NOT EXISTS keeps old tables as they are, columns added later are created here
+    if env.database_engine == "sqlite":
+        rows = await database.fetch_all(f"PRAGMA table_info({table})")
+        existing = {row["name"] for row in rows}
+        for name, definition in columns.items():
+            if name not in existing:
+                logger.info(f"Adding column {table}.{name}")
+                await database.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    else:
+        for name, definition in columns.items():
+            await database.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} {definition}")
+
+
 async def init_database(database: Database) -> None:
-    crypt_service = get_crypt_service()
-    user_repository = get_user_repository(database)
-    user_service = get_user_service(crypt_service, user_repository)
+    user_repository = UserRepository(database)
+    user_service = UserService(get_crypt_service(), user_repository, get_user_cache())
 
     logger.info("Initializing database")
     await database.execute("SELECT 1")
@@ -39,12 +56,128 @@ async def init_database(database: Database) -> None:
                 user_id INTEGER NOT NULL,
                 private BOOLEAN NOT NULL,
                 flow_error TEXT,
-                input TEXT
+                input TEXT,
+                compact_keep INTEGER,
+                flow_event_count INTEGER,
+                flow_size INTEGER,
+                flow_time_start INTEGER,
+                flow_time_end INTEGER,
+                created_at INTEGER,
+                updated_at INTEGER,
+                processed_at INTEGER
             )""")
+        await add_missing_columns(database, "code_flow", {
+            "compact_keep": "INTEGER",
+            "flow_event_count": "INTEGER",
+            "flow_size": "INTEGER",
+            "flow_time_start": "INTEGER",
+            "flow_time_end": "INTEGER",
+            "created_at": "INTEGER",
+            "updated_at": "INTEGER",
+            "processed_at": "INTEGER",
+        })
         await database.execute(
             """CREATE UNIQUE INDEX IF NOT EXISTS code_flow_unique_idx ON code_flow (user_id, name)""")
         await database.execute(
             """CREATE INDEX IF NOT EXISTS code_flow_private_idx ON code_flow (private)""")
+        # Keyset pagination of the list, see CodeFlowRepository.get_page
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_name_id_idx ON code_flow (name, id)""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_private_name_id_idx ON code_flow (private, name, id)""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_user_name_id_idx ON code_flow (user_id, name, id)""")
+
+        # Delta sync, see CodeFlowRepository.get_changes_records
+        await database.execute(
+            """UPDATE code_flow SET created_at = :now, updated_at = :now WHERE updated_at IS NULL""",
+            {"now": now_ms()})
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_updated_at_idx ON code_flow (updated_at, id)""")
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_tombstone (
+                code_flow_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                private BOOLEAN NOT NULL,
+                deleted_at INTEGER NOT NULL
+            )""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_tombstone_deleted_at_idx ON code_flow_tombstone (deleted_at)""")
+
+        # Queue of ProcessCodeFlowJob, see CodeFlowJobRepository
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_job (
+                code_flow_id INTEGER PRIMARY KEY,
+                queued_at INTEGER NOT NULL,
+                claimed_by TEXT,
+                claimed_at INTEGER
+            )""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_job_queued_at_idx ON code_flow_job (queued_at, code_flow_id)""")
+        # Messages of JobRelay, PostgreSQL sends them as notifications instead
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_job_message (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            )""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_job_message_created_at_idx ON code_flow_job_message (created_at)""")
+
+        # Search over the names of the code flows and their owners, rowid is code_flow.id
+        await database.execute(
+            """CREATE VIRTUAL TABLE IF NOT EXISTS code_flow_search USING fts5(
+                name, username, tokenize = 'trigram'
+            )""")
+        await database.execute(
+            """CREATE TRIGGER IF NOT EXISTS code_flow_search_insert AFTER INSERT ON code_flow BEGIN
+                INSERT INTO code_flow_search (rowid, name, username)
+                VALUES (new.id, new.name, (SELECT username FROM users WHERE id = new.user_id));
+            END""")
+        await database.execute(
+            """CREATE TRIGGER IF NOT EXISTS code_flow_search_update AFTER UPDATE OF name, user_id ON code_flow BEGIN
+                UPDATE code_flow_search
+                SET name = new.name, username = (SELECT username FROM users WHERE id = new.user_id)
+                WHERE rowid = new.id;
+            END""")
+        await database.execute(
+            """CREATE TRIGGER IF NOT EXISTS code_flow_search_delete AFTER DELETE ON code_flow BEGIN
+                DELETE FROM code_flow_search WHERE rowid = old.id;
+            END""")
+        await database.execute(
+            """CREATE TRIGGER IF NOT EXISTS code_flow_search_username AFTER UPDATE OF username ON users BEGIN
+                UPDATE code_flow_search SET username = new.username
+                WHERE rowid IN (SELECT id FROM code_flow WHERE user_id = new.id);
+            END""")
+        # Code flows stored before the search table existed
+        await database.execute(
+            """INSERT INTO code_flow_search (rowid, name, username)
+            SELECT c.id, c.name, u.username
+            FROM code_flow c
+            LEFT JOIN users u ON c.user_id = u.id
+            WHERE c.id NOT IN (SELECT rowid FROM code_flow_search)""")
+
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_checkpoint (
+                code_flow_id INTEGER NOT NULL,
+                step INTEGER NOT NULL,
+                byte_offset INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (code_flow_id, step)
+            )""")
+
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_variable (
+                code_flow_id INTEGER NOT NULL,
+                function TEXT NOT NULL,
+                name TEXT NOT NULL,
+                type TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                byte_offset INTEGER NOT NULL,
+                byte_length INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (code_flow_id, function, name, segment)
+            )""")
     elif env.database_engine == "postgresql":
         await database.execute(
             """CREATE TABLE IF NOT EXISTS users (
@@ -66,12 +199,96 @@ async def init_database(database: Database) -> None:
                 user_id INTEGER NOT NULL,
                 private BOOLEAN NOT NULL,
                 flow_error TEXT,
-                input TEXT
+                input TEXT,
+                compact_keep INTEGER,
+                flow_event_count BIGINT,
+                flow_size BIGINT,
+                flow_time_start BIGINT,
+                flow_time_end BIGINT,
+                created_at BIGINT,
+                updated_at BIGINT,
+                processed_at BIGINT
             )""")
+        await add_missing_columns(database, "code_flow", {
+            "compact_keep": "INTEGER",
+            "flow_event_count": "BIGINT",
+            "flow_size": "BIGINT",
+            "flow_time_start": "BIGINT",
+            "flow_time_end": "BIGINT",
+            "created_at": "BIGINT",
+            "updated_at": "BIGINT",
+            "processed_at": "BIGINT",
+        })
         await database.execute(
             """CREATE UNIQUE INDEX IF NOT EXISTS code_flow_unique_idx ON code_flow (user_id, name)""")
         await database.execute(
             """CREATE INDEX IF NOT EXISTS code_flow_private_idx ON code_flow (private)""")
+        # Keyset pagination of the list, see CodeFlowRepository.get_page
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_name_id_idx ON code_flow (name, id)""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_private_name_id_idx ON code_flow (private, name, id)""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_user_name_id_idx ON code_flow (user_id, name, id)""")
+
+        # Delta sync, see CodeFlowRepository.get_changes_records
+        await database.execute(
+            """UPDATE code_flow SET created_at = :now, updated_at = :now WHERE updated_at IS NULL""",
+            {"now": now_ms()})
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_updated_at_idx ON code_flow (updated_at, id)""")
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_tombstone (
+                code_flow_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                private BOOLEAN NOT NULL,
+                deleted_at BIGINT NOT NULL
+            )""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_tombstone_deleted_at_idx ON code_flow_tombstone (deleted_at)""")
+
+        # Queue of ProcessCodeFlowJob, see CodeFlowJobRepository
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_job (
+                code_flow_id INTEGER PRIMARY KEY,
+                queued_at BIGINT NOT NULL,
+                claimed_by TEXT,
+                claimed_at BIGINT
+            )""")
+        await database.execute(
+            """CREATE INDEX IF NOT EXISTS code_flow_job_queued_at_idx ON code_flow_job (queued_at, code_flow_id)""")
+
+        # Search over the names of the code flows and their owners, the trigram indexes serve ILIKE
+        try:
+            await database.execute("""CREATE EXTENSION IF NOT EXISTS pg_trgm""")
+            await database.execute(
+                """CREATE INDEX IF NOT EXISTS code_flow_name_trgm_idx ON code_flow USING gin (name gin_trgm_ops)""")
+            await database.execute(
+                """CREATE INDEX IF NOT EXISTS user_username_trgm_idx ON users USING gin (username gin_trgm_ops)""")
+        except Exception as e:
+            logger.warning(f"pg_trgm is not available, search falls back to sequential scans: {e}")
+
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_checkpoint (
+                code_flow_id INTEGER NOT NULL,
+                step INTEGER NOT NULL,
+                byte_offset BIGINT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (code_flow_id, step)
+            )""")
+
+        await database.execute(
+            """CREATE TABLE IF NOT EXISTS code_flow_variable (
+                code_flow_id INTEGER NOT NULL,
+                function TEXT NOT NULL,
+                name TEXT NOT NULL,
+                type TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                byte_offset BIGINT NOT NULL,
+                byte_length INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (code_flow_id, function, name, segment)
+            )""")
     else:
         raise Exception("Unknown db_engine: " + env.database_engine)
     
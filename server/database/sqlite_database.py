@@ -0,0 +1,273 @@
+import aiosqlite
+import asyncio
+import logging
+import re
+import sqlite3
+
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from databases import Database
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteRecord(dict):
+    # Same access as the records of `databases`: record["column"], dict(record), record._mapping
+    @property
+    def _mapping(self) -> "SQLiteRecord":
+        return self
+
+
+def _record_factory(cursor: sqlite3.Cursor, row: tuple) -> SQLiteRecord:
+    return SQLiteRecord(zip([column[0] for column in cursor.description], row))
+
+
+class SQLiteProfile:
+    def __init__(self, read_connections: int, busy_timeout: int, cache_size: int, mmap_size: int) -> None:
+        self.read_connections = read_connections
+        self.busy_timeout = busy_timeout  # milliseconds
+        self.cache_size = cache_size  # KiB
+        self.mmap_size = mmap_size  # bytes
+
+    def pragmas(self, read_only: bool) -> List[str]:
+        pragmas = [
+            "PRAGMA journal_mode = WAL",
+            # Durable on checkpoint instead of on every commit, safe with WAL
+            "PRAGMA synchronous = NORMAL",
+            f"PRAGMA busy_timeout = {self.busy_timeout}",
+            f"PRAGMA cache_size = -{self.cache_size}",
+            f"PRAGMA mmap_size = {self.mmap_size}",
+            "PRAGMA temp_store = MEMORY",
+        ]
+        if read_only:
+            pragmas[0] = "PRAGMA query_only = ON"
+        return pragmas
+
+
+class SQLiteDatabase(Database):
+    """`databases.Database` for SQLite with a pool of read connections and a single writer.
+
+    `databases` opens a new SQLite connection (and thread) for every task and leaves every
+    query on it. Here reads (see _is_read) go to one of the read connections, which WAL lets
+    run next to the writer. Any other statement, and everything inside transaction(), waits
+    for the single write connection, so writers queue in the process instead of on
+    SQLITE_BUSY. connection() is the write connection, see SQLiteConnection.
+    """
+
+    def __init__(self, url: str, profile: SQLiteProfile) -> None:
+        super().__init__(url)
+        self.profile = profile
+        self._path = self.url.database
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._reader_count = 0
+        # The task holding the writer, in transaction() or in a connection() block. Tasks
+        # created meanwhile copy the variable, they wait for the writer all the same
+        self._holder: ContextVar[Optional[asyncio.Task]] = ContextVar(f"sqlite_holder_{id(self)}", default=None)
+        self._in_transaction: ContextVar[bool] = ContextVar(f"sqlite_transaction_{id(self)}", default=False)
+
+    async def connect(self) -> None:
+        if self.is_connected:
+            return
+        self._writer = await self._open(read_only=False)
+        # Every connection to an in-memory database is a different database
+        if self._path != ":memory:":
+            for _ in range(self.profile.read_connections):
+                self._readers.put_nowait(await self._open(read_only=True))
+                self._reader_count += 1
+        await super().connect()
+
+    async def disconnect(self) -> None:
+        if not self.is_connected:
+            return
+        while self._reader_count > 0:
+            await (await self._readers.get()).close()
+            self._reader_count -= 1
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+        await super().disconnect()
+
+    async def fetch_all(self, query: Any, values: Optional[dict] = None) -> List[Any]:
+        async with self._connection_for(query) as connection:
+            return await connection.execute_fetchall(query, values or {})
+
+    async def fetch_one(self, query: Any, values: Optional[dict] = None) -> Optional[Any]:
+        async with self._connection_for(query) as connection:
+            async with connection.execute(query, values or {}) as cursor:
+                return await cursor.fetchone()
+
+    async def fetch_val(self, query: Any, values: Optional[dict] = None, column: Any = 0) -> Any:
+        record = await self.fetch_one(query, values)
+        if record is None:
+            return None
+        return record[column] if isinstance(column, str) else list(record.values())[column]
+
+    async def iterate(self, query: Any, values: Optional[dict] = None) -> AsyncGenerator[Any, None]:
+        # The connection is held until the iteration ends, a write through the writer in the
+        # middle of the iteration of another write would wait for itself
+        async with self._connection_for(query) as connection:
+            async with connection.execute(query, values or {}) as cursor:
+                async for record in cursor:
+                    yield record
+
+    async def execute(self, query: Any, values: Optional[dict] = None) -> Any:
+        async with self._connection_for(query, write=True) as connection:
+            async with connection.execute(query, values or {}) as cursor:
+                # The cursor keeps the last inserted rowid of the connection for any statement
+                if _is_insert(query):
+                    return cursor.lastrowid
+                return cursor.rowcount
+
+    async def execute_many(self, query: Any, values: List[Dict[str, Any]]) -> None:
+        async with self._connection_for(query, write=True) as connection:
+            await connection.executemany(query, values)
+
+    @asynccontextmanager
+    async def transaction(self, **_kwargs: Any) -> AsyncIterator[None]:  # type: ignore[override]
+        if self._in_transaction.get() and self._holds_writer():
+            # Nested transactions are part of the outer one
+            yield
+            return
+        async with self._hold_writer() as writer:
+            token = self._in_transaction.set(True)
+            await writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                await writer.execute("ROLLBACK")
+                raise
+            else:
+                await writer.execute("COMMIT")
+            finally:
+                self._in_transaction.reset(token)
+
+    def connection(self) -> "SQLiteConnection":  # type: ignore[override]
+        return SQLiteConnection(self)
+
+    @asynccontextmanager
+    async def _hold_writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        # Re-entrant within a task, its statements run on the writer it already holds
+        if self._holds_writer():
+            assert self._writer is not None, "Database is not connected"
+            yield self._writer
+            return
+        async with self._write_lock:
+            assert self._writer is not None, "Database is not connected"
+            token = self._holder.set(asyncio.current_task())
+            try:
+                yield self._writer
+            finally:
+                self._holder.reset(token)
+
+    def _holds_writer(self) -> bool:
+        holder = self._holder.get()
+        return holder is not None and holder is asyncio.current_task()
+
+    @asynccontextmanager
+    async def _connection_for(self, query: Any, write: bool = False) -> AsyncIterator[aiosqlite.Connection]:
+        if self._holds_writer():
+            assert self._writer is not None, "Database is not connected"
+            yield self._writer
+        elif write or self._reader_count == 0 or not _is_read(query):
+            async with self._write_lock:
+                assert self._writer is not None, "Database is not connected"
+                yield self._writer
+        else:
+            connection = await self._readers.get()
+            try:
+                yield connection
+            finally:
+                self._readers.put_nowait(connection)
+
+    async def _open(self, read_only: bool) -> aiosqlite.Connection:
+        connection = await aiosqlite.connect(
+            self._path,
+            isolation_level=None,
+            timeout=self.profile.busy_timeout / 1000,
+            check_same_thread=False,
+        )
+        connection.row_factory = _record_factory
+        for pragma in self.profile.pragmas(read_only):
+            await connection.execute(pragma)
+        return connection
+
+
+class SQLiteConnection:
+    """connection() of SQLiteDatabase, the single write connection.
+
+    An `async with` block holds it, every statement of the block (reads too) runs on it and
+    other writers wait for the block to end. Outside of a block each statement waits for the
+    writer on its own.
+    """
+
+    def __init__(self, database: SQLiteDatabase) -> None:
+        self.database = database
+        self._holds: List[Any] = []
+
+    async def __aenter__(self) -> "SQLiteConnection":
+        hold = self.database._hold_writer()
+        await hold.__aenter__()
+        self._holds.append(hold)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self._holds.pop().__aexit__(*exc_info)
+
+    async def fetch_all(self, query: Any, values: Optional[dict] = None) -> List[Any]:
+        async with self.database._hold_writer():
+            return await self.database.fetch_all(query, values)
+
+    async def fetch_one(self, query: Any, values: Optional[dict] = None) -> Optional[Any]:
+        async with self.database._hold_writer():
+            return await self.database.fetch_one(query, values)
+
+    async def fetch_val(self, query: Any, values: Optional[dict] = None, column: Any = 0) -> Any:
+        async with self.database._hold_writer():
+            return await self.database.fetch_val(query, values, column)
+
+    async def iterate(self, query: Any, values: Optional[dict] = None) -> AsyncGenerator[Any, None]:
+        async with self.database._hold_writer():
+            async for record in self.database.iterate(query, values):
+                yield record
+
+    async def execute(self, query: Any, values: Optional[dict] = None) -> Any:
+        async with self.database._hold_writer():
+            return await self.database.execute(query, values)
+
+    async def execute_many(self, query: Any, values: List[Dict[str, Any]]) -> None:
+        async with self.database._hold_writer():
+            await self.database.execute_many(query, values)
+
+    def transaction(self, **kwargs: Any) -> Any:
+        return self.database.transaction(**kwargs)
+
+    @property
+    def raw_connection(self) -> aiosqlite.Connection:
+        # Only safe inside an `async with` block of this connection
+        assert self.database._writer is not None, "Database is not connected"
+        return self.database._writer
+
+
+_WRITE_KEYWORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+def _first_keyword(query: Any) -> str:
+    return str(query).lstrip().split(None, 1)[0].upper()
+
+
+def _is_read(query: Any) -> bool:
+    # EXPLAIN never writes. A WITH is a read unless its statement writes, any of these words
+    # in it (even in a literal) sends it to the writer, which can run anything. PRAGMA goes
+    # to the writer too, many of them change the database or the connection.
+    keyword = _first_keyword(query)
+    if keyword == "WITH":
+        return _WRITE_KEYWORDS.search(str(query)) is None
+    return keyword in ("SELECT", "EXPLAIN")
+
+
+def _is_insert(query: Any) -> bool:
+    return _first_keyword(query) in ("INSERT", "REPLACE")
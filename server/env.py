@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 import os
 import dotenv
 
@@ -9,10 +10,41 @@ class Env(BaseModel):
     c_runner_url: str
     database_engine: str
     database_url: str
+    database_read_url: Optional[str]
+    sqlite_read_connections: int
+    sqlite_busy_timeout: int
+    sqlite_cache_size: int
+    sqlite_mmap_size: int
     admin_password: str
     jwt_secret: str
     jwt_expires_in: int
     jwt_refresh_expires_in: int
+    user_cache_size: int
+    user_cache_ttl_seconds: float
+    crypt_workers: int
+    crypt_queue_size: int
+    trace_checkpoint_interval: int
+    trace_max_bytes: int
+    trace_merge_seconds: float
+    trace_live_stream: bool
+    live_trace_buffer_events: int
+    live_trace_queue_size: int
+    artifact_cache_size: int
+    artifact_cache_max_entry_size: int
+    artifact_encodings: str
+    artifact_storage: str
+    artifact_gc_interval: float
+    artifact_gc_batch_size: int
+    artifact_gc_grace_seconds: float
+    artifact_gc_pause_seconds: float
+    change_settle_ms: int
+    change_retention_days: int
+    job_events_queue_size: int
+    job_events_keepalive_seconds: float
+    job_embedded_worker: bool
+    job_poll_interval: float
+    job_lease_seconds: float
+    job_relay_poll_interval: float
 
 
 dotenv.load_dotenv()
@@ -21,8 +53,39 @@ env = Env(
     database_engine = os.environ.get("DATABASE_ENGINE", "sqlite"),
     database_url=os.environ.get(
         'DATABASE_URL', "sqlite+aiosqlite:///" + str(Resources.DATABASE)),
+    database_read_url=os.environ.get('DATABASE_READ_URL') or None, # PostgreSQL read replica
+    sqlite_read_connections = int(os.environ.get("SQLITE_READ_CONNECTIONS", 4)),
+    sqlite_busy_timeout = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)), # milliseconds
+    sqlite_cache_size = int(os.environ.get("SQLITE_CACHE_SIZE", 64 * 1024)), # KiB per connection
+    sqlite_mmap_size = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)), # 256 MiB
     admin_password=os.environ.get("ADMIN_PASSWORD", "admin"),
     jwt_secret = os.environ.get("JWT_SECRET", "secret"),
     jwt_expires_in = int(os.environ.get("JWT_EXPIRES_IN", 1 * 60 * 60 * 1000)), # 1 hour
     jwt_refresh_expires_in = int(os.environ.get("JWT_REFRESH_EXPIRES_IN", 7 * 24 * 60 * 60 * 1000)), # 7 days
+    user_cache_size = int(os.environ.get("USER_CACHE_SIZE", 1024)), # users resolved from tokens, 0 disables it
+    user_cache_ttl_seconds = float(os.environ.get("USER_CACHE_TTL_SECONDS", 10)), # staleness across workers
+    crypt_workers = int(os.environ.get("CRYPT_WORKERS", min(4, os.cpu_count() or 1))), # bcrypt threads, 0 runs it on the event loop
+    crypt_queue_size = int(os.environ.get("CRYPT_QUEUE_SIZE", 16)), # waiting bcrypt calls, more get 503
+    trace_checkpoint_interval = int(os.environ.get("TRACE_CHECKPOINT_INTERVAL", 1000)), # events
+    trace_max_bytes = int(os.environ.get("TRACE_MAX_BYTES", 256 * 1024 * 1024)), # 256 MiB
+    trace_merge_seconds = float(os.environ.get("TRACE_MERGE_SECONDS", 5)),
+    trace_live_stream = os.environ.get("TRACE_LIVE_STREAM", "false").lower() == "true", # the runner sends the raw trace twice, falls back to /v1/run on older runners, set it on the workers too
+    live_trace_buffer_events = int(os.environ.get("LIVE_TRACE_BUFFER_EVENTS", 10000)), # replayed to late subscribers
+    live_trace_queue_size = int(os.environ.get("LIVE_TRACE_QUEUE_SIZE", 64)), # batches per subscriber
+    artifact_cache_size = int(os.environ.get("ARTIFACT_CACHE_SIZE", 64 * 1024 * 1024)), # 64 MiB
+    artifact_cache_max_entry_size = int(os.environ.get("ARTIFACT_CACHE_MAX_ENTRY_SIZE", 4 * 1024 * 1024)), # 4 MiB
+    artifact_encodings = os.environ.get("ARTIFACT_ENCODINGS", "br,zstd,gzip"), # only the installed ones are used
+    artifact_storage = os.environ.get("ARTIFACT_STORAGE", "flat"), # flat | sharded, see scripts.py storage-migrate
+    artifact_gc_interval = float(os.environ.get("ARTIFACT_GC_INTERVAL", 0)), # seconds between sweeps, 0 disables it (see scripts.py artifact-gc)
+    artifact_gc_batch_size = int(os.environ.get("ARTIFACT_GC_BATCH_SIZE", 500)), # files per query
+    artifact_gc_grace_seconds = float(os.environ.get("ARTIFACT_GC_GRACE_SECONDS", 60 * 60)), # 1 hour
+    artifact_gc_pause_seconds = float(os.environ.get("ARTIFACT_GC_PAUSE_SECONDS", 0.1)), # between batches
+    change_settle_ms = int(os.environ.get("CHANGE_SETTLE_MS", 1000)), # newer changes wait for the next sync
+    change_retention_days = int(os.environ.get("CHANGE_RETENTION_DAYS", 30)), # older sync cursors start over
+    job_events_queue_size = int(os.environ.get("JOB_EVENTS_QUEUE_SIZE", 256)), # per subscriber
+    job_events_keepalive_seconds = float(os.environ.get("JOB_EVENTS_KEEPALIVE_SECONDS", 15)),
+    job_embedded_worker = os.environ.get("JOB_EMBEDDED_WORKER", "true").lower() == "true", # false when `scripts.py worker` runs the jobs
+    job_poll_interval = float(os.environ.get("JOB_POLL_INTERVAL", 1)), # seconds, SQLite has no LISTEN/NOTIFY
+    job_lease_seconds = float(os.environ.get("JOB_LEASE_SECONDS", 10 * 60)), # claims of dead workers expire after it
+    job_relay_poll_interval = float(os.environ.get("JOB_RELAY_POLL_INTERVAL", 0.5)), # seconds, events of the other processes on SQLite
 )
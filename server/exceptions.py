@@ -27,6 +27,10 @@ class UnexpectedError(DomainError):
     status_code = 500
 
 
+class ServiceUnavailableError(DomainError):
+    status_code = 503
+
+
 def domain_error_handler(_request: Request, exc: DomainError) -> Response:
     return Response(status_code=exc.status_code, content=json.dumps(
         {"message": str(exc)}), media_type="application/json")
@@ -0,0 +1,109 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import Dict, List, Tuple
+
+from ..env import env
+from ..repositories.code_flow_repository import CodeFlowRepository
+from ..storage.artifact_storage import ArtifactStorage
+
+
+class ArtifactGcReport(BaseModel):
+    scanned: int = 0
+    deleted: int = 0
+    reclaimed_bytes: int = 0
+    batches: int = 0
+
+
+class ArtifactGcJob:
+    """Deletes artifacts whose file id has no code_flow row.
+
+    The storage is walked in batches, each one costs a single query and is followed by a
+    pause so a sweep does not compete with requests. Files younger than the grace period
+    are skipped, they may belong to an upload that has not been inserted yet.
+    """
+
+    def __init__(
+        self,
+        repository: CodeFlowRepository,
+        storage: ArtifactStorage,
+        batch_size: int = env.artifact_gc_batch_size,
+        grace_seconds: float = env.artifact_gc_grace_seconds,
+        pause_seconds: float = env.artifact_gc_pause_seconds,
+        dry_run: bool = False,
+    ) -> None:
+        self.repository = repository
+        self.storage = storage
+        self.batch_size = batch_size
+        self.grace_seconds = grace_seconds
+        self.pause_seconds = pause_seconds
+        self.dry_run = dry_run
+        self.logger = logging.getLogger(__name__)
+
+    async def sweep(self) -> ArtifactGcReport:
+        report = ArtifactGcReport()
+        # Only one batch of names is in memory, the listing goes on after each batch. Files
+        # deleted meanwhile may or may not be listed, _delete skips the missing ones.
+        names = self.storage.iter_names()
+        try:
+            while batch := await run_in_threadpool(lambda: list(itertools.islice(names, self.batch_size))):
+                if report.batches > 0:
+                    await asyncio.sleep(self.pause_seconds)
+                await self._sweep_batch(batch, report)
+        finally:
+            names.close()
+        self.logger.info(
+            f"Artifact GC: scanned {report.scanned}, deleted {report.deleted}, "
+            f"reclaimed {report.reclaimed_bytes} bytes")
+        return report
+
+    async def _sweep_batch(self, batch: List[str], report: ArtifactGcReport) -> None:
+        by_file_id: Dict[str, List[str]] = {}
+        for name in batch:
+            by_file_id.setdefault(name.split("_", 1)[0], []).append(name)
+        existing = await self.repository.get_existing_file_ids(list(by_file_id))
+
+        orphans = [
+            name
+            for file_id, names in by_file_id.items()
+            for name in names
+            # Temporary files of an interrupted compression are orphans even if the flow exists
+            if file_id not in existing or name.endswith(".tmp")
+        ]
+        deleted, reclaimed = await run_in_threadpool(lambda: self._delete(orphans))
+        report.scanned += len(batch)
+        report.deleted += deleted
+        report.reclaimed_bytes += reclaimed
+        report.batches += 1
+
+    def _delete(self, names: List[str]) -> Tuple[int, int]:
+        deleted = 0
+        reclaimed = 0
+        threshold = time.time() - self.grace_seconds
+        for name in names:
+            try:
+                stat_result = os.stat(self.storage.path(name))
+            except FileNotFoundError:
+                continue
+            if stat_result.st_mtime > threshold:
+                continue
+            if not self.dry_run:
+                self.storage.delete(name)
+            deleted += 1
+            reclaimed += stat_result.st_size
+        return deleted, reclaimed
+
+
+async def run_artifact_gc_periodically(job: ArtifactGcJob, interval: float) -> None:
+    logger = logging.getLogger(__name__)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job.sweep()
+        except Exception as e:
+            logger.error(f"Artifact GC failed: {e}")
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+import socket
+
+from databases import Database
+from typing import Any
+
+from ..env import env
+from ..models import CodeFlowModel
+from ..repositories.code_flow_job_repository import CODE_FLOW_JOB_CHANNEL, CodeFlowJobRepository
+from ..repositories.code_flow_repository import CodeFlowRepository
+
+
+# Seconds between claims while listening, they only pick up expired claims and lost notifications
+LISTEN_POLL_INTERVAL = 30
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class CodeFlowQueue:
+    """Code flows to process, shared by the API and the workers through the database.
+
+    On PostgreSQL the workers wake up on the notification sent with every queued job, on
+    SQLite they poll every `poll_interval` seconds. Jobs queued by this process wake its
+    own worker right away.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        job_repository: CodeFlowJobRepository,
+        repository: CodeFlowRepository,
+        worker: str,
+        poll_interval: float,
+        lease_seconds: float,
+    ) -> None:
+        self.database = database
+        self.job_repository = job_repository
+        self.repository = repository
+        self.worker = worker
+        self.poll_interval = poll_interval
+        self.lease_ms = int(lease_seconds * 1000)
+        self.listening = False
+        self.logger = logging.getLogger(__name__)
+        self._wake = asyncio.Event()
+
+    async def put(self, data: CodeFlowModel) -> None:
+        await self.job_repository.enqueue(data.id)
+        self._wake.set()
+
+    async def get(self) -> CodeFlowModel:
+        while True:
+            self._wake.clear()
+            id = await self.job_repository.claim(self.worker, self.lease_ms)
+            if id is not None:
+                data = await self.repository.get_by_id(id)
+                if data is not None:
+                    return data
+                # Deleted after it was queued
+                await self.job_repository.complete(id, self.worker)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), LISTEN_POLL_INTERVAL if self.listening else self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def task_done(self, data: CodeFlowModel) -> None:
+        await self.job_repository.complete(data.id, self.worker)
+
+    async def is_claimed(self, code_flow_id: int) -> bool:
+        # By a live worker of any process
+        return await self.job_repository.is_claimed(code_flow_id, self.lease_ms)
+
+    async def listen(self) -> None:
+        if env.database_engine != "postgresql":
+            return
+        # Keeps one connection of the pool while the worker runs
+        async with self.database.connection() as connection:
+            raw_connection = connection.raw_connection
+            await raw_connection.add_listener(CODE_FLOW_JOB_CHANNEL, self._notified)
+            self.listening = True
+            self.logger.info(f"Listening on {CODE_FLOW_JOB_CHANNEL}")
+            try:
+                await asyncio.Event().wait()
+            finally:
+                self.listening = False
+                await raw_connection.remove_listener(CODE_FLOW_JOB_CHANNEL, self._notified)
+
+    def _notified(self, *_args: Any) -> None:
+        self._wake.set()
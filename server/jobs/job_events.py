@@ -0,0 +1,71 @@
+import asyncio
+
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Set
+
+from ..env import env
+from ..models import CodeFlowJobEvent
+
+
+class JobEventSubscription:
+    def __init__(self, accept: Callable[[CodeFlowJobEvent], bool], queue_size: int) -> None:
+        self.accept = accept
+        self.queue: "asyncio.Queue[CodeFlowJobEvent]" = asyncio.Queue(queue_size)
+        # Set when events were dropped, the subscriber has to read the state again
+        self.lagged = False
+
+    def put(self, event: CodeFlowJobEvent) -> None:
+        if not self.accept(event):
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.lagged = True
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> Optional[CodeFlowJobEvent]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class JobEventBroker:
+    """In-process pub/sub of the status transitions of ProcessCodeFlowJob.
+
+    publish() never waits: every subscriber has a bounded queue and a slow one loses its
+    oldest events instead of slowing down the job.
+    """
+
+    def __init__(self, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self._subscriptions: Set[JobEventSubscription] = set()
+
+    def publish(self, event: CodeFlowJobEvent) -> None:
+        for subscription in list(self._subscriptions):
+            subscription.put(event)
+
+    @contextmanager
+    def subscribe(self, accept: Callable[[CodeFlowJobEvent], bool]) -> Iterator[JobEventSubscription]:
+        subscription = JobEventSubscription(accept, self.queue_size)
+        self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscriptions)
+
+
+class JobEventBrokerSingleton:
+    instance: Optional[JobEventBroker] = None
+
+    def get_instance(self) -> JobEventBroker:
+        if JobEventBrokerSingleton.instance is None:
+            JobEventBrokerSingleton.instance = JobEventBroker(env.job_events_queue_size)
+        return JobEventBrokerSingleton.instance
+
+
+def get_job_event_broker() -> JobEventBroker:
+    return JobEventBrokerSingleton().get_instance()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import orjson
+
+from databases import Database
+from typing import Any, Dict, List
+
+from ..env import env
+from ..models import CodeFlowJobEvent
+from ..repositories.code_flow_job_message_repository import CODE_FLOW_JOB_MESSAGE_CHANNEL, CodeFlowJobMessageRepository
+from ..repositories.code_flow_repository import now_ms
+from ..traces.trace_reader import TraceEvent
+from .job_events import JobEventBroker
+from .live_trace import LiveTrace, LiveTraceRegistry
+
+
+# PostgreSQL rejects notifications of 8000 bytes or more, larger batches of live events are
+# split and longer flow errors cut
+MAX_MESSAGE_BYTES = 7900
+
+# Rows read per query, and how long they stay in code_flow_job_message, on SQLite
+POLL_BATCH_SIZE = 500
+MESSAGE_RETENTION_MS = 60 * 1000
+
+
+class JobRelay:
+    """Job status events and live traces between the processes sharing the database, the
+    API processes and the workers of `scripts.py worker`.
+
+    Every process publishes the transitions of its own jobs to its JobEventBroker and to the
+    others, which publish them to theirs. The events of a live trace only leave the worker
+    while another process watches it (see LiveTrace.watch), that process mirrors the run in
+    its LiveTraceRegistry.
+
+    The messages are notifications on PostgreSQL and rows polled every `poll_interval`
+    seconds on SQLite.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        repository: CodeFlowJobMessageRepository,
+        event_broker: JobEventBroker,
+        live_traces: LiveTraceRegistry,
+        origin: str,
+        poll_interval: float,
+    ) -> None:
+        self.database = database
+        self.repository = repository
+        self.event_broker = event_broker
+        self.live_traces = live_traces
+        self.origin = origin
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+
+    async def publish(self, event: CodeFlowJobEvent) -> None:
+        self.event_broker.publish(event)
+        data = event.model_dump(mode="json")
+        payload = self._encode({"type": "status", "event": data})
+        error = event.flow_error
+        while len(payload) > MAX_MESSAGE_BYTES and error:
+            error = error[:len(error) // 2]
+            payload = self._encode({"type": "status", "event": {**data, "flow_error": error + "..."}})
+        await self._send(payload)
+
+    async def publish_live(self, code_flow_id: int, events: List[TraceEvent]) -> None:
+        # The events are encoded once, the messages are built around them
+        prefix = b'{"type":"live","origin":%s,"code_flow_id":%d,"skipped":' % (orjson.dumps(self.origin), code_flow_id)
+        room = MAX_MESSAGE_BYTES - len(prefix) - len(b'%d,"events":[]}' % len(events))
+        chunk: List[bytes] = []
+        size = 0
+        skipped = 0
+        for event in events:
+            encoded = orjson.dumps(event)
+            if len(encoded) > room:
+                skipped += 1
+                continue
+            if size + len(encoded) > room:
+                await self._send(b'%s0,"events":[%s]}' % (prefix, b",".join(chunk)))
+                chunk, size = [], 0
+            chunk.append(encoded)
+            size += len(encoded) + 1
+        if chunk or skipped:
+            await self._send(b'%s%d,"events":[%s]}' % (prefix, skipped, b",".join(chunk)))
+
+    async def finish_live(self, code_flow_id: int) -> None:
+        await self._send(self._encode({"type": "live_end", "code_flow_id": code_flow_id}))
+
+    async def watch_live(self, code_flow_id: int) -> None:
+        await self._send(self._encode({"type": "watch", "code_flow_id": code_flow_id}))
+
+    def _encode(self, message: Dict[str, Any]) -> bytes:
+        return orjson.dumps({**message, "origin": self.origin})
+
+    async def _send(self, payload: bytes) -> None:
+        # The job goes on, the other processes only miss the message
+        try:
+            await self.repository.send(payload.decode())
+        except Exception as e:
+            self.logger.warning(f"Could not relay a message: {e}")
+
+    async def run(self) -> None:
+        if env.database_engine == "postgresql":
+            await self._listen()
+        else:
+            await self._poll()
+
+    async def _listen(self) -> None:
+        # Keeps one connection of the pool while the process runs
+        async with self.database.connection() as connection:
+            raw_connection = connection.raw_connection
+            await raw_connection.add_listener(CODE_FLOW_JOB_MESSAGE_CHANNEL, self._notified)
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await raw_connection.remove_listener(CODE_FLOW_JOB_MESSAGE_CHANNEL, self._notified)
+
+    def _notified(self, _connection: Any, _pid: int, _channel: str, payload: str) -> None:
+        self._received(payload)
+
+    async def _poll(self) -> None:
+        after = None
+        pruned_at = 0
+        while True:
+            try:
+                if after is None:
+                    # Only the messages sent after this process started
+                    after = await self.repository.get_last_id()
+                rows = await self.repository.get_after(after, POLL_BATCH_SIZE)
+                for row in rows:
+                    after = row["id"]
+                    self._received(row["payload"])
+                now = now_ms()
+                if now - pruned_at > MESSAGE_RETENTION_MS:
+                    pruned_at = now
+                    await self.repository.prune(now - MESSAGE_RETENTION_MS)
+            except Exception as e:
+                self.logger.error(f"Could not read the relayed messages: {e}")
+                rows = []
+            if len(rows) < POLL_BATCH_SIZE:
+                await asyncio.sleep(self.poll_interval)
+
+    def _received(self, payload: str) -> None:
+        try:
+            message = orjson.loads(payload)
+            if message["origin"] == self.origin:
+                return
+            if message["type"] == "status":
+                self.event_broker.publish(CodeFlowJobEvent.model_validate(message["event"]))
+                return
+            live = self.live_traces.get(message["code_flow_id"])
+            if live is not None:
+                self._received_live(live, message)
+        except Exception as e:
+            self.logger.warning(f"Invalid relayed message: {e}")
+
+    def _received_live(self, live: LiveTrace, message: Dict[str, Any]) -> None:
+        type = message["type"]
+        if type == "watch" and not live.remote:
+            live.watch()
+        elif type == "live" and live.remote:
+            if message["skipped"]:
+                live.skip(message["skipped"])
+            if message["events"]:
+                live.publish(message["events"])
+        elif type == "live_end" and live.remote:
+            self.live_traces.finish(live)
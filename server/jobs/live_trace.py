@@ -0,0 +1,162 @@
+import asyncio
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Set, Union
+
+from ..env import env
+from ..traces.trace_reader import TraceEvent
+
+
+class LiveTraceEnd:
+    pass
+
+
+END = LiveTraceEnd()
+
+LiveTraceItem = Union[List[TraceEvent], LiveTraceEnd]
+
+# Start of the frames of events of the runner (events_frame in its api.py), the frames are
+# skipped without decoding them while nobody subscribes
+EVENTS_FRAME_PREFIX = b'{"type": "events"'
+
+# Seconds a worker relays the events of a run to the other processes after their last watch
+# message, they send one every third of it while somebody subscribes (see JobRelay)
+LIVE_WATCH_SECONDS = 15
+
+
+class LiveTraceSubscription:
+    def __init__(self, queue_size: int, replay: List[TraceEvent], skipped: Optional[int]) -> None:
+        self.queue: "asyncio.Queue[LiveTraceItem]" = asyncio.Queue(queue_size)
+        # Recent events of the run when subscribing, and how many came before them (None when
+        # some were skipped unread, see LiveTrace.drained)
+        self.replay = replay
+        self.skipped = skipped
+        # Events of batches dropped because the subscriber did not keep up
+        self.dropped = 0
+
+    def put(self, item: LiveTraceItem) -> None:
+        if self.queue.full():
+            oldest = self.queue.get_nowait()
+            if not isinstance(oldest, LiveTraceEnd):
+                self.dropped += len(oldest)
+        self.queue.put_nowait(item)
+
+    async def get(self, timeout: float) -> Optional[LiveTraceItem]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LiveTrace:
+    """Events of a run still in progress, as they arrive from the runner.
+
+    Only the last `buffer_events` are kept for subscribers that join late, the complete
+    trace is the file persisted when the run ends.
+
+    A remote trace mirrors a run of another process, JobRelay feeds it while it is watched.
+    """
+
+    def __init__(self, code_flow_id: int, buffer_events: int, queue_size: int, remote: bool = False) -> None:
+        self.code_flow_id = code_flow_id
+        self.queue_size = queue_size
+        self.remote = remote
+        self.recent: Deque[TraceEvent] = deque(maxlen=buffer_events)
+        self.total = 0
+        self.finished = False
+        # Frames were skipped unread while nobody subscribed, `total` is a lower bound
+        self.drained = remote
+        # time.monotonic() until which other processes watch the run, and of the next watch
+        # message of a remote trace
+        self.watched_until = 0.0
+        self.next_watch = 0.0
+        self._subscriptions: Set[LiveTraceSubscription] = set()
+
+    @property
+    def subscribed(self) -> bool:
+        return bool(self._subscriptions) or self.watched
+
+    @property
+    def watched(self) -> bool:
+        return time.monotonic() < self.watched_until
+
+    def watch(self) -> None:
+        self.watched_until = time.monotonic() + LIVE_WATCH_SECONDS
+
+    def watch_due(self) -> bool:
+        now = time.monotonic()
+        if now < self.next_watch:
+            return False
+        self.next_watch = now + LIVE_WATCH_SECONDS / 3
+        return True
+
+    def publish(self, events: List[TraceEvent]) -> None:
+        self.recent.extend(events)
+        self.total += len(events)
+        for subscription in self._subscriptions:
+            subscription.put(events)
+
+    def skip(self, count: int) -> None:
+        # Events of the run that never reached this process
+        for subscription in self._subscriptions:
+            subscription.dropped += count
+
+    def finish(self) -> None:
+        self.finished = True
+        for subscription in self._subscriptions:
+            subscription.put(END)
+
+    @contextmanager
+    def subscribe(self) -> Iterator[LiveTraceSubscription]:
+        skipped = None if self.drained else self.total - len(self.recent)
+        subscription = LiveTraceSubscription(self.queue_size, list(self.recent), skipped)
+        if self.finished:
+            subscription.put(END)
+        self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions.discard(subscription)
+
+
+class LiveTraceRegistry:
+    def __init__(self, buffer_events: int, queue_size: int) -> None:
+        self.buffer_events = buffer_events
+        self.queue_size = queue_size
+        self._traces: Dict[int, LiveTrace] = {}
+
+    def start(self, code_flow_id: int) -> LiveTrace:
+        live = LiveTrace(code_flow_id, self.buffer_events, self.queue_size)
+        self._traces[code_flow_id] = live
+        return live
+
+    def finish(self, live: LiveTrace) -> None:
+        live.finish()
+        if self._traces.get(live.code_flow_id) is live:
+            del self._traces[live.code_flow_id]
+
+    def mirror(self, code_flow_id: int) -> LiveTrace:
+        live = self._traces.get(code_flow_id)
+        if live is None:
+            live = LiveTrace(code_flow_id, self.buffer_events, self.queue_size, remote=True)
+            self._traces[code_flow_id] = live
+        return live
+
+    def get(self, code_flow_id: int) -> Optional[LiveTrace]:
+        return self._traces.get(code_flow_id)
+
+
+class LiveTraceRegistrySingleton:
+    instance: Optional[LiveTraceRegistry] = None
+
+    def get_instance(self) -> LiveTraceRegistry:
+        if LiveTraceRegistrySingleton.instance is None:
+            LiveTraceRegistrySingleton.instance = LiveTraceRegistry(
+                env.live_trace_buffer_events, env.live_trace_queue_size)
+        return LiveTraceRegistrySingleton.instance
+
+
+def get_live_trace_registry() -> LiveTraceRegistry:
+    return LiveTraceRegistrySingleton().get_instance()
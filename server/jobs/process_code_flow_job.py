@@ -1,110 +1,235 @@
+import anyio
 import asyncio
 import logging
+import orjson
 import requests
+import time
 
 from fastapi.concurrency import run_in_threadpool
 
-from fastapi import BackgroundTasks, Depends
+from fastapi import Request
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, List, Optional, Tuple
 
+from .. import metrics
+from ..database.connection import pin_to_primary
 from ..env import env
-from ..models import CodeFlowModel
-from ..repositories.code_flow_repository import CodeFlowRepository, get_code_flow_repository
-from ..resources import Resources
+from ..models import CodeFlowCheckpoint, CodeFlowJobEvent, CodeFlowJobStatus, CodeFlowModel
+from ..repositories.code_flow_repository import CodeFlowRepository
+from ..repositories.code_flow_trace_repository import CodeFlowTraceRepository
+from ..services.artifact_cache import ArtifactCache
+from ..services.artifact_compression import compress_artifact, remove_compressed_artifacts
+from ..storage.artifact_storage import ArtifactStorage
+from ..traces.trace_indexer import index_trace
+from ..traces.trace_reader import TraceFormatError
+from .code_flow_queue import CodeFlowQueue
+from .job_relay import JobRelay
+from .live_trace import EVENTS_FRAME_PREFIX, LiveTrace, LiveTraceRegistry
 
 
-CodeFlowQueue = asyncio.Queue[CodeFlowModel]
+# Requests to the runner, it answers or ends the run within the timeout of the body
+RUNNER_CONNECT_SECONDS = 10
+RUNNER_READ_MARGIN_SECONDS = 30
+
+
+def runner_timeout(body: Any) -> Tuple[float, float]:
+    # The stream is silent while the program prints nothing, up to the whole run
+    return RUNNER_CONNECT_SECONDS, body["timeout"] + RUNNER_READ_MARGIN_SECONDS
 
 
 class ProcessCodeFlowJob:
-    def __init__(self, repository: CodeFlowRepository, queue: CodeFlowQueue):
+    def __init__(
+        self,
+        repository: CodeFlowRepository,
+        trace_repository: CodeFlowTraceRepository,
+        artifact_cache: ArtifactCache,
+        artifact_storage: ArtifactStorage,
+        relay: JobRelay,
+        live_traces: LiveTraceRegistry,
+        queue: CodeFlowQueue,
+    ):
         self.repository = repository
+        self.trace_repository = trace_repository
+        self.artifact_cache = artifact_cache
+        self.artifact_storage = artifact_storage
+        self.relay = relay
+        self.live_traces = live_traces
         self.logger = logging.getLogger(__name__)
         self.queue = queue
+        # Id of the code flow being processed
+        self.running: Optional[int] = None
         self.logger.info("ProcessCodeFlowJob initialized")
 
-    def create_job(self, data: CodeFlowModel) -> None:
+    async def create_job(self, data: CodeFlowModel) -> None:
         self.logger.info(f"Creating job for {data.name}")
-        self.queue.put_nowait(data)
+        await self.queue.put(data)
+        await self._publish(data, CodeFlowJobStatus.QUEUED)
+
+    async def is_running(self, code_flow_id: int) -> bool:
+        # Here or in another process
+        return self.running == code_flow_id or await self.queue.is_claimed(code_flow_id)
+
+    async def _publish(self, data: CodeFlowModel, status: CodeFlowJobStatus, **kwargs: Any) -> None:
+        await self.relay.publish(CodeFlowJobEvent(
+            code_flow_id=data.id, user_id=data.user_id, private=data.private, status=status, **kwargs))
 
-    async def _update_flow_error(self, data: CodeFlowModel, e: Any) -> None:
+    async def _update_flow_error(self, data: CodeFlowModel, e: Any) -> CodeFlowJobStatus:
         self.logger.error(f"Error processing {data.name}: {e}")
+        await self.trace_repository.delete(data.id)
         await self.repository.update_processed(data.id, str(e))
-
-    async def process(self, data: CodeFlowModel) -> None:
-        flow_path = Path(data.flow_path).name
-        cmd = ['sh', './run.sh', flow_path]
+        await self._publish(data, CodeFlowJobStatus.FAILED, flow_error=str(e))
+        return CodeFlowJobStatus.FAILED
+
+    async def process(self, data: CodeFlowModel) -> CodeFlowJobStatus:
+        flow_name = Path(data.flow_path).name
+        flow_path = self.artifact_storage.path(flow_name)
+        # The runner mounts the storage root, it gets the path relative to it
+        cmd = ['sh', './run.sh', str(self.artifact_storage.relative_path(flow_name)),
+               '--max-bytes', str(env.trace_max_bytes),
+               '--max-seconds', str(env.trace_merge_seconds)]
+        if data.compact_keep is not None:
+            cmd += ['--compact-keep', str(data.compact_keep)]
         self.logger.info(f"Processing {data.name}")
+        await self._publish(data, CodeFlowJobStatus.RUNNING)
+        remove_compressed_artifacts(flow_path)
         try:
-            # https://stackoverflow.com/questions/67599119/fastapi-asynchronous-background-tasks-blocks-other-requests
-            response = await run_in_threadpool(lambda: requests.post(f'{env.c_runner_url}/v1/run', json={
+            body = {
                 "cmd": cmd,
                 "stdin": data.input,
                 "timeout": 10,
-            }))
-            if response.status_code != 200:
-                await self._update_flow_error(data, response)
-                return
-
-            result = response.json()
+            }
+            start = time.perf_counter()
+            result = await self._run_live(data, body) if env.trace_live_stream else None
+            if result is not None:
+                metrics.RUNNER_REQUEST_DURATION.labels("/v1/run/stream").observe(time.perf_counter() - start)
+            else:
+                start = time.perf_counter()
+                # https://stackoverflow.com/questions/67599119/fastapi-asynchronous-background-tasks-blocks-other-requests
+                response = await run_in_threadpool(lambda: requests.post(
+                    f'{env.c_runner_url}/v1/run', json=body, timeout=runner_timeout(body)))
+                metrics.RUNNER_REQUEST_DURATION.labels("/v1/run").observe(time.perf_counter() - start)
+                if response.status_code != 200:
+                    return await self._update_flow_error(data, response)
+
+                result = response.json()
 
             if result is None:
-                await self._update_flow_error(data, f"""ERROR: 'result' is None""")
-                return
+                return await self._update_flow_error(data, f"""ERROR: 'result' is None""")
 
             if result["ok"] is None and result["error"] is None:
-                await self._update_flow_error(data, f"""ERROR: 'result["ok"]' is None and result["error"] is None""")
-                return
+                return await self._update_flow_error(data, f"""ERROR: 'result["ok"]' is None and result["error"] is None""")
 
             if result["error"] is not None:
-                await self._update_flow_error(data, f"""ERROR: {result["error"]}""")
-                return
+                return await self._update_flow_error(data, f"""ERROR: {result["error"]}""")
 
             if result['ok']['returncode'] != 0:
-                await self._update_flow_error(data, f"""OK ERROR: STDOUT:\n{result['ok']['stdout']}\nSTDERR:\n{result['ok']['stderr']}""")
-                return
+                return await self._update_flow_error(data, f"""OK ERROR: STDOUT:\n{result['ok']['stdout']}\nSTDERR:\n{result['ok']['stderr']}""")
+
+            if not self.artifact_storage.exists(flow_name):
+                return await self._update_flow_error(data, f"EXTERNAL: Flow file not generated")
 
-            if not (Resources.FILES / flow_path).exists():
-                await self._update_flow_error(data, f"EXTERNAL: Flow file not generated")
-                return
+            variables_name = Path(data.variables_path).name
+            variables_path = self.artifact_storage.path(variables_name)
+            # The checkpoints are written while the trace is read, the code flow is not
+            # processed meanwhile so nobody seeks through the partial index
+            await self.trace_repository.delete(data.id)
+
+            def write_checkpoints(checkpoints: List[CodeFlowCheckpoint]) -> None:
+                anyio.from_thread.run(self.trace_repository.insert_checkpoints, data.id, checkpoints)
+
+            try:
+                index = await run_in_threadpool(
+                    lambda: index_trace(flow_path, variables_path, env.trace_checkpoint_interval, write_checkpoints))
+                await self.trace_repository.insert_variables(data.id, index.variables)
+            except TraceFormatError as e:
+                # _update_flow_error deletes the partial checkpoints, the variables file goes here
+                self.artifact_storage.delete(variables_name)
+                return await self._update_flow_error(data, f"TRACE: {e}")
+            except (OSError, KeyError) as e:
+                self.artifact_storage.delete(variables_name)
+                return await self._update_flow_error(data, f"INDEX: {e}")
+            try:
+                await run_in_threadpool(lambda: compress_artifact(flow_path))
+            except OSError as e:
+                # Precompressed variants are optional, the static route falls back to the artifact
+                self.logger.warning(f"Could not compress {data.name}: {e}")
 
         except requests.exceptions.RequestException as e:
-            await self._update_flow_error(data, f"REQUEST: {e}")
-            return
+            return await self._update_flow_error(data, f"REQUEST: {e}")
+        except TraceFormatError as e:
+            return await self._update_flow_error(data, f"TRACE: {e}")
+
+        self.logger.info(f"Complete {data.name}: {index.stats.event_count} events")
+        await self.repository.update_processed(data.id, stats=index.stats)
+        await self._publish(data, CodeFlowJobStatus.PROCESSED, flow_event_count=index.stats.event_count)
+        return CodeFlowJobStatus.PROCESSED
+
+    async def _run_live(self, data: CodeFlowModel, body: Any) -> Optional[Any]:
+        # Same result as /v1/run, the events are published while the program runs.
+        # None when the runner has no streaming endpoint.
+        live = self.live_traces.start(data.id)
+        try:
+            return await run_in_threadpool(lambda: self._read_live(live, body))
+        finally:
+            self.live_traces.finish(live)
+            if live.watched_until:
+                await self.relay.finish_live(data.id)
+
+    def _read_live(self, live: LiveTrace, body: Any) -> Optional[Any]:
+        with requests.post(
+                f'{env.c_runner_url}/v1/run/stream', json=body, stream=True, timeout=runner_timeout(body)) as response:
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            for line in response.iter_lines(chunk_size=64 * 1024):
+                if not line:
+                    continue
+                if not live.subscribed and line.startswith(EVENTS_FRAME_PREFIX):
+                    live.drained = True
+                    continue
+                try:
+                    frame = orjson.loads(line)
+                except orjson.JSONDecodeError as e:
+                    raise TraceFormatError(f"Invalid live frame: {e}")
+                if frame["type"] == "events":
+                    # Waits for the event loop, so a busy API reads slower and the runner tail pauses
+                    anyio.from_thread.run_sync(live.publish, frame["events"])
+                    if live.watched:
+                        anyio.from_thread.run(self.relay.publish_live, live.code_flow_id, frame["events"])
+                elif frame["type"] == "result":
+                    return frame["result"]
+        raise requests.exceptions.RequestException("Run stream ended without a result")
 
-        self.logger.info(f"Complete {data.name}")
-        await self.repository.update_processed(data.id)
-    
     async def run(self) -> None:
-        while True:
-            data = await self.queue.get()
-            try:
-                await self.process(data)
-            except Exception as e:
-                self.logger.error(f"Unknown error {data.name}: {e}")
-            self.queue.task_done()
-
-
-class ProcessCodeFlowJobSingleton:
-    instance: Optional[ProcessCodeFlowJob] = None
-
-    async def get_instance(self, repository: CodeFlowRepository, background_tasks: BackgroundTasks) -> ProcessCodeFlowJob:
-        if ProcessCodeFlowJobSingleton.instance is not None:
-            return ProcessCodeFlowJobSingleton.instance
-        # First
-        queue: CodeFlowQueue = asyncio.Queue()
-        job = ProcessCodeFlowJob(repository, queue)
-        background_tasks.add_task(job.run)
-        # data = await job.repository.get_all_unprocessed_and_failed()
-        # for item in data:
-        #     job.create_job(item)
-        ProcessCodeFlowJobSingleton.instance = job
-        return ProcessCodeFlowJobSingleton.instance
-
-
-async def get_process_code_flow_job(
-    background_tasks: BackgroundTasks,
-    code_flow_repository: CodeFlowRepository = Depends(get_code_flow_repository),
-) -> ProcessCodeFlowJob:
-    return await ProcessCodeFlowJobSingleton().get_instance(code_flow_repository, background_tasks)
+        # The claimed code flows are read from the primary, the replica may not have them yet
+        pin_to_primary()
+        listener = asyncio.create_task(self.queue.listen())
+        try:
+            while True:
+                try:
+                    data = await self.queue.get()
+                except Exception as e:
+                    self.logger.error(f"Could not claim a job: {e}")
+                    await asyncio.sleep(self.queue.poll_interval)
+                    continue
+                self.running = data.id
+                start = time.perf_counter()
+                try:
+                    outcome = (await self.process(data)).value
+                except Exception as e:
+                    self.logger.error(f"Unknown error {data.name}: {e}")
+                    outcome = "error"
+                metrics.JOB_DURATION.labels(outcome).observe(time.perf_counter() - start)
+                self.running = None
+                self.artifact_cache.invalidate(data.file_id)
+                try:
+                    await self.queue.task_done(data)
+                except Exception as e:
+                    # The claim expires and the code flow is processed again
+                    self.logger.error(f"Could not complete the job of {data.name}: {e}")
+        finally:
+            listener.cancel()
+
+
+async def get_process_code_flow_job(request: Request) -> ProcessCodeFlowJob:
+    return request.app.state.container.process_code_flow_job
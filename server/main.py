@@ -1,19 +1,19 @@
+import asyncio
 from contextlib import asynccontextmanager
 import logging
 from typing import AsyncGenerator
-from fastapi import FastAPI, Response
+from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from mimetypes import guess_type
-
 import server.controllers.auth_controller
 import server.controllers.code_flow_controller
+import server.controllers.metrics_controller
+import server.controllers.static_controller
 import server.controllers.user_controller
 import server.exceptions
-
-from server.resources import Resources
-from server.exceptions import NotFoundError
+from server.database.connection import ReadPrimaryMiddleware
+from server.metrics import MetricsMiddleware
 
 logging.basicConfig(level=logging.INFO,
                     format="%(levelname)s: [%(asctime)s] %(name)s: %(message)s")
@@ -21,15 +21,35 @@ logging.basicConfig(level=logging.INFO,
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator:
+    from server.container import Container
     from server.database.init_database import init_database
-    from server.database.connection import DatabaseSingleton
+    from server.database.connection import DatabaseSingleton, ReadDatabaseSingleton
+    from server.env import env
+    from server.jobs.artifact_gc_job import ArtifactGcJob, run_artifact_gc_periodically
 
     database = DatabaseSingleton()
     connection = await database.get_instance()
     await init_database(connection)
+    container = Container(connection, await ReadDatabaseSingleton().get_instance())
+    app.state.container = container
+    job_relay = asyncio.create_task(container.job_relay.run())
+    process_code_flow = None
+    if env.job_embedded_worker:
+        process_code_flow = asyncio.create_task(container.process_code_flow_job.run())
+
+    artifact_gc = None
+    if env.artifact_gc_interval > 0:
+        job = ArtifactGcJob(container.code_flow_repository, container.artifact_storage)
+        artifact_gc = asyncio.create_task(run_artifact_gc_periodically(job, env.artifact_gc_interval))
 
     yield
 
+    job_relay.cancel()
+    if process_code_flow is not None:
+        process_code_flow.cancel()
+    if artifact_gc is not None:
+        artifact_gc.cancel()
+    await ReadDatabaseSingleton().close_instance()
     await database.close_instance()
 
 
@@ -41,8 +61,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
+app.add_middleware(ReadPrimaryMiddleware)
+
+# Outermost, the latency includes the other middlewares
+app.add_middleware(MetricsMiddleware)
+
 server.exceptions.configure(app)
 
 
@@ -51,20 +77,8 @@ def read_root():
     return RedirectResponse(url="/docs")
 
 
-@app.get("/static/files/{file_path:path}", include_in_schema=False)
-def read_static_file(file_path: str) -> Response:
-    # https://stackoverflow.com/questions/62455652/how-to-serve-static-files-in-fastapi
-    full_path = Resources.FILES / file_path
-    if not full_path.exists():
-        raise NotFoundError(f"File {file_path} not found")
-
-    with open(full_path) as f:
-        content = f.read()
-
-    content_type, _ = guess_type(full_path)
-    return Response(content, media_type=content_type)
-
-
 app.include_router(server.controllers.auth_controller.router)
 app.include_router(server.controllers.code_flow_controller.router)
+app.include_router(server.controllers.metrics_controller.router)
+app.include_router(server.controllers.static_controller.router)
 app.include_router(server.controllers.user_controller.router)
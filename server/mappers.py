@@ -1,6 +1,8 @@
+import orjson
+
 from databases.interfaces import Record
-from typing import List
-from server.models import CodeFlowIndex, CodeFlowModel, CodeFlowShow
+from typing import Any, Dict, List
+from server.models import CodeFlowCheckpoint, CodeFlowIndex, CodeFlowModel, CodeFlowShow, CodeFlowVariable, CodeFlowVariableSegment
 
 
 class CodeFlowShowMapper:
@@ -16,7 +18,15 @@ class CodeFlowShowMapper:
             user_id=model.user_id,
             private=model.private,
             flow_error=model.flow_error,
-            input=model.input
+            input=model.input,
+            compact_keep=model.compact_keep,
+            flow_event_count=model.flow_event_count,
+            flow_size=model.flow_size,
+            flow_time_start=model.flow_time_start,
+            flow_time_end=model.flow_time_end,
+            created_at=model.created_at,
+            updated_at=model.updated_at,
+            processed_at=model.processed_at,
         )
 
     @staticmethod
@@ -32,13 +42,53 @@ class CodeFlowShowMapper:
             private=model.private,
             flow_error=model.flow_error,
             input=model.input,
-            username=model.username
+            username=model.username,
+            compact_keep=model.compact_keep,
+            flow_event_count=model.flow_event_count,
+            flow_size=model.flow_size,
+            flow_time_start=model.flow_time_start,
+            flow_time_end=model.flow_time_end,
+            created_at=model.created_at,
+            updated_at=model.updated_at,
+            processed_at=model.processed_at,
         )
     
     @staticmethod
     def from_all_indexes(models: List[CodeFlowIndex]) -> List[CodeFlowShow]:
         return [CodeFlowShowMapper.from_index(model) for model in models]
 
+    @staticmethod
+    def json_from_records(records: List[Record]) -> bytes:
+        # Fast path of the lists, rows are serialized to a JSON array of CodeFlowShow without
+        # building any model. Needs the columns of CodeFlowRepository.LIST_COLUMNS
+        return orjson.dumps(CodeFlowShowMapper.dicts_from_records(records))
+
+    @staticmethod
+    def dicts_from_records(records: List[Record]) -> List[Dict[str, Any]]:
+        rows = [record._mapping for record in records]
+        return [{
+            "id": row["id"],
+            "name": row["name"],
+            "code_path": f"/static/files/{row['file_id']}_o.c",
+            "transform_path": f"/static/files/{row['file_id']}_t.c",
+            "flow_path": f"/static/files/{row['file_id']}_t.json",
+            # SQLite returns booleans as integers
+            "processed": bool(row["processed"]),
+            "user_id": row["user_id"],
+            "private": bool(row["private"]),
+            "flow_error": row["flow_error"],
+            "input": row["input"],
+            "username": row["username"],
+            "compact_keep": row["compact_keep"],
+            "flow_event_count": row["flow_event_count"],
+            "flow_size": row["flow_size"],
+            "flow_time_start": row["flow_time_start"],
+            "flow_time_end": row["flow_time_end"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "processed_at": row["processed_at"],
+        } for row in rows]
+
 
 class CodeFlowMapper:
     @staticmethod
@@ -64,3 +114,39 @@ class CodeFlowIndexMapper:
     @staticmethod
     def from_all_records(records: List[Record]) -> List[CodeFlowIndex]:
         return [CodeFlowIndexMapper.from_record(record) for record in records]
+
+
+class CodeFlowCheckpointMapper:
+    @staticmethod
+    def from_record(record: Record) -> CodeFlowCheckpoint:
+        return CodeFlowCheckpoint(
+            step=record["step"],
+            byte_offset=record["byte_offset"],
+            state=orjson.loads(record["state"]),
+        )
+
+    @staticmethod
+    def from_record_(record: Record | None) -> CodeFlowCheckpoint | None:
+        if record is None:
+            return None
+        return CodeFlowCheckpointMapper.from_record(record)
+
+
+class CodeFlowVariableMapper:
+    @staticmethod
+    def from_record(record: Record) -> CodeFlowVariable:
+        return CodeFlowVariable(**dict(record))
+
+    @staticmethod
+    def from_all_records(records: List[Record]) -> List[CodeFlowVariable]:
+        return [CodeFlowVariableMapper.from_record(record) for record in records]
+
+
+class CodeFlowVariableSegmentMapper:
+    @staticmethod
+    def from_record(record: Record) -> CodeFlowVariableSegment:
+        return CodeFlowVariableSegment(**dict(record))
+
+    @staticmethod
+    def from_all_records(records: List[Record]) -> List[CodeFlowVariableSegment]:
+        return [CodeFlowVariableSegmentMapper.from_record(record) for record in records]
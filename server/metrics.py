@@ -0,0 +1,228 @@
+import functools
+import inspect
+import time
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Any, Callable, Dict, Generic, List, Sequence, Tuple, TypeVar
+
+
+# Prometheus text exposition format (Starlette adds the charset),
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds, from a cached query to a long run of the runner
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = buckets
+        # One more for +Inf, the counts are made cumulative when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+V = TypeVar("V", CounterValue, GaugeValue, HistogramValue)
+
+
+class Metric(ABC, Generic[V]):
+    """A metric and its values by label values.
+
+    Values are plain attributes updated from the event loop, the code running in the
+    threadpool reports its timings once it is back on the loop.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], V] = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values: str) -> V:
+        value = self._values.get(values)
+        if value is None:
+            assert len(values) == len(self.label_names), f"{self.name} takes labels {self.label_names}"
+            value = self._values[values] = self._new_value()
+        return value
+
+    @abstractmethod
+    def _new_value(self) -> V:
+        pass
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in self._values.items():
+            lines += self._render_value(self._label_pairs(values), value)
+        return lines
+
+    def _render_value(self, pairs: List[str], value: V) -> List[str]:
+        return [f"{self.name}{_labels(pairs)} {_number(value.value)}"]  # type: ignore[union-attr]
+
+    def _label_pairs(self, values: Tuple[str, ...]) -> List[str]:
+        return [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, values)]
+
+
+class Counter(Metric[CounterValue]):
+    kind = "counter"
+
+    def _new_value(self) -> CounterValue:
+        return CounterValue()
+
+
+class Gauge(Metric[GaugeValue]):
+    kind = "gauge"
+
+    def _new_value(self) -> GaugeValue:
+        return GaugeValue()
+
+
+class Histogram(Metric[HistogramValue]):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_value(self) -> HistogramValue:
+        return HistogramValue(self.buckets)
+
+    def _render_value(self, pairs: List[str], value: HistogramValue) -> List[str]:
+        lines = []
+        count = 0
+        for bound, bucket_count in zip([*map(_number, self.buckets), "+Inf"], value.counts):
+            count += bucket_count
+            le = f'le="{bound}"'
+            lines.append(f"{self.name}_bucket{_labels([*pairs, le])} {count}")
+        lines.append(f"{self.name}_sum{_labels(pairs)} {_number(value.sum)}")
+        lines.append(f"{self.name}_count{_labels(pairs)} {count}")
+        return lines
+
+
+REGISTRY: List[Metric] = []
+
+
+def render() -> bytes:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _labels(pairs: List[str]) -> str:
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to respond to HTTP requests, streams included",
+    ["method", "route", "status"])
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests being handled")
+JOB_QUEUE_DEPTH = Gauge(
+    "code_flow_job_queue_depth", "Code flows queued or being processed, read when scraped")
+JOB_DURATION = Histogram(
+    "code_flow_job_duration_seconds", "Time to process a code flow", ["outcome"])
+RUNNER_REQUEST_DURATION = Histogram(
+    "runner_request_duration_seconds", "Time of the runs of the C runner that got a response", ["endpoint"])
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Time of the repository methods", ["repository", "method"])
+STATIC_BYTES_SENT = Counter(
+    "static_bytes_sent_total", "Bytes of artifacts sent by the static routes", ["source", "encoding"])
+
+
+class MetricsMiddleware:
+    """Records the latency of the HTTP requests by route template, not by path."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels()
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            # The router leaves the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
+
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def _timed(repository: str, method: str, func: F) -> F:
+    histogram = DB_QUERY_DURATION.labels(repository, method)
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def instrument_repository(repository: str) -> Callable[[type], type]:
+    """Class decorator timing the public async methods of a repository."""
+
+    def decorate(cls: type) -> type:
+        for name, func in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.iscoroutinefunction(func):
+                setattr(cls, name, _timed(repository, name, func))
+        return cls
+
+    return decorate
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 
 
@@ -12,6 +12,14 @@ class CodeFlowModel(BaseModel):
     private: bool
     flow_error: Optional[str]
     input: Optional[str]
+    compact_keep: Optional[int] = None
+    flow_event_count: Optional[int] = None
+    flow_size: Optional[int] = None
+    flow_time_start: Optional[int] = None
+    flow_time_end: Optional[int] = None
+    created_at: Optional[int] = None
+    updated_at: Optional[int] = None
+    processed_at: Optional[int] = None
 
     @property
     def code_path(self):
@@ -25,6 +33,10 @@ class CodeFlowModel(BaseModel):
     def flow_path(self):
         return f'/static/files/{self.file_id}_t.json'
 
+    @property
+    def variables_path(self):
+        return f'/static/files/{self.file_id}_v.jsonl'
+
 
 class CodeFlowIndex(CodeFlowModel):
     username: Optional[str] = None
@@ -42,11 +54,154 @@ class CodeFlowShow(BaseModel):
     flow_error: Optional[str]
     input: Optional[str]
     username: Optional[str] = None
+    compact_keep: Optional[int] = None
+    flow_event_count: Optional[int] = None
+    flow_size: Optional[int] = None
+    flow_time_start: Optional[int] = None
+    flow_time_end: Optional[int] = None
+    created_at: Optional[int] = None
+    updated_at: Optional[int] = None
+    processed_at: Optional[int] = None
 
     class Config():
         from_attributes = True
 
 
+class CodeFlowStatus(str, Enum):
+    PENDING = "pending"
+    PROCESSED = "processed"
+    FAILED = "failed"
+
+
+class CodeFlowJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    PROCESSED = "processed"
+    FAILED = "failed"
+
+
+class CodeFlowJobEvent(BaseModel):
+    code_flow_id: int
+    user_id: int
+    private: bool
+    status: CodeFlowJobStatus
+    flow_error: Optional[str] = None
+    flow_event_count: Optional[int] = None
+
+
+class CodeFlowPage(BaseModel):
+    # JSON array of CodeFlowShow
+    content: bytes
+    # Opaque, None on the last page
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+class CodeFlowChanges(BaseModel):
+    # Changed code flows, and the ids of the ones deleted or no longer visible to the user
+    changed: List[CodeFlowShow]
+    deleted: List[int]
+    # Opaque, the since of the next sync
+    next_cursor: str
+    has_more: bool
+
+
+class CodeFlowBulkResult(BaseModel):
+    # Changed code flows, and the requested ids that do not exist or are not owned by the user
+    ids: List[int]
+    missing: List[int] = []
+
+
+class CodeFlowStats(BaseModel):
+    event_count: int = 0
+    size: int = 0
+    # Microseconds since epoch of the first and last events
+    time_start: Optional[int] = None
+    time_end: Optional[int] = None
+
+
+class TraceVariable(BaseModel):
+    type: str
+    value: Any
+
+
+class TraceFrame(BaseModel):
+    function: str
+    line: int
+    variables: Dict[str, TraceVariable]
+
+
+class CodeFlowCheckpoint(BaseModel):
+    step: int
+    byte_offset: int
+    state: Dict[str, List[Dict[str, Any]]]
+
+
+class CodeFlowState(BaseModel):
+    step: int
+    event: Dict[str, Any]
+    processes: Dict[str, List[TraceFrame]]
+
+
+class TraceDivergence(BaseModel):
+    kind: str
+    a_step: int
+    b_step: int
+    a_event: Optional[Dict[str, Any]]
+    b_event: Optional[Dict[str, Any]]
+
+
+class TraceDiffHunk(BaseModel):
+    a_start: int
+    a_count: int
+    b_start: int
+    b_count: int
+
+
+class CodeFlowDiff(BaseModel):
+    a: int
+    b: int
+    a_events: int
+    b_events: int
+    matched_events: int
+    value_differences: int
+    identical: bool
+    first_divergence: Optional[TraceDivergence]
+    hunk_count: int
+    hunks: List[TraceDiffHunk]
+
+
+class CodeFlowVariableSegment(BaseModel):
+    function: str
+    name: str
+    type: str
+    segment: int
+    byte_offset: int
+    byte_length: int
+    count: int
+
+
+class CodeFlowVariable(BaseModel):
+    function: str
+    name: str
+    type: str
+    count: int
+
+
+class VariableHistoryEntry(BaseModel):
+    step: int
+    line: int
+    pid: int
+    value: Any
+
+
+class CodeFlowVariableHistory(CodeFlowVariable):
+    # One page of the timeline, count is the length of the whole timeline
+    history: List[VariableHistoryEntry]
+    # Opaque, None on the last page
+    next_cursor: Optional[str] = None
+
+
 class UserRole(str, Enum):
     ADMIN = "admin"
     PROFESSOR = "professor"
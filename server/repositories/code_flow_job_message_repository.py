@@ -0,0 +1,49 @@
+from databases import Database
+from fastapi import Request
+from typing import Any, List, Optional
+
+from ..env import env
+from ..metrics import instrument_repository
+from .code_flow_repository import now_ms
+
+
+# Channel of the PostgreSQL notifications carrying the messages of JobRelay
+CODE_FLOW_JOB_MESSAGE_CHANNEL = "code_flow_job_message"
+
+
+@instrument_repository("code_flow_job_message")
+class CodeFlowJobMessageRepository:
+    """Messages between the processes sharing the database, see JobRelay.
+
+    PostgreSQL sends them as notifications, SQLite keeps them in code_flow_job_message for the
+    other processes to poll until they are pruned.
+    """
+
+    def __init__(self, db: Database) -> None:
+        self.db = db
+
+    async def send(self, payload: str) -> None:
+        if env.database_engine == "postgresql":
+            await self.db.execute(
+                """SELECT pg_notify(:channel, :payload)""",
+                {"channel": CODE_FLOW_JOB_MESSAGE_CHANNEL, "payload": payload})
+        else:
+            await self.db.execute(
+                """INSERT INTO code_flow_job_message (created_at, payload) VALUES (:now, :payload)""",
+                {"now": now_ms(), "payload": payload})
+
+    async def get_last_id(self) -> int:
+        return await self.db.fetch_val("""SELECT COALESCE(MAX(id), 0) FROM code_flow_job_message""")
+
+    async def get_after(self, after: int, limit: int) -> List[Any]:
+        return await self.db.fetch_all(
+            """SELECT id, payload FROM code_flow_job_message WHERE id > :after ORDER BY id ASC LIMIT :limit""",
+            {"after": after, "limit": limit})
+
+    async def prune(self, before_ms: int) -> Optional[int]:
+        return await self.db.execute(
+            """DELETE FROM code_flow_job_message WHERE created_at < :before""", {"before": before_ms})
+
+
+async def get_code_flow_job_message_repository(request: Request) -> CodeFlowJobMessageRepository:
+    return request.app.state.container.code_flow_job_message_repository
@@ -0,0 +1,70 @@
+from databases import Database
+from fastapi import Request
+from typing import Optional
+
+from ..env import env
+from ..metrics import instrument_repository
+from .code_flow_repository import now_ms
+
+
+# Channel of the PostgreSQL notifications sent when a job is queued
+CODE_FLOW_JOB_CHANNEL = "code_flow_job"
+
+
+@instrument_repository("code_flow_job")
+class CodeFlowJobRepository:
+    """Code flows waiting for ProcessCodeFlowJob, one row per code flow.
+
+    A worker claims a row while it processes the code flow and deletes it when done. Claims
+    older than the lease belong to workers that died, other workers claim them again.
+    """
+
+    def __init__(self, db: Database) -> None:
+        self.db = db
+
+    async def enqueue(self, code_flow_id: int) -> None:
+        # Queuing a claimed code flow again releases the claim, it is processed once more
+        await self.db.execute("""
+            INSERT INTO code_flow_job (code_flow_id, queued_at, claimed_by, claimed_at)
+            VALUES (:code_flow_id, :now, NULL, NULL)
+            ON CONFLICT (code_flow_id) DO UPDATE
+            SET queued_at = excluded.queued_at, claimed_by = NULL, claimed_at = NULL
+        """, {"code_flow_id": code_flow_id, "now": now_ms()})
+        if env.database_engine == "postgresql":
+            await self.db.execute(f"NOTIFY {CODE_FLOW_JOB_CHANNEL}")
+
+    async def claim(self, worker: str, lease_ms: int) -> Optional[int]:
+        now = now_ms()
+        # SQLite runs one write at a time, PostgreSQL workers skip the rows others are claiming
+        lock = " FOR UPDATE SKIP LOCKED" if env.database_engine == "postgresql" else ""
+        query = f"""
+            UPDATE code_flow_job SET claimed_by = :worker, claimed_at = :now
+            WHERE code_flow_id = (
+                SELECT code_flow_id FROM code_flow_job
+                WHERE claimed_at IS NULL OR claimed_at < :expired
+                ORDER BY queued_at ASC, code_flow_id ASC
+                LIMIT 1{lock}
+            )
+            RETURNING code_flow_id
+        """
+        data = await self.db.fetch_one(query, {"worker": worker, "now": now, "expired": now - lease_ms})
+        return None if data is None else data["code_flow_id"]
+
+    async def complete(self, code_flow_id: int, worker: str) -> None:
+        # Nothing is deleted when the code flow was queued again meanwhile
+        await self.db.execute(
+            """DELETE FROM code_flow_job WHERE code_flow_id = :code_flow_id AND claimed_by = :worker""",
+            {"code_flow_id": code_flow_id, "worker": worker})
+
+    async def is_claimed(self, code_flow_id: int, lease_ms: int) -> bool:
+        data = await self.db.fetch_one(
+            """SELECT 1 FROM code_flow_job WHERE code_flow_id = :code_flow_id AND claimed_at >= :expired""",
+            {"code_flow_id": code_flow_id, "expired": now_ms() - lease_ms})
+        return data is not None
+
+    async def count(self) -> int:
+        return await self.db.fetch_val("""SELECT COUNT(*) FROM code_flow_job""")
+
+
+async def get_code_flow_job_repository(request: Request) -> CodeFlowJobRepository:
+    return request.app.state.container.code_flow_job_repository
@@ -1,11 +1,16 @@
+import time
+
 from databases import Database
-from fastapi import Depends
-from pydantic import BaseModel
-from typing import List, Optional
+from databases.interfaces import Record
+from fastapi import Request
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-from ..database.connection import get_database
-from ..models import CodeFlowIndex, CodeFlowModel
-from ..mappers import CodeFlowIndexMapper, CodeFlowMapper
+from ..env import env
+from ..database.connection import is_pinned_to_primary
+from ..metrics import instrument_repository
+from ..models import CodeFlowModel, CodeFlowStats, CodeFlowStatus
+from ..mappers import CodeFlowMapper
 
 
 class CodeFlowInsert(BaseModel):
@@ -19,71 +24,311 @@ class CodeFlowUpdate(BaseModel):
     processed: Optional[bool] = None
     private: Optional[bool] = None
     input: Optional[str] = None
+    # Loop iterations kept verbatim at both ends of a compacted loop, None disables compaction
+    compact_keep: Optional[int] = Field(default=None, ge=0)
+
+
+class CodeFlowFilter(BaseModel):
+    public: bool = True
+    # Private code flows of this user are included too
+    private_user_id: Optional[int] = None
+    owner_id: Optional[int] = None
+    status: Optional[CodeFlowStatus] = None
+
+
+class CodeFlowSelection(BaseModel):
+    # Code flows of one owner, by id and/or by filter. An empty selection matches nothing
+    ids: Optional[List[int]] = Field(default=None, max_length=1000)
+    status: Optional[CodeFlowStatus] = None
+    private: Optional[bool] = None
+    name_prefix: Optional[str] = Field(default=None, min_length=1)
+
+
+class CodeFlowCursor(BaseModel):
+    name: str
+    id: int
+
+
+class CodeFlowChangeCursor(BaseModel):
+    updated_at: int
+    id: int
+
+
+# code_flow.id is a SERIAL, an int4 on PostgreSQL
+MAX_CODE_FLOW_ID = 2 ** 31 - 1
 
 
+def now_ms() -> int:
+    # Timestamps of the code flows, milliseconds since epoch
+    return time.time_ns() // 1_000_000
+
+
+@instrument_repository("code_flow")
 class CodeFlowRepository:
-    def __init__(self, db: Database) -> None:
+    # Columns of CodeFlowShow, see CodeFlowShowMapper.json_from_records
+    LIST_COLUMNS = """
+        c.id, c.name, c.file_id, c.processed, c.user_id, c.private, c.flow_error, c.input,
+        c.compact_keep, c.flow_event_count, c.flow_size, c.flow_time_start, c.flow_time_end,
+        c.created_at, c.updated_at, c.processed_at, u.username AS username
+    """
+
+    def __init__(self, db: Database, read_db: Optional[Database] = None) -> None:
         self.db = db
+        self.read_db = read_db or db
     
-    async def insert(self, data: CodeFlowInsert) -> int:
-        return await self.db.execute("""
-            INSERT INTO code_flow (name, file_id, processed, flow_error, user_id, private, input)
-            VALUES (:name, :file_id, TRUE, 'You need to run', :user_id, TRUE, NULL)
-            RETURNING id
-        """, data.model_dump())
-
-    async def update(self, id: int, data: CodeFlowUpdate) -> bool:
+    async def insert(self, data: CodeFlowInsert) -> CodeFlowModel:
+        data = await self.db.fetch_one("""
+            INSERT INTO code_flow (name, file_id, processed, flow_error, user_id, private, input, created_at, updated_at)
+            VALUES (:name, :file_id, TRUE, 'You need to run', :user_id, TRUE, NULL, :now, :now)
+            RETURNING *
+        """, {**data.model_dump(), "now": now_ms()})
+        return CodeFlowMapper.from_record(data)
+
+    async def update(self, id: int, data: CodeFlowUpdate, user_id: Optional[int] = None) -> CodeFlowModel | None:
+        # Returns the updated row, None when no row matches (or nothing to update)
         values = data.model_dump(exclude_unset=True)
         if not values:
-            return False
+            return None
         query = """UPDATE code_flow SET """
         query += ", ".join([f"{key} = :{key}" for key in values])
+        query += ", updated_at = :updated_at"
+        values["updated_at"] = now_ms()
         query += f" WHERE id = :id"
-        result = await self.db.execute(query, {"id": id, **values})
-        return result == 1
+        if user_id is not None:
+            query += f" AND user_id = :user_id"
+            values["user_id"] = user_id
+        query += " RETURNING *"
+        result = await self.db.fetch_one(query, {"id": id, **values})
+        return CodeFlowMapper.from_record_(result)
     
-    async def update_processed(self, id: int, error: Optional[str] = None) -> bool:
-        query = 'UPDATE code_flow SET processed = TRUE, flow_error = :error WHERE id = :id'
-        result = await self.db.execute(query, {"id": id, "error": error})
+    async def update_processed(self, id: int, error: Optional[str] = None, stats: Optional[CodeFlowStats] = None) -> bool:
+        query = """
+            UPDATE code_flow SET
+                processed = TRUE,
+                flow_error = :error,
+                flow_event_count = :event_count,
+                flow_size = :size,
+                flow_time_start = :time_start,
+                flow_time_end = :time_end,
+                processed_at = :now,
+                updated_at = :now
+            WHERE id = :id
+        """
+        result = await self.db.execute(query, {
+            "id": id,
+            "now": now_ms(),
+            "error": error,
+            "event_count": stats.event_count if stats else None,
+            "size": stats.size if stats else None,
+            "time_start": stats.time_start if stats else None,
+            "time_end": stats.time_end if stats else None,
+        })
         return result == 1
 
+    async def update_many(self, user_id: int, selection: CodeFlowSelection, data: CodeFlowUpdate) -> List[CodeFlowModel]:
+        # One statement for the whole selection, the owner check is part of it
+        values = data.model_dump(exclude_unset=True)
+        if not values:
+            return []
+        where, params = self._where_selection(user_id, selection)
+        values["updated_at"] = now_ms()
+        query = f"""UPDATE code_flow AS c SET {", ".join(f"{key} = :{key}" for key in values)}"""
+        query += f""" WHERE {" AND ".join(where)} RETURNING *"""
+        data = await self.db.fetch_all(query, {**params, **values})
+        return CodeFlowMapper.from_all_records(data)
+
+    async def delete_many(self, user_id: int, selection: CodeFlowSelection) -> List[CodeFlowModel]:
+        where, params = self._where_selection(user_id, selection)
+        query = f"""DELETE FROM code_flow AS c WHERE {" AND ".join(where)} RETURNING *"""
+        async with self.db.transaction():
+            data = CodeFlowMapper.from_all_records(await self.db.fetch_all(query, params))
+            await self._insert_tombstones(data)
+        return data
+
     async def delete(self, id: int) -> bool:
-        result = await self.db.execute("DELETE FROM code_flow WHERE id = :id", {"id": id})
-        return result == 1
+        async with self.db.transaction():
+            data = await self.db.fetch_one("DELETE FROM code_flow WHERE id = :id RETURNING *", {"id": id})
+            if data is None:
+                return False
+            await self._insert_tombstones([CodeFlowMapper.from_record(data)])
+        return True
 
-    async def get_all_public(self) -> List[CodeFlowIndex]:
-        query = """
-            SELECT c.*, u.username AS username
+    async def _insert_tombstones(self, data: List[CodeFlowModel]) -> None:
+        # Deleted code flows are reported by get_deleted_ids, see CodeFlowService.code_flow_changes
+        if not data:
+            return
+        now = now_ms()
+        await self.db.execute(
+            "DELETE FROM code_flow_tombstone WHERE deleted_at < :expired", {"expired": now - self.change_retention_ms()})
+        await self.db.execute_many("""
+            INSERT INTO code_flow_tombstone (code_flow_id, user_id, private, deleted_at)
+            VALUES (:code_flow_id, :user_id, :private, :deleted_at)
+        """, [{"code_flow_id": it.id, "user_id": it.user_id, "private": it.private, "deleted_at": now} for it in data])
+
+    @staticmethod
+    def change_retention_ms() -> int:
+        return env.change_retention_days * 24 * 60 * 60 * 1000
+
+    async def get_page_records(
+        self,
+        filter: CodeFlowFilter,
+        limit: int,
+        after: Optional[CodeFlowCursor] = None,
+        descending: bool = False,
+    ) -> List[Record]:
+        # Keyset pagination, served by the (name, id) indexes whatever the page
+        where, values = self._where(filter)
+        if after is not None:
+            where.append(f"(c.name, c.id) {'<' if descending else '>'} (:after_name, :after_id)")
+            values.update(after_name=after.name, after_id=after.id)
+        direction = "DESC" if descending else "ASC"
+        query = f"""
+            SELECT {self.LIST_COLUMNS}
             FROM code_flow c
             LEFT JOIN users u ON c.user_id = u.id
-            WHERE c.private = FALSE
-            ORDER BY c.name ASC
+            WHERE {" AND ".join(where)}
+            ORDER BY c.name {direction}, c.id {direction}
+            LIMIT :limit
         """
-        data = await self.db.fetch_all(query)
-        return CodeFlowIndexMapper.from_all_records(data)
+        return await self._reader().fetch_all(query, {**values, "limit": limit})
 
-    async def get_all_private(self, user_id: int) -> List[CodeFlowIndex]:
-        query = """
-            SELECT c.*, u.username AS username
-            FROM code_flow c
+    async def count(self, filter: CodeFlowFilter) -> int:
+        where, values = self._where(filter)
+        query = f"""SELECT COUNT(*) FROM code_flow c WHERE {" AND ".join(where)}"""
+        return await self._reader().fetch_val(query, values)
+
+    async def search_records(self, text: str, filter: CodeFlowFilter, limit: int, offset: int) -> List[Record]:
+        from_, where, values, rank = self._search(text, filter)
+        query = f"""
+            SELECT {self.LIST_COLUMNS}
+            FROM {from_}
+            WHERE {" AND ".join(where)}
+            ORDER BY {rank}, c.id
+            LIMIT :limit OFFSET :offset
+        """
+        return await self._reader().fetch_all(query, {**values, "limit": limit, "offset": offset})
+
+    async def search_count(self, text: str, filter: CodeFlowFilter) -> int:
+        from_, where, values, _ = self._search(text, filter)
+        query = f"""SELECT COUNT(*) FROM {from_} WHERE {" AND ".join(where)}"""
+        return await self._reader().fetch_val(query, values)
+
+    def _search(self, text: str, filter: CodeFlowFilter) -> Tuple[str, List[str], Dict[str, Any], str]:
+        # Every term has to be in the name or in the username
+        where, values = self._where(filter)
+        terms = text.split()
+        if env.database_engine == "sqlite":
+            # Quoted, the trigram tokenizer matches them as substrings. It needs 3 characters,
+            # shorter terms are matched with LIKE like on PostgreSQL
+            where += self._where_terms([term for term in terms if len(term) < 3], values, "LIKE")
+            terms = [term for term in terms if len(term) >= 3]
+            if terms:
+                values["match"] = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+                from_ = """
+                    code_flow_search s
+                    JOIN code_flow c ON c.id = s.rowid
+                    LEFT JOIN users u ON c.user_id = u.id
+                """
+                where.append("code_flow_search MATCH :match")
+                return from_, where, values, "bm25(code_flow_search)"
+        else:
+            where += self._where_terms(terms, values, "ILIKE")
+        values["text"] = text.strip().lower()
+        from_ = """
+            code_flow c
             LEFT JOIN users u ON c.user_id = u.id
-            WHERE c.private = TRUE AND c.user_id = :user_id
-            ORDER BY c.name ASC
         """
-        data = await self.db.fetch_all(query, {"user_id": user_id})
-        return CodeFlowIndexMapper.from_all_records(data)
-    
-    async def get_all_public_and_private(self, user_id: int) -> List[CodeFlowIndex]:
-        query = """
-            SELECT c.*, u.username AS username
+        # SQLite has no starts_with(), it only gets here with short terms
+        prefix = "starts_with(lower(c.name), :text)"
+        if env.database_engine == "sqlite":
+            prefix = "substr(lower(c.name), 1, length(:text)) = :text"
+        # Exact names first, then prefixes, then shorter names
+        rank = f"""
+            CASE WHEN lower(c.name) = :text THEN 0 WHEN {prefix} THEN 1 ELSE 2 END,
+            length(c.name)
+        """
+        return from_, where, values, rank
+
+    def _where_terms(self, terms: List[str], values: Dict[str, Any], like: str) -> List[str]:
+        # LIKE of SQLite ignores the case of ASCII letters, as ILIKE does
+        where: List[str] = []
+        for i, term in enumerate(terms):
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            values[f"term_{i}"] = f"%{escaped}%"
+            where.append(f"(c.name {like} :term_{i} ESCAPE '\\' OR u.username {like} :term_{i} ESCAPE '\\')")
+        return where
+
+    def _where(self, filter: CodeFlowFilter) -> Tuple[List[str], Dict[str, Any]]:
+        where: List[str] = []
+        values: Dict[str, Any] = {}
+        if filter.public and filter.private_user_id is not None:
+            where.append("(c.private = FALSE OR c.user_id = :private_user_id)")
+            values["private_user_id"] = filter.private_user_id
+        elif filter.private_user_id is not None:
+            where.append("c.private = TRUE AND c.user_id = :private_user_id")
+            values["private_user_id"] = filter.private_user_id
+        else:
+            where.append("c.private = FALSE")
+        if filter.owner_id is not None:
+            where.append("c.user_id = :owner_id")
+            values["owner_id"] = filter.owner_id
+        where += self._where_status(filter.status)
+        return where, values
+
+    def _where_status(self, status: Optional[CodeFlowStatus]) -> List[str]:
+        if status == CodeFlowStatus.PENDING:
+            return ["c.processed = FALSE"]
+        if status == CodeFlowStatus.PROCESSED:
+            return ["c.processed = TRUE AND c.flow_error IS NULL"]
+        if status == CodeFlowStatus.FAILED:
+            return ["c.processed = TRUE AND c.flow_error IS NOT NULL"]
+        return []
+
+    def _where_selection(self, user_id: int, selection: CodeFlowSelection) -> Tuple[List[str], Dict[str, Any]]:
+        where = ["c.user_id = :user_id"]
+        values: Dict[str, Any] = {"user_id": user_id}
+        if selection.ids is not None:
+            if not selection.ids:
+                where.append("FALSE")
+            else:
+                params = {f"id_{i}": id for i, id in enumerate(selection.ids)}
+                where.append(f"c.id IN ({', '.join(':' + it for it in params)})")
+                values.update(params)
+        elif selection.status is None and selection.private is None and selection.name_prefix is None:
+            where.append("FALSE")
+        where += self._where_status(selection.status)
+        if selection.private is not None:
+            where.append("c.private = :private_filter")
+            values["private_filter"] = selection.private
+        if selection.name_prefix is not None:
+            escaped = selection.name_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("c.name LIKE :name_prefix ESCAPE '\\'")
+            values["name_prefix"] = escaped + "%"
+        return where, values
+
+    async def get_changes_records(self, after: CodeFlowChangeCursor, until: int, limit: int) -> List[Record]:
+        # Every change, visibility is applied by the caller so private rows can be reported as gone.
+        # Always the primary, a change skipped because of the lag of a replica would never be sent
+        query = f"""
+            SELECT {self.LIST_COLUMNS}
             FROM code_flow c
             LEFT JOIN users u ON c.user_id = u.id
-            WHERE c.private = FALSE OR c.user_id = :user_id
-            ORDER BY c.name ASC
+            WHERE (c.updated_at, c.id) > (:updated_at, :id) AND c.updated_at <= :until
+            ORDER BY c.updated_at ASC, c.id ASC
+            LIMIT :limit
         """
-        data = await self.db.fetch_all(query, {"user_id": user_id})
-        return CodeFlowIndexMapper.from_all_records(data)
-    
+        return await self.db.fetch_all(query, {
+            "updated_at": after.updated_at, "id": after.id, "until": until, "limit": limit})
+
+    async def get_deleted_ids(self, user_id: Optional[int], after: int, until: int) -> List[int]:
+        query = """
+            SELECT code_flow_id FROM code_flow_tombstone
+            WHERE deleted_at > :after AND deleted_at <= :until AND (private = FALSE OR user_id = :user_id)
+            ORDER BY deleted_at ASC
+        """
+        data = await self.db.fetch_all(query, {"after": after, "until": until, "user_id": user_id})
+        return [it["code_flow_id"] for it in data]
+
     async def get_all_unprocessed_and_failed(self) -> List[CodeFlowModel]:
         query = """SELECT * FROM code_flow WHERE processed = FALSE OR flow_error IS NOT NULL"""
         data = await self.db.fetch_all(query)
@@ -91,14 +336,26 @@ class CodeFlowRepository:
     
     async def get_by_id(self, id: int) -> CodeFlowModel | None:
         query = """SELECT * FROM code_flow WHERE id = :id"""
-        data = await self.db.fetch_one(query, {"id": id})
+        data = await self._reader().fetch_one(query, {"id": id})
         return CodeFlowMapper.from_record_(data)
     
     async def get_by_user_id_and_name(self, user_id: int, name: str) -> CodeFlowModel | None:
         query = """SELECT * FROM code_flow WHERE user_id = :user_id AND name = :name"""
-        data = await self.db.fetch_one(query, {"name": name, "user_id": user_id})
+        data = await self._reader().fetch_one(query, {"name": name, "user_id": user_id})
         return CodeFlowMapper.from_record_(data)
 
+    async def get_existing_file_ids(self, file_ids: List[str]) -> Set[str]:
+        if not file_ids:
+            return set()
+        # Always on the primary, a lagging replica would make new artifacts look orphaned
+        params = {f"file_id_{i}": file_id for i, file_id in enumerate(file_ids)}
+        query = f"""SELECT file_id FROM code_flow WHERE file_id IN ({", ".join(":" + it for it in params)})"""
+        data = await self.db.fetch_all(query, params)
+        return {it["file_id"] for it in data}
+
+    def _reader(self) -> Database:
+        return self.db if is_pinned_to_primary() else self.read_db
+
 
-def get_code_flow_repository(db: Database = Depends(get_database)) -> CodeFlowRepository:
-    return CodeFlowRepository(db)
+async def get_code_flow_repository(request: Request) -> CodeFlowRepository:
+    return request.app.state.container.code_flow_repository
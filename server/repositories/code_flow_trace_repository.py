@@ -0,0 +1,91 @@
+import orjson
+
+from databases import Database
+from fastapi import Request
+from typing import List, Optional
+
+from ..database.connection import is_pinned_to_primary
+from ..mappers import CodeFlowCheckpointMapper, CodeFlowVariableMapper, CodeFlowVariableSegmentMapper
+from ..metrics import instrument_repository
+from ..models import CodeFlowCheckpoint, CodeFlowVariable, CodeFlowVariableSegment
+
+
+@instrument_repository("code_flow_trace")
+class CodeFlowTraceRepository:
+    def __init__(self, db: Database, read_db: Optional[Database] = None) -> None:
+        self.db = db
+        self.read_db = read_db or db
+
+    async def insert_checkpoints(self, code_flow_id: int, checkpoints: List[CodeFlowCheckpoint]) -> None:
+        # Called with every batch of the indexer, each batch is its own short write
+        await self.db.execute_many("""
+            INSERT INTO code_flow_checkpoint (code_flow_id, step, byte_offset, state)
+            VALUES (:code_flow_id, :step, :byte_offset, :state)
+        """, [{
+            "code_flow_id": code_flow_id,
+            "step": it.step,
+            "byte_offset": it.byte_offset,
+            "state": orjson.dumps(it.state).decode(),
+        } for it in checkpoints])
+
+    async def insert_variables(self, code_flow_id: int, segments: List[CodeFlowVariableSegment]) -> None:
+        if not segments:
+            return
+        await self.db.execute_many("""
+            INSERT INTO code_flow_variable
+                (code_flow_id, function, name, type, segment, byte_offset, byte_length, count)
+            VALUES
+                (:code_flow_id, :function, :name, :type, :segment, :byte_offset, :byte_length, :count)
+        """, [{"code_flow_id": code_flow_id, **it.model_dump()} for it in segments])
+
+    async def delete(self, code_flow_id: int) -> None:
+        await self.db.execute(
+            "DELETE FROM code_flow_checkpoint WHERE code_flow_id = :code_flow_id", {"code_flow_id": code_flow_id})
+        await self.db.execute(
+            "DELETE FROM code_flow_variable WHERE code_flow_id = :code_flow_id", {"code_flow_id": code_flow_id})
+
+    async def delete_many(self, code_flow_ids: List[int]) -> None:
+        if not code_flow_ids:
+            return
+        params = {f"id_{i}": id for i, id in enumerate(code_flow_ids)}
+        ids = ", ".join(":" + it for it in params)
+        await self.db.execute(f"DELETE FROM code_flow_checkpoint WHERE code_flow_id IN ({ids})", params)
+        await self.db.execute(f"DELETE FROM code_flow_variable WHERE code_flow_id IN ({ids})", params)
+
+    async def get_checkpoint_before(self, code_flow_id: int, step: int) -> CodeFlowCheckpoint | None:
+        query = """
+            SELECT * FROM code_flow_checkpoint
+            WHERE code_flow_id = :code_flow_id AND step <= :step
+            ORDER BY step DESC
+            LIMIT 1
+        """
+        data = await self._reader().fetch_one(query, {"code_flow_id": code_flow_id, "step": step})
+        return CodeFlowCheckpointMapper.from_record_(data)
+
+    async def get_all_variables(self, code_flow_id: int) -> List[CodeFlowVariable]:
+        query = """
+            SELECT function, name, MIN(type) AS type, SUM(count) AS count
+            FROM code_flow_variable
+            WHERE code_flow_id = :code_flow_id
+            GROUP BY function, name
+            ORDER BY function ASC, name ASC
+        """
+        data = await self._reader().fetch_all(query, {"code_flow_id": code_flow_id})
+        return CodeFlowVariableMapper.from_all_records(data)
+
+    async def get_variable_segments(self, code_flow_id: int, function: str, name: str) -> List[CodeFlowVariableSegment]:
+        query = """
+            SELECT function, name, type, segment, byte_offset, byte_length, count
+            FROM code_flow_variable
+            WHERE code_flow_id = :code_flow_id AND function = :function AND name = :name
+            ORDER BY segment ASC
+        """
+        data = await self._reader().fetch_all(query, {"code_flow_id": code_flow_id, "function": function, "name": name})
+        return CodeFlowVariableSegmentMapper.from_all_records(data)
+
+    def _reader(self) -> Database:
+        return self.db if is_pinned_to_primary() else self.read_db
+
+
+async def get_code_flow_trace_repository(request: Request) -> CodeFlowTraceRepository:
+    return request.app.state.container.code_flow_trace_repository
@@ -1,9 +1,11 @@
 from databases import Database
 from databases.interfaces import Record
-from fastapi import Depends
+from fastapi import Request
 from pydantic import BaseModel
+from typing import Optional
 
-from ..database.connection import get_database
+from ..database.connection import is_pinned_to_primary
+from ..metrics import instrument_repository
 from ..models import UserModel, UserRole
 
 
@@ -19,45 +21,50 @@ class UserUpdate(BaseModel):
     role: UserRole
 
 
+@instrument_repository("user")
 class UserRepository:
-    def __init__(self, db: Database) -> None:
+    def __init__(self, db: Database, read_db: Optional[Database] = None) -> None:
         self.db = db
+        self.read_db = read_db or db
 
-    async def insert(self, user: UserInsert) -> int:
+    async def insert(self, user: UserInsert) -> UserModel:
         query = """
             INSERT INTO users (username, password, role)
             VALUES (:username, :password, :role)
-            RETURNING id
+            RETURNING *
         """
-        return await self.db.execute(query, {
+        data = await self.db.fetch_one(query, {
             "username": user.username,
             "password": user.password,
             "role": user.role.value,
         })
+        return UserModel(**dict(data))
 
-    async def update(self, user_id: int, user: UserUpdate) -> None:
+    async def update(self, user_id: int, user: UserUpdate) -> UserModel | None:
         query = """
             UPDATE users SET
                 username = :username,
                 password = :password,
                 role = :role
             WHERE id = :id
+            RETURNING *
         """
-        await self.db.execute(query, {
+        data = await self.db.fetch_one(query, {
             "id": user_id,
             "username": user.username,
             "password": user.password,
             "role": user.role.value,
         })
+        return self._to_model(data)
 
     async def get_by_username(self, username: str) -> UserModel | None:
         query = """SELECT * FROM users WHERE username = :username"""
-        data = await self.db.fetch_one(query, {"username": username})
+        data = await self._reader().fetch_one(query, {"username": username})
         return self._to_model(data)
 
     async def get_by_id(self, user_id: int) -> UserModel | None:
         query = """SELECT * FROM users WHERE id = :user_id"""
-        data = await self.db.fetch_one(query, {"user_id": user_id})
+        data = await self._reader().fetch_one(query, {"user_id": user_id})
         return self._to_model(data)
 
     def _to_model(self, data: Record | None) -> UserModel | None:
@@ -65,6 +72,9 @@ class UserRepository:
             return None
         return UserModel(**dict(data))
 
+    def _reader(self) -> Database:
+        return self.db if is_pinned_to_primary() else self.read_db
+
 
-def get_user_repository(db: Database = Depends(get_database)) -> UserRepository:
-    return UserRepository(db)
+async def get_user_repository(request: Request) -> UserRepository:
+    return request.app.state.container.user_repository
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from pydantic import BaseModel
+from typing import Optional
+
+from ..env import env
+
+
+class ArtifactCacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    entries: int
+    size: int
+    max_size: int
+
+
+class CachedArtifact:
+    __slots__ = ("etag", "content")
+
+    def __init__(self, etag: str, content: bytes) -> None:
+        self.etag = etag
+        self.content = content
+
+
+class ArtifactCache:
+    """In-process LRU cache of artifact bytes, bounded by their total size."""
+
+    def __init__(self, max_size: int, max_entry_size: int) -> None:
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[str, CachedArtifact] = OrderedDict()
+
+    def accepts(self, size: int) -> bool:
+        return size <= self.max_entry_size and size <= self.max_size
+
+    def get(self, name: str, etag: str) -> Optional[bytes]:
+        entry = self._entries.get(name)
+        if entry is None or entry.etag != etag:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(name)
+        self.hits += 1
+        return entry.content
+
+    def put(self, name: str, etag: str, content: bytes) -> None:
+        if not self.accepts(len(content)):
+            return
+        self._remove(name)
+        self._entries[name] = CachedArtifact(etag, content)
+        self.size += len(content)
+        while self.size > self.max_size:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= len(entry.content)
+            self.evictions += 1
+
+    def invalidate(self, file_id: str) -> None:
+        # Artifacts of a code flow are named <file_id>_<kind>
+        for name in [name for name in self._entries if name.startswith(file_id)]:
+            self._remove(name)
+            self.invalidations += 1
+
+    def stats(self) -> ArtifactCacheStats:
+        return ArtifactCacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+            entries=len(self._entries),
+            size=self.size,
+            max_size=self.max_size,
+        )
+
+    def _remove(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self.size -= len(entry.content)
+
+
+class ArtifactCacheSingleton:
+    instance: Optional[ArtifactCache] = None
+
+    def get_instance(self) -> ArtifactCache:
+        if ArtifactCacheSingleton.instance is None:
+            ArtifactCacheSingleton.instance = ArtifactCache(
+                env.artifact_cache_size, env.artifact_cache_max_entry_size)
+        return ArtifactCacheSingleton.instance
+
+
+def get_artifact_cache() -> ArtifactCache:
+    return ArtifactCacheSingleton().get_instance()
@@ -0,0 +1,100 @@
+import gzip
+import os
+import shutil
+
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from ..env import env
+
+# Optional, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CHUNK_SIZE = 256 * 1024
+
+Compressor = Callable[[BinaryIO, BinaryIO], None]
+
+
+def _gzip(src: BinaryIO, dst: BinaryIO) -> None:
+    # mtime=0 keeps the output (and so its ETag) stable for the same input
+    with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=9, mtime=0) as f:
+        shutil.copyfileobj(src, f, CHUNK_SIZE)
+
+
+def _brotli(src: BinaryIO, dst: BinaryIO) -> None:
+    compressor = brotli.Compressor(quality=9)
+    while chunk := src.read(CHUNK_SIZE):
+        dst.write(compressor.process(chunk))
+    dst.write(compressor.finish())
+
+
+def _zstd(src: BinaryIO, dst: BinaryIO) -> None:
+    zstandard.ZstdCompressor(level=19).copy_stream(src, dst, read_size=CHUNK_SIZE)
+
+
+# Content-Encoding -> (file suffix, compressor), in order of preference when serving
+ENCODINGS: Dict[str, Tuple[str, Optional[Compressor]]] = {
+    "br": (".br", _brotli if brotli is not None else None),
+    "zstd": (".zst", _zstd if zstandard is not None else None),
+    "gzip": (".gz", _gzip),
+}
+
+
+def enabled_encodings() -> List[str]:
+    names = [it.strip() for it in env.artifact_encodings.split(",") if it.strip()]
+    return [it for it in ENCODINGS if it in names and ENCODINGS[it][1] is not None]
+
+
+def encoded_path(path: Path, encoding: str) -> Path:
+    return path.with_name(path.name + ENCODINGS[encoding][0])
+
+
+def compress_artifact(path: Path) -> List[Path]:
+    written = []
+    for encoding in enabled_encodings():
+        compressor = ENCODINGS[encoding][1]
+        assert compressor is not None
+        target = encoded_path(path, encoding)
+        tmp = target.with_name(target.name + ".tmp")
+        with path.open("rb") as src, tmp.open("wb") as dst:
+            compressor(src, dst)
+        os.replace(tmp, target)
+        written.append(target)
+    return written
+
+
+def remove_compressed_artifacts(path: Path) -> None:
+    for encoding in ENCODINGS:
+        encoded_path(path, encoding).unlink(missing_ok=True)
+
+
+def negotiate_encoding(accept_encoding: str, available: List[str]) -> Optional[str]:
+    # https://httpwg.org/specs/rfc9110.html#field.accept-encoding
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best: Optional[str] = None
+    best_weight = 0.0
+    for encoding in available:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
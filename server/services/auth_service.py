@@ -1,10 +1,10 @@
-from fastapi import Depends
+from fastapi import Request
 from pydantic import BaseModel
 
 from ..models import UserModel
 
-from .jwt_service import JwtService, TokenData, get_jwt_service
-from .user_service import ChangePassword, UserLogin, UserService, UserUpdateDiff, get_user_service
+from .jwt_service import JwtService, TokenData
+from .user_service import ChangePassword, UserLogin, UserService, UserUpdateDiff
 
 
 class AuthResponse(BaseModel):
@@ -32,7 +32,7 @@ class AuthService:
 
 
     async def auth_change_password(self, user: UserModel, body: ChangePassword) -> AuthResponse:
-        self.user_service.fail_if_not_check_password(body.old_password, user.password)
+        await self.user_service.fail_if_not_check_password(body.old_password, user.password)
         user = await self.user_service.user_update(user, UserUpdateDiff(password=body.new_password))
         return self._create_auth_response(user)
 
@@ -43,9 +43,5 @@ class AuthService:
         return AuthResponse(access_token=access_token, refresh_token=refresh_token)
 
 
-def get_auth_service(
-    user_service: UserService = Depends(get_user_service),
-    jwt_service: JwtService = Depends(get_jwt_service),
-) -> AuthService:
-    return AuthService(user_service, jwt_service)
-
+async def get_auth_service(request: Request) -> AuthService:
+    return request.app.state.container.auth_service
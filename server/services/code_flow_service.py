@@ -1,14 +1,31 @@
 
-from fastapi import Depends
+import asyncio
+import base64
+import binascii
+import logging
+import orjson
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from pathlib import Path
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, AsyncIterator, Coroutine, List, Optional, Set
 
-from ..exceptions import ForbiddenError, NotFoundError, UnauthorizedError
-from ..jobs.process_code_flow_job import ProcessCodeFlowJob, get_process_code_flow_job
+from ..database.connection import pin_to_primary
+from ..env import env
+from ..exceptions import DomainError, ForbiddenError, NotFoundError, UnauthorizedError
+from ..jobs.job_events import JobEventBroker
+from ..jobs.job_relay import JobRelay
+from ..jobs.live_trace import LIVE_WATCH_SECONDS, LiveTrace, LiveTraceEnd, LiveTraceRegistry
+from ..jobs.process_code_flow_job import ProcessCodeFlowJob
 from ..mappers import CodeFlowShowMapper
-from ..models import CodeFlowModel, CodeFlowShow, UserModel
-from ..repositories.code_flow_repository import CodeFlowRepository, CodeFlowUpdate, get_code_flow_repository
-from ..resources import Resources
+from ..models import CodeFlowBulkResult, CodeFlowDiff, CodeFlowJobEvent, CodeFlowJobStatus, CodeFlowModel, CodeFlowPage, CodeFlowShow, CodeFlowState, CodeFlowStatus, CodeFlowVariable, CodeFlowVariableHistory, UserModel
+from ..repositories.code_flow_repository import CodeFlowChangeCursor, CodeFlowCursor, CodeFlowFilter, CodeFlowRepository, CodeFlowSelection, CodeFlowUpdate, MAX_CODE_FLOW_ID, now_ms
+from ..repositories.code_flow_trace_repository import CodeFlowTraceRepository
+from ..storage.artifact_storage import ArtifactStorage
+from ..traces.trace_diff import diff_traces
+from ..traces.trace_indexer import read_variable_history, seek_trace_state
+from .artifact_cache import ArtifactCache
 
 
 class CodeFlowStore(BaseModel):
@@ -17,10 +34,95 @@ class CodeFlowStore(BaseModel):
     user_id: int
 
 
+def _encode(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode().rstrip("=")
+
+
+def _decode(value: str) -> List[Any]:
+    return orjson.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+
+
+def encode_cursor(cursor: CodeFlowCursor) -> str:
+    return _encode([cursor.name, cursor.id])
+
+
+def decode_cursor(value: Optional[str]) -> Optional[CodeFlowCursor]:
+    if not value:
+        return None
+    try:
+        name, id = _decode(value)
+        return CodeFlowCursor(name=name, id=id)
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise DomainError("Invalid cursor")
+
+
+def encode_change_cursor(cursor: CodeFlowChangeCursor) -> str:
+    return _encode([cursor.updated_at, cursor.id])
+
+
+def decode_change_cursor(value: Optional[str]) -> Optional[CodeFlowChangeCursor]:
+    if not value:
+        return None
+    try:
+        updated_at, id = _decode(value)
+        return CodeFlowChangeCursor(updated_at=updated_at, id=id)
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise DomainError("Invalid cursor")
+
+
+def encode_offset_cursor(offset: int) -> str:
+    # Ranked results have no stable key, their pages are offsets behind the same opaque cursor
+    return _encode([offset])
+
+
+def decode_offset_cursor(value: Optional[str]) -> int:
+    if not value:
+        return 0
+    try:
+        offset, = _decode(value)
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError(offset)
+        return offset
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise DomainError("Invalid cursor")
+
+
+def sse_message(event: str, data: bytes) -> bytes:
+    # https://html.spec.whatwg.org/multipage/server-sent-events.html, data is single line JSON
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+
+# Started by the bulk endpoints and referenced until they finish. Not BackgroundTasks: the
+# tasks of a response run one after the other and the first request also starts the job loop
+_background_tasks: Set["asyncio.Task[None]"] = set()
+
+
+def run_in_background(coroutine: Coroutine[Any, Any, None]) -> None:
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 class CodeFlowService:
-    def __init__(self, code_flow_repository: CodeFlowRepository, process_code_flow_job: ProcessCodeFlowJob) -> None:
+    def __init__(
+        self,
+        code_flow_repository: CodeFlowRepository,
+        code_flow_trace_repository: CodeFlowTraceRepository,
+        process_code_flow_job: ProcessCodeFlowJob,
+        artifact_cache: ArtifactCache,
+        artifact_storage: ArtifactStorage,
+        job_event_broker: JobEventBroker,
+        job_relay: JobRelay,
+        live_traces: LiveTraceRegistry,
+    ) -> None:
         self.code_flow_repository = code_flow_repository
+        self.code_flow_trace_repository = code_flow_trace_repository
         self.process_code_flow_job = process_code_flow_job
+        self.artifact_cache = artifact_cache
+        self.artifact_storage = artifact_storage
+        self.job_event_broker = job_event_broker
+        self.job_relay = job_relay
+        self.live_traces = live_traces
 
     async def code_flow_show(self, id: int, user: UserModel) -> CodeFlowShow:
         data = await self.code_flow_repository.get_by_id(id)
@@ -29,58 +131,329 @@ class CodeFlowService:
             raise UnauthorizedError("You are not the owner of this CodeFlow")
         return CodeFlowShowMapper.from_model(data)
 
-    async def code_flow_index(self, user: Optional[UserModel], public: Optional[bool], private: Optional[bool]) -> List[CodeFlowShow]:
-        data = None
-        if private:
-            if user is None:
-                raise ForbiddenError("You are not allowed to access this resource")
-            if public:
-                data = await self.code_flow_repository.get_all_public_and_private(user.id)
-            else:
-                data = await self.code_flow_repository.get_all_private(user.id)
-        elif public:
-            data = await self.code_flow_repository.get_all_public()
+    async def code_flow_state(self, id: int, user: UserModel, step: int) -> CodeFlowState:
+        data = await self._get_processed(id, user)
+        if step < 0:
+            raise DomainError("Step must be greater than or equal to 0")
 
-        if data is None:
-            if user is not None:
-                data = await self.code_flow_repository.get_all_public_and_private(user.id)
-            else:
-                data = await self.code_flow_repository.get_all_public()
-        return CodeFlowShowMapper.from_all_indexes(data)
+        checkpoint = await self.code_flow_trace_repository.get_checkpoint_before(id, step)
+        if checkpoint is None:
+            raise NotFoundError("CodeFlow checkpoints not found, reprocess it")
+        flow_path = self.artifact_storage.path(Path(data.flow_path).name)
+        return await run_in_threadpool(lambda: seek_trace_state(flow_path, checkpoint, step))
 
-    async def code_flow_update(self, id: int, user: UserModel, body: CodeFlowUpdate) -> CodeFlowShow:
-        data = await self.code_flow_repository.get_by_id(id)
-        data = self._fail_if_not_found(data)
-        if data.user_id != user.id:
-            raise ForbiddenError(f"You are not the owner of this CodeFlow")
+    async def code_flow_variables(self, id: int, user: UserModel) -> List[CodeFlowVariable]:
+        await self._get_processed(id, user)
+        return await self.code_flow_trace_repository.get_all_variables(id)
+
+    async def code_flow_variable_history(
+        self,
+        id: int,
+        user: UserModel,
+        function: str,
+        name: str,
+        cursor: Optional[str] = None,
+        limit: int = 1000,
+    ) -> CodeFlowVariableHistory:
+        data = await self._get_processed(id, user)
+        segments = await self.code_flow_trace_repository.get_variable_segments(id, function, name)
+        if not segments:
+            raise NotFoundError(f"Variable {name} not found in function {function}")
+        offset = decode_offset_cursor(cursor)
+        count = sum(it.count for it in segments)
+        variables_path = self.artifact_storage.path(Path(data.variables_path).name)
+        history = await run_in_threadpool(lambda: read_variable_history(variables_path, segments, offset, limit))
+        return CodeFlowVariableHistory(
+            function=function,
+            name=name,
+            type=segments[0].type,
+            count=count,
+            history=history,
+            next_cursor=encode_offset_cursor(offset + limit) if offset + limit < count else None,
+        )
+
+    async def code_flow_diff(self, a: int, b: int, user: UserModel) -> CodeFlowDiff:
+        data_a = await self._get_processed(a, user)
+        data_b = await self._get_processed(b, user)
+        flow_a = self.artifact_storage.path(Path(data_a.flow_path).name)
+        flow_b = self.artifact_storage.path(Path(data_b.flow_path).name)
+        return await run_in_threadpool(lambda: diff_traces(flow_a, flow_b, a, b))
+
+    async def code_flow_index(
+        self,
+        user: Optional[UserModel],
+        public: Optional[bool],
+        private: Optional[bool],
+        owner_id: Optional[int] = None,
+        status: Optional[CodeFlowStatus] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+        descending: bool = False,
+        total: bool = False,
+    ) -> CodeFlowPage:
+        if private and user is None:
+            raise ForbiddenError("You are not allowed to access this resource")
+        if private or (not public and user is not None):
+            filter = CodeFlowFilter(public=bool(public) or not private, private_user_id=user.id)
+        else:
+            filter = CodeFlowFilter(public=True)
+        filter.owner_id = owner_id
+        filter.status = status
 
-        updated = await self.code_flow_repository.update(id, body)
-        if updated:
+        # One extra row tells whether there is a next page
+        data = await self.code_flow_repository.get_page_records(filter, limit + 1, decode_cursor(cursor), descending)
+        next_cursor = None
+        if len(data) > limit:
+            data = data[:limit]
+            next_cursor = encode_cursor(CodeFlowCursor(name=data[-1]["name"], id=data[-1]["id"]))
+        return CodeFlowPage(
+            content=CodeFlowShowMapper.json_from_records(data),
+            next_cursor=next_cursor,
+            total=await self.code_flow_repository.count(filter) if total else None,
+        )
+
+    async def code_flow_search(
+        self,
+        user: Optional[UserModel],
+        text: str,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+        total: bool = False,
+    ) -> CodeFlowPage:
+        # Same visibility as the default list: public code flows and the private ones of the user
+        filter = CodeFlowFilter(public=True, private_user_id=user.id if user else None)
+        offset = decode_offset_cursor(cursor)
+        data = await self.code_flow_repository.search_records(text, filter, limit + 1, offset)
+        next_cursor = None
+        if len(data) > limit:
+            data = data[:limit]
+            next_cursor = encode_offset_cursor(offset + limit)
+        return CodeFlowPage(
+            content=CodeFlowShowMapper.json_from_records(data),
+            next_cursor=next_cursor,
+            total=await self.code_flow_repository.search_count(text, filter) if total else None,
+        )
+
+    async def code_flow_changes(self, user: Optional[UserModel], since: Optional[str], limit: int = 500) -> bytes:
+        """JSON CodeFlowChanges of the code flows changed after the since cursor, all of them without it.
+
+        Changes of the last CHANGE_SETTLE_MS are left for the next sync, a write still in its
+        transaction may get an older updated_at than a row already committed.
+        """
+        after = decode_change_cursor(since)
+        now = now_ms()
+        if after is not None and after.updated_at < now - self.code_flow_repository.change_retention_ms():
+            raise DomainError("Cursor expired, sync again without since")
+        until = max(now - env.change_settle_ms, after.updated_at if after else 0)
+
+        user_id = user.id if user else None
+        data = await self.code_flow_repository.get_changes_records(
+            after or CodeFlowChangeCursor(updated_at=0, id=0), until, limit + 1)
+        has_more = len(data) > limit
+        if has_more:
+            data = data[:limit]
+            end = CodeFlowChangeCursor(updated_at=data[-1]["updated_at"], id=data[-1]["id"])
+        else:
+            # Past every id of the window, the next sync starts with the changes after it
+            end = CodeFlowChangeCursor(updated_at=until, id=MAX_CODE_FLOW_ID)
+
+        changed = [it for it in data if not it["private"] or it["user_id"] == user_id]
+        deleted = []
+        if after is not None:
+            # Made private by someone else, gone for this user
+            deleted = [it["id"] for it in data if it["private"] and it["user_id"] != user_id]
+            deleted += await self.code_flow_repository.get_deleted_ids(user_id, after.updated_at, end.updated_at)
+        return orjson.dumps({
+            "changed": CodeFlowShowMapper.dicts_from_records(changed),
+            "deleted": deleted,
+            "next_cursor": encode_change_cursor(end),
+            "has_more": has_more,
+        })
+
+    def code_flow_events(self, user: Optional[UserModel], ids: List[int]) -> AsyncIterator[bytes]:
+        """Server-sent events of the job status of the visible code flows, or only of ids.
+
+        The current status of every id is sent first. A "resync" event means the client was
+        too slow and lost events, it should read the state of its code flows again.
+        """
+        if len(ids) > 100:
+            raise DomainError("At most 100 ids")
+        # Checked before the response starts, the generator runs after it
+        return self._events(user.id if user else None, ids)
+
+    async def _events(self, user_id: Optional[int], ids: List[int]) -> AsyncIterator[bytes]:
+        wanted = set(ids)
+
+        def accept(event: CodeFlowJobEvent) -> bool:
+            return (not wanted or event.code_flow_id in wanted) and (not event.private or event.user_id == user_id)
+
+        # Subscribed before the snapshot, a transition in between is sent twice instead of lost
+        with self.job_event_broker.subscribe(accept) as subscription:
+            for id in ids:
+                data = await self.code_flow_repository.get_by_id(id)
+                if data is not None and (not data.private or data.user_id == user_id):
+                    yield sse_message("status", (await self._job_event(data)).model_dump_json().encode())
+            while True:
+                event = await subscription.get(env.job_events_keepalive_seconds)
+                if subscription.lagged:
+                    subscription.lagged = False
+                    yield sse_message("resync", b"{}")
+                if event is None:
+                    # Keeps proxies from closing an idle stream
+                    yield b": keepalive\n\n"
+                    continue
+                yield sse_message("status", event.model_dump_json().encode())
+
+    async def code_flow_live(self, id: int, user: Optional[UserModel]) -> AsyncIterator[bytes]:
+        """Server-sent events of the trace of a run in progress.
+
+        "events" carries a JSON array of trace events, "skipped" the number of events the
+        client missed (it joined late or could not keep up, null when the run was not decoded
+        before anybody subscribed) and "end" closes the stream, the complete trace is then at
+        flow_path.
+
+        A run of another process (`scripts.py worker`) is relayed from the time somebody
+        subscribes, its stream starts with "skipped" null.
+        """
+        data = self._fail_if_not_found(await self.code_flow_repository.get_by_id(id))
+        if data.private and (user is None or data.user_id != user.id):
+            raise UnauthorizedError("You are not the owner of this CodeFlow")
+        live = self.live_traces.get(id)
+        if live is None:
+            if not env.trace_live_stream or self.process_code_flow_job.running == id \
+                    or not await self.process_code_flow_job.is_running(id):
+                raise NotFoundError("CodeFlow is not running")
+            live = self.live_traces.mirror(id)
+        return self._live_events(live)
+
+    async def _live_events(self, live: LiveTrace) -> AsyncIterator[bytes]:
+        timeout = env.job_events_keepalive_seconds
+        if live.remote:
+            timeout = min(timeout, LIVE_WATCH_SECONDS / 3)
+        try:
+            with live.subscribe() as subscription:
+                if subscription.skipped is None or subscription.skipped > 0:
+                    yield sse_message("skipped", orjson.dumps({"events": subscription.skipped}))
+                if subscription.replay:
+                    yield sse_message("events", orjson.dumps(subscription.replay))
+                while True:
+                    if live.remote and live.watch_due():
+                        await self._watch_remote(live)
+                    item = await subscription.get(timeout)
+                    if subscription.dropped:
+                        yield sse_message("skipped", orjson.dumps({"events": subscription.dropped}))
+                        subscription.dropped = 0
+                    if item is None:
+                        yield b": keepalive\n\n"
+                    elif isinstance(item, LiveTraceEnd):
+                        break
+                    else:
+                        yield sse_message("events", orjson.dumps(item))
+        finally:
+            # The last subscriber of a mirror, the worker stops relaying once the watch expires
+            if live.remote and not live.subscribed:
+                self.live_traces.finish(live)
+        yield sse_message("end", b"{}")
+
+    async def _watch_remote(self, live: LiveTrace) -> None:
+        if await self.process_code_flow_job.is_running(live.code_flow_id):
+            await self.job_relay.watch_live(live.code_flow_id)
+        else:
+            # Done without a "live_end" message, the worker died or did not stream the run
+            self.live_traces.finish(live)
+
+    async def _job_event(self, data: CodeFlowModel) -> CodeFlowJobEvent:
+        if not data.processed:
+            running = await self.process_code_flow_job.is_running(data.id)
+            status = CodeFlowJobStatus.RUNNING if running else CodeFlowJobStatus.QUEUED
+        elif data.flow_error is not None:
+            status = CodeFlowJobStatus.FAILED
+        else:
+            status = CodeFlowJobStatus.PROCESSED
+        return CodeFlowJobEvent(
+            code_flow_id=data.id,
+            user_id=data.user_id,
+            private=data.private,
+            status=status,
+            flow_error=data.flow_error,
+            flow_event_count=data.flow_event_count,
+        )
+
+    async def code_flow_update(self, id: int, user: UserModel, body: CodeFlowUpdate) -> CodeFlowShow:
+        pin_to_primary()
+        # The owner check is part of the UPDATE, the row is only read again to report why nothing matched
+        data = await self.code_flow_repository.update(id, body, user_id=user.id)
+        if data is None:
             data = await self.code_flow_repository.get_by_id(id)
             data = self._fail_if_not_found(data)
+            if data.user_id != user.id:
+                raise ForbiddenError(f"You are not the owner of this CodeFlow")
 
         if body.processed == False:
-            self.process_code_flow_job.create_job(data)
+            await self.process_code_flow_job.create_job(data)
         return CodeFlowShowMapper.from_model(data)
 
     async def code_flow_delete(self, id: int, user: UserModel) -> None:
+        pin_to_primary()
         data = await self.code_flow_repository.get_by_id(id)
         data = self._fail_if_not_found(data)
         if data.user_id != user.id:
             raise UnauthorizedError("You are not the owner of this CodeFlow")
-        (Resources.FILES / f"{data.file_id}_o.c").unlink(missing_ok=True)
-        (Resources.FILES / f"{data.file_id}_t.c").unlink(missing_ok=True)
-        (Resources.FILES / f"{data.file_id}_t.json").unlink(missing_ok=True)
+        self.artifact_storage.delete_all(data.file_id)
+        self.artifact_cache.invalidate(data.file_id)
+        await self.code_flow_trace_repository.delete(id)
         await self.code_flow_repository.delete(id)
 
+    async def code_flow_bulk_visibility(self, user: UserModel, selection: CodeFlowSelection, private: bool) -> CodeFlowBulkResult:
+        pin_to_primary()
+        data = await self.code_flow_repository.update_many(user.id, selection, CodeFlowUpdate(private=private))
+        return self._bulk_result(selection, data)
+
+    async def code_flow_bulk_reprocess(self, user: UserModel, selection: CodeFlowSelection) -> CodeFlowBulkResult:
+        pin_to_primary()
+        data = await self.code_flow_repository.update_many(user.id, selection, CodeFlowUpdate(processed=False))
+        for item in data:
+            await self.process_code_flow_job.create_job(item)
+        return self._bulk_result(selection, data)
+
+    async def code_flow_bulk_delete(self, user: UserModel, selection: CodeFlowSelection) -> CodeFlowBulkResult:
+        pin_to_primary()
+        data = await self.code_flow_repository.delete_many(user.id, selection)
+        await self.code_flow_trace_repository.delete_many([it.id for it in data])
+        file_ids = [it.file_id for it in data]
+        if file_ids:
+            run_in_background(self._delete_artifacts(file_ids))
+        return self._bulk_result(selection, data)
+
+    async def _delete_artifacts(self, file_ids: List[str]) -> None:
+        try:
+            await run_in_threadpool(lambda: [self.artifact_storage.delete_all(it) for it in file_ids])
+        except OSError as e:
+            # What is left is collected by the artifact GC
+            logging.getLogger(__name__).warning(f"Could not delete artifacts: {e}")
+        for file_id in file_ids:
+            self.artifact_cache.invalidate(file_id)
+
+    def _bulk_result(self, selection: CodeFlowSelection, data: List[CodeFlowModel]) -> CodeFlowBulkResult:
+        ids = [it.id for it in data]
+        changed = set(ids)
+        missing = [it for it in selection.ids or [] if it not in changed]
+        return CodeFlowBulkResult(ids=ids, missing=missing)
+
+    async def _get_processed(self, id: int, user: UserModel) -> CodeFlowModel:
+        data = await self.code_flow_repository.get_by_id(id)
+        data = self._fail_if_not_found(data)
+        if data.user_id != user.id and data.private:
+            raise UnauthorizedError("You are not the owner of this CodeFlow")
+        if not data.processed or data.flow_error is not None:
+            raise DomainError("CodeFlow has not been processed successfully")
+        return data
+
     def _fail_if_not_found(self, data: CodeFlowModel | None) -> CodeFlowModel:
         if not data:
             raise NotFoundError("CodeFlow not found")
         return data
 
 
-def get_code_flow_service(
-    code_flow_repository: CodeFlowRepository = Depends(get_code_flow_repository),
-    process_code_flow_job: ProcessCodeFlowJob = Depends(get_process_code_flow_job),
-) -> CodeFlowService:
-    return CodeFlowService(code_flow_repository, process_code_flow_job)
+async def get_code_flow_service(request: Request) -> CodeFlowService:
+    return request.app.state.container.code_flow_service
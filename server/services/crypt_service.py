@@ -1,15 +1,60 @@
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
+from typing import Any, Callable, Optional, TypeVar
+
+from ..env import env
+from ..exceptions import ServiceUnavailableError
 
 crypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
+T = TypeVar('T')
+
 
 class CryptService:
-    def hash_password(self, password):
-        return crypt_context.hash(password)
+    """bcrypt takes ~250 ms of CPU per call, it runs in a bounded pool of threads (bcrypt
+    releases the GIL) instead of the event loop. Calls beyond the workers and the queue are
+    rejected at once, a login burst gets 503 instead of slowing down every other request.
+
+    With 0 workers bcrypt runs inline on the event loop and nothing is rejected, as before
+    the pool (see scripts.py benchmark-login).
+    """
+
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="crypt") if workers > 0 else None
+        # Released when the work is done, not when the caller stops waiting for it
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    async def hash_password(self, password: str) -> str:
+        return await self._run(crypt_context.hash, password)
+
+    async def check_password(self, password: str, hashed_password: str) -> bool:
+        return await self._run(crypt_context.verify, password, hashed_password)
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        if self._executor is None:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise ServiceUnavailableError("Too many authentication requests, try again later")
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+
+class CryptServiceSingleton:
+    instance: Optional[CryptService] = None
 
-    def check_password(self, password, hashed_password):
-        return crypt_context.verify(password, hashed_password)
+    def get_instance(self) -> CryptService:
+        if CryptServiceSingleton.instance is None:
+            CryptServiceSingleton.instance = CryptService(env.crypt_workers, env.crypt_queue_size)
+        return CryptServiceSingleton.instance
 
 
 def get_crypt_service() -> CryptService:
-    return CryptService()
+    return CryptServiceSingleton().get_instance()
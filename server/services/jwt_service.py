@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from fastapi import Depends
+from fastapi import Depends, Query, Request
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import BaseModel
@@ -8,7 +8,8 @@ from typing import Callable, Optional
 from ..env import env
 from ..exceptions import UnauthorizedError
 from ..models import UserModel, UserRole
-from ..repositories.user_repository import UserRepository, get_user_repository
+from ..repositories.user_repository import UserRepository
+from .user_cache import UserCache
 
 
 JWT_ALGORITHM = 'HS256'
@@ -27,8 +28,9 @@ class TokenData(BaseModel):
 
 
 class JwtService:
-    def __init__(self, user_repository: UserRepository) -> None:
+    def __init__(self, user_repository: UserRepository, user_cache: UserCache) -> None:
         self.user_repository = user_repository
+        self.user_cache = user_cache
 
     def _create_token(self, data: dict, milliseconds: int, typ: str) -> str:
         data['exp'] = datetime.now() + timedelta(milliseconds=milliseconds)
@@ -46,11 +48,15 @@ class JwtService:
         try:
             data = jwt.decode(token, JWT_SECRET_KEY, algorithms=JWT_ALGORITHM)
             user_id = int(data['sub'])
-            user = await self.user_repository.get_by_id(user_id)
+            version = data.get('version')
+            user = self.user_cache.get(user_id, version)
             if user is None:
-                raise UnauthorizedError('Invalid token')
-            if user.version != data.get('version'):
-                raise UnauthorizedError('Token version mismatch')
+                user = await self.user_repository.get_by_id(user_id)
+                if user is None:
+                    raise UnauthorizedError('Invalid token')
+                if user.version != version:
+                    raise UnauthorizedError('Token version mismatch')
+                self.user_cache.put(user, version)
             return TokenData(user_id=user_id, user=user,
                             type=data.get('typ', 'access_token'),
                             value=token)
@@ -58,8 +64,8 @@ class JwtService:
             raise UnauthorizedError(str(e))
 
 
-def get_jwt_service(user_repository: UserRepository = Depends(get_user_repository)) -> JwtService:
-    return JwtService(user_repository)
+async def get_jwt_service(request: Request) -> JwtService:
+    return request.app.state.container.jwt_service
 
 
 async def get_required_token(
@@ -80,6 +86,17 @@ async def get_token(
     return await jwt_service.decode_token(token)
 
 
+async def get_stream_token(
+    jwt_service: JwtService = Depends(get_jwt_service),
+    token: Optional[str] = Depends(oauth2_schema),
+    access_token: Optional[str] = Query(default=None, description="For EventSource, it cannot send headers"),
+) -> Optional[TokenData]:
+    token = token or access_token
+    if not token:
+        return None
+    return await jwt_service.decode_token(token)
+
+
 def get_token_with_role(role: UserRole, *roles: UserRole) -> Callable[[TokenData], TokenData]:
     all_roles = list(roles)
     all_roles.append(role)
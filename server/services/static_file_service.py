@@ -0,0 +1,223 @@
+import anyio
+import os
+import re
+import stat
+
+from email.utils import formatdate
+from fastapi import Request, Response
+from mimetypes import guess_type
+from pathlib import Path
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+from typing import Dict, Optional, Tuple
+
+from .. import metrics
+from ..exceptions import NotFoundError
+from ..storage.artifact_storage import ArtifactStorage
+from .artifact_cache import ArtifactCache
+from .artifact_compression import enabled_encodings, encoded_path, negotiate_encoding
+
+
+# str.isdigit() also takes other scripts and superscripts, RFC 9110 positions are ASCII digits
+_DIGITS = re.compile(r"[0-9]*")
+
+class FileRangeResponse(Response):
+    # Like starlette FileResponse but it sends a byte range of the file and it hands the file
+    # descriptor to the server when it supports the ASGI zero copy send extension
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: Path,
+        start: int,
+        end: int,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        send_header_only: bool = False,
+    ) -> None:
+        self.path = path
+        self.start = start
+        self.count = end - start
+        self.status_code = status_code
+        self.media_type = media_type
+        self.send_header_only = send_header_only
+        self.background = None
+        self.init_headers({**(headers or {}), "content-length": str(self.count)})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            with self.path.open("rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.start,
+                    "count": self.count,
+                    "more_body": False,
+                })
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(self.start)
+                remaining = self.count
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    })
+                if remaining > 0:
+                    # The file was truncated after the headers were sent
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def make_etag(stat_result: os.stat_result, encoding: Optional[str] = None) -> str:
+    if encoding is not None:
+        return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}-{encoding}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # https://httpwg.org/specs/rfc9110.html#field.if-none-match (weak comparison)
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value == "*" or value.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    # Only a single "bytes" range is supported, any other range (or an invalid one, like
+    # "5-3") is served as a full response. Returns the [start, end) interval, raises
+    # ValueError when it is not satisfiable.
+    unit, _, ranges = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, sep, last = ranges.strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if not sep or not (first or last) or not _DIGITS.fullmatch(first) or not _DIGITS.fullmatch(last):
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - suffix, 0), size
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    end = min(int(last) + 1, size) if last else size
+    return start, end
+
+
+class StaticFileService:
+    def __init__(self, artifact_cache: ArtifactCache, artifact_storage: ArtifactStorage) -> None:
+        self.artifact_cache = artifact_cache
+        self.artifact_storage = artifact_storage
+
+    async def static_file_show(self, file_path: str, headers: Headers, method: str) -> Response:
+        try:
+            full_path = self.artifact_storage.path(file_path)
+        except ValueError:
+            raise NotFoundError(f"File {file_path} not found")
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, full_path)
+        except FileNotFoundError:
+            raise NotFoundError(f"File {file_path} not found")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise NotFoundError(f"File {file_path} not found")
+
+        content_type, _ = guess_type(full_path)
+        cache_key = file_path
+        encoding = None
+        accept_encoding = headers.get("accept-encoding")
+        if accept_encoding:
+            variant = await self._find_encoded_variant(full_path, stat_result, accept_encoding)
+            if variant is not None:
+                encoding, full_path, stat_result = variant
+                cache_key = f"{file_path}{full_path.suffix}"
+
+        size = stat_result.st_size
+        etag = make_etag(stat_result, encoding)
+        response_headers = {
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            # Artifacts are rewritten in place when a flow is reprocessed, clients revalidate with the ETag
+            "cache-control": "no-cache",
+            "accept-ranges": "bytes",
+            "vary": "Accept-Encoding",
+        }
+        if encoding is not None:
+            response_headers["content-encoding"] = encoding
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=response_headers)
+
+        start, end, status_code = 0, size, 200
+        range_header = headers.get("range")
+        if_range = headers.get("if-range")
+        if range_header is not None and (if_range is None or if_range == etag):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                return Response(status_code=416, headers={**response_headers, "content-range": f"bytes */{size}"})
+            if byte_range is not None:
+                start, end = byte_range
+                status_code = 206
+                response_headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+
+        if method == "GET" and self.artifact_cache.accepts(size):
+            content = self.artifact_cache.get(cache_key, etag)
+            if content is None:
+                content = await anyio.Path(full_path).read_bytes()
+                self.artifact_cache.put(cache_key, etag, content)
+            metrics.STATIC_BYTES_SENT.labels("cache", encoding or "identity").inc(end - start)
+            return Response(content[start:end], status_code=status_code,
+                            headers=response_headers, media_type=content_type)
+
+        if method == "GET":
+            metrics.STATIC_BYTES_SENT.labels("file", encoding or "identity").inc(end - start)
+        return FileRangeResponse(
+            full_path,
+            start,
+            end,
+            status_code=status_code,
+            headers=response_headers,
+            media_type=content_type,
+            send_header_only=method == "HEAD",
+        )
+
+    async def _find_encoded_variant(
+        self, path: Path, stat_result: os.stat_result, accept_encoding: str
+    ) -> Optional[Tuple[str, Path, os.stat_result]]:
+        available = enabled_encodings()
+        while available:
+            encoding = negotiate_encoding(accept_encoding, available)
+            if encoding is None:
+                return None
+            available.remove(encoding)
+            variant = encoded_path(path, encoding)
+            try:
+                variant_stat = await anyio.to_thread.run_sync(os.stat, variant)
+            except FileNotFoundError:
+                continue
+            # A variant older than the artifact belongs to a previous run
+            if variant_stat.st_mtime_ns >= stat_result.st_mtime_ns:
+                return encoding, variant, variant_stat
+        return None
+
+
+async def get_static_file_service(request: Request) -> StaticFileService:
+    return request.app.state.container.static_file_service
@@ -0,0 +1,105 @@
+import time
+
+from collections import OrderedDict
+from pydantic import BaseModel
+from typing import Optional, Tuple
+
+from ..env import env
+from ..models import UserModel
+
+
+class UserCacheStats(BaseModel):
+    hits: int
+    misses: int
+    expirations: int
+    evictions: int
+    invalidations: int
+    entries: int
+    max_entries: int
+    ttl_seconds: float
+
+
+class CachedUser:
+    __slots__ = ("expires_at", "user")
+
+    def __init__(self, expires_at: float, user: UserModel) -> None:
+        self.expires_at = expires_at
+        self.user = user
+
+
+class UserCache:
+    """In-process TTL + LRU cache of the users resolved from tokens, keyed by (user id, token version).
+
+    invalidate() only reaches this process, the TTL bounds how long the other workers
+    keep serving a user changed elsewhere.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[Tuple[int, Optional[int]], CachedUser] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get(self, user_id: int, version: Optional[int]) -> Optional[UserModel]:
+        key = (user_id, version)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # A copy, callers redact() the user they get
+        return entry.user.model_copy()
+
+    def put(self, user: UserModel, version: Optional[int]) -> None:
+        if not self.enabled:
+            return
+        key = (user.id, version)
+        self._entries[key] = CachedUser(time.monotonic() + self.ttl_seconds, user.model_copy())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: int) -> None:
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+            self.invalidations += 1
+
+    def stats(self) -> UserCacheStats:
+        return UserCacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            expirations=self.expirations,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+            entries=len(self._entries),
+            max_entries=self.max_entries,
+            ttl_seconds=self.ttl_seconds,
+        )
+
+
+class UserCacheSingleton:
+    instance: Optional[UserCache] = None
+
+    def get_instance(self) -> UserCache:
+        if UserCacheSingleton.instance is None:
+            UserCacheSingleton.instance = UserCache(env.user_cache_size, env.user_cache_ttl_seconds)
+        return UserCacheSingleton.instance
+
+
+def get_user_cache() -> UserCache:
+    return UserCacheSingleton().get_instance()
@@ -1,12 +1,14 @@
 from typing import Optional
-from fastapi import Depends
+from fastapi import Request
 from pydantic import BaseModel
 
+from ..database.connection import pin_to_primary
 from ..exceptions import NotFoundError, AlreadyExistsError, UnauthorizedError
 from ..models import UserModel, UserRole
-from ..repositories.user_repository import UserInsert, UserRepository, UserUpdate, get_user_repository
+from ..repositories.user_repository import UserInsert, UserRepository, UserUpdate
 
-from .crypt_service import CryptService, get_crypt_service
+from .crypt_service import CryptService
+from .user_cache import UserCache
 
 
 class UserLogin(BaseModel):
@@ -32,9 +34,10 @@ class ChangePassword(BaseModel):
 
 
 class UserService:
-    def __init__(self, crypt_service: CryptService, user_repository: UserRepository) -> None:
+    def __init__(self, crypt_service: CryptService, user_repository: UserRepository, user_cache: UserCache) -> None:
         self.crypt_service = crypt_service
         self.user_repository = user_repository
+        self.user_cache = user_cache
     
     async def user_show(self, user_id: int) -> UserModel:
         user = await self.user_repository.get_by_id(user_id)
@@ -44,36 +47,43 @@ class UserService:
     async def user_login(self, body: UserLogin) -> UserModel:
         user = await self.user_repository.get_by_username(body.username)
         user = self._fail_if_not_found(user)
-        self.fail_if_not_check_password(body.password, user.password)
+        await self.fail_if_not_check_password(body.password, user.password)
         return user.redact()
 
-    def fail_if_not_check_password(self, password: str, password_hashed: str):
-        if not self.crypt_service.check_password(password, password_hashed):
+    async def fail_if_not_check_password(self, password: str, password_hashed: str):
+        if not await self.crypt_service.check_password(password, password_hashed):
             raise UnauthorizedError("Invalid credentials")
 
     async def user_store(self, body: UserStore) -> UserModel:
+        pin_to_primary()
         user = await self.user_repository.get_by_username(body.username)
         self._fail_if_found(user)
-        user_id = await self.user_repository.insert(UserInsert(
+        user = await self.user_repository.insert(UserInsert(
             username=body.username,
-            password=self.crypt_service.hash_password(body.password),
+            password=await self.crypt_service.hash_password(body.password),
             role=body.role
         ))
-        return await self.user_show(user_id)
+        return user.redact()
     
     async def user_update_by_id(self, user_id: int, body: UserUpdateDiff) -> UserModel:
+        pin_to_primary()
         user = await self.user_repository.get_by_id(user_id)
         user = self._fail_if_not_found(user)
         return await self.user_update(user, body)
     
     async def user_update(self, user: UserModel, body: UserUpdateDiff) -> UserModel:
+        pin_to_primary()
         data = body.model_dump(exclude_unset=True)
-        await self.user_repository.update(user.id, UserUpdate(
+        password = await self.crypt_service.hash_password(data['password']) if 'password' in data else user.password
+        updated = await self.user_repository.update(user.id, UserUpdate(
             username=data['username'] if 'username' in data else user.username,
-            password=self.crypt_service.hash_password(data['password']) if 'password' in data else user.password,
+            password=password,
             role=data['role'] if 'role' in data else user.role,
         ))
-        return await self.user_show(user.id)
+        updated = self._fail_if_not_found(updated)
+        # Role and password changes apply to the next request of this worker, the others wait for the TTL
+        self.user_cache.invalidate(user.id)
+        return updated.redact()
 
     def _fail_if_not_found(self, data: UserModel | None) -> UserModel:
         if not data:
@@ -85,8 +95,5 @@ class UserService:
             raise AlreadyExistsError("User already exists")
 
 
-def get_user_service(
-    crypt_service: CryptService = Depends(get_crypt_service),
-    user_repository: UserRepository = Depends(get_user_repository)
-) -> UserService:
-    return UserService(crypt_service, user_repository)
+async def get_user_service(request: Request) -> UserService:
+    return request.app.state.container.user_service
@@ -0,0 +1,128 @@
+import hashlib
+import os
+
+from abc import ABC, abstractmethod
+from pathlib import Path, PurePosixPath
+from typing import Generator, List, Optional
+
+from ..env import env
+from ..resources import Resources
+
+
+class ArtifactStorage(ABC):
+    """Where the artifacts of the code flows (<file_id>_o.c, <file_id>_t.json, ...) live.
+
+    Artifacts are addressed by name only. Backends map a name to a file below `root`,
+    a remote backend (S3-like) would keep `root` as its local working copy.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    @abstractmethod
+    def relative_path(self, name: str) -> PurePosixPath:
+        pass
+
+    @abstractmethod
+    def iter_names(self) -> Generator[str, None, None]:
+        pass
+
+    def path(self, name: str) -> Path:
+        return self.root / self.relative_path(name)
+
+    def exists(self, name: str) -> bool:
+        return self.path(name).is_file()
+
+    def write_bytes(self, name: str, content: bytes) -> Path:
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        return path
+
+    def delete(self, name: str) -> None:
+        self.path(name).unlink(missing_ok=True)
+
+    def names_of(self, file_id: str) -> List[str]:
+        # Every artifact of a code flow starts with its file id, so they share a directory
+        directory = self.path(f"{file_id}_").parent
+        return [it.name for it in directory.glob(f"{file_id}_*") if it.is_file()]
+
+    def delete_all(self, file_id: str) -> None:
+        for name in self.names_of(file_id):
+            self.delete(name)
+
+    def _check_name(self, name: str) -> None:
+        if not name or "/" in name or "\\" in name or name.startswith("."):
+            raise ValueError(f"Invalid artifact name: {name}")
+
+
+class FlatArtifactStorage(ArtifactStorage):
+    # <root>/<name>
+    def relative_path(self, name: str) -> PurePosixPath:
+        self._check_name(name)
+        return PurePosixPath(name)
+
+    def iter_names(self) -> Generator[str, None, None]:
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    yield entry.name
+
+
+class ShardedArtifactStorage(ArtifactStorage):
+    # <root>/<h[0:2]>/<h[2:4]>/<name> where h is the hash of the file id, so all the
+    # artifacts of a code flow land in the same directory
+    levels = 2
+    width = 2
+
+    def relative_path(self, name: str) -> PurePosixPath:
+        self._check_name(name)
+        file_id = name.split("_", 1)[0]
+        digest = hashlib.md5(file_id.encode(), usedforsecurity=False).hexdigest()
+        shards = [digest[i * self.width:(i + 1) * self.width] for i in range(self.levels)]
+        return PurePosixPath(*shards, name)
+
+    def iter_names(self) -> Generator[str, None, None]:
+        pattern = "/".join(["?" * self.width] * self.levels + ["*"])
+        for path in self.root.glob(pattern):
+            if path.is_file() and not path.name.startswith("."):
+                yield path.name
+
+
+STORAGE_LAYOUTS = {
+    "flat": FlatArtifactStorage,
+    "sharded": ShardedArtifactStorage,
+}
+
+
+def create_artifact_storage(layout: str, root: Optional[Path] = None) -> ArtifactStorage:
+    if layout not in STORAGE_LAYOUTS:
+        raise Exception("Unknown artifact storage layout: " + layout)
+    return STORAGE_LAYOUTS[layout](root if root is not None else Resources.FILES)
+
+
+def migrate_artifacts(source: ArtifactStorage, target: ArtifactStorage) -> int:
+    # Moves files with rename(), both layouts must share the file system
+    moved = 0
+    for name in list(source.iter_names()):
+        source_path = source.path(name)
+        target_path = target.path(name)
+        if source_path == target_path:
+            continue
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source_path, target_path)
+        moved += 1
+    return moved
+
+
+class ArtifactStorageSingleton:
+    instance: Optional[ArtifactStorage] = None
+
+    def get_instance(self) -> ArtifactStorage:
+        if ArtifactStorageSingleton.instance is None:
+            ArtifactStorageSingleton.instance = create_artifact_storage(env.artifact_storage)
+        return ArtifactStorageSingleton.instance
+
+
+def get_artifact_storage() -> ArtifactStorage:
+    return ArtifactStorageSingleton().get_instance()
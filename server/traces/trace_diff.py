@@ -0,0 +1,151 @@
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from ..models import CodeFlowDiff, TraceDiffHunk, TraceDivergence
+from .trace_reader import TraceEvent, iter_trace_events
+
+
+# Events looked ahead in each trace to re-align after a divergence, it bounds memory and work
+DIFF_WINDOW = 256
+# Consecutive matching events required to accept a re-alignment point
+DIFF_CONFIRM = 4
+DIFF_MAX_HUNKS = 50
+# Only these payloads are comparable between runs, the others hold pids
+VALUE_EVENTS = {"variable_assign", "condition", "printf"}
+
+EventKey = Tuple[str, str, int]
+
+
+def _key(event: TraceEvent) -> EventKey:
+    # Without the pid, the pids of two runs differ. The merged trace holds one block per
+    # process in the order they started (see outs-concat in the runner), so the processes
+    # of two runs of the same program are compared in fork order.
+    return (event["function"], event["type"], event["line"])
+
+
+class _Stream:
+    def __init__(self, path: Path, window: int) -> None:
+        self.events: Iterator[TraceEvent] = (event for _offset, event in iter_trace_events(path))
+        self.buffer: Deque[TraceEvent] = deque()
+        self.window = window
+        self.step = 0
+        self.exhausted = False
+
+    def fill(self) -> None:
+        while not self.exhausted and len(self.buffer) < self.window:
+            event = next(self.events, None)
+            if event is None:
+                self.exhausted = True
+            else:
+                self.buffer.append(event)
+
+    def pop(self, count: int = 1) -> None:
+        for _ in range(count):
+            self.buffer.popleft()
+        self.step += count
+
+    def drain(self) -> int:
+        count = len(self.buffer)
+        self.buffer.clear()
+        for _ in self.events:
+            count += 1
+        self.exhausted = True
+        self.step += count
+        return count
+
+
+def _realign(a: Deque[TraceEvent], b: Deque[TraceEvent], confirm: int) -> Optional[Tuple[int, int]]:
+    keys_a = [_key(event) for event in a]
+    keys_b = [_key(event) for event in b]
+    positions: Dict[EventKey, List[int]] = {}
+    for j, key in enumerate(keys_b):
+        positions.setdefault(key, []).append(j)
+
+    best: Optional[Tuple[int, int]] = None
+    for i, key in enumerate(keys_a):
+        if best is not None and i >= best[0] + best[1]:
+            break
+        for j in positions.get(key, []):
+            if best is not None and i + j >= best[0] + best[1]:
+                break
+            length = min(confirm, len(keys_a) - i, len(keys_b) - j)
+            if keys_a[i:i + length] == keys_b[j:j + length]:
+                best = (i, j)
+                break
+    return best
+
+
+def diff_traces(a_path: Path, b_path: Path, a: int, b: int,
+                window: int = DIFF_WINDOW, confirm: int = DIFF_CONFIRM,
+                max_hunks: int = DIFF_MAX_HUNKS) -> CodeFlowDiff:
+    stream_a = _Stream(a_path, window)
+    stream_b = _Stream(b_path, window)
+    matched = 0
+    value_differences = 0
+    hunks: List[TraceDiffHunk] = []
+    hunk_count = 0
+    first_divergence: Optional[TraceDivergence] = None
+
+    def diverge() -> None:
+        nonlocal first_divergence
+        if first_divergence is None:
+            first_divergence = TraceDivergence(
+                kind="flow",
+                a_step=stream_a.step,
+                b_step=stream_b.step,
+                a_event=stream_a.buffer[0] if stream_a.buffer else None,
+                b_event=stream_b.buffer[0] if stream_b.buffer else None,
+            )
+
+    def add_hunk(a_start: int, a_count: int, b_start: int, b_count: int) -> None:
+        nonlocal hunk_count
+        hunk_count += 1
+        if len(hunks) < max_hunks:
+            hunks.append(TraceDiffHunk(a_start=a_start, a_count=a_count, b_start=b_start, b_count=b_count))
+
+    while True:
+        stream_a.fill()
+        stream_b.fill()
+        if not stream_a.buffer and not stream_b.buffer:
+            break
+
+        if not stream_a.buffer or not stream_b.buffer:
+            # One of the runs ended, the rest of the other one is a single hunk
+            diverge()
+            a_start, b_start = stream_a.step, stream_b.step
+            add_hunk(a_start, stream_a.drain(), b_start, stream_b.drain())
+            break
+
+        event_a, event_b = stream_a.buffer[0], stream_b.buffer[0]
+        if _key(event_a) == _key(event_b):
+            matched += 1
+            if event_a["type"] in VALUE_EVENTS and event_a["payload"] != event_b["payload"]:
+                value_differences += 1
+                if first_divergence is None:
+                    first_divergence = TraceDivergence(
+                        kind="value", a_step=stream_a.step, b_step=stream_b.step,
+                        a_event=event_a, b_event=event_b)
+            stream_a.pop()
+            stream_b.pop()
+            continue
+
+        diverge()
+        realign = _realign(stream_a.buffer, stream_b.buffer, confirm)
+        a_count, b_count = realign if realign is not None else (len(stream_a.buffer), len(stream_b.buffer))
+        add_hunk(stream_a.step, a_count, stream_b.step, b_count)
+        stream_a.pop(a_count)
+        stream_b.pop(b_count)
+
+    return CodeFlowDiff(
+        a=a,
+        b=b,
+        a_events=stream_a.step,
+        b_events=stream_b.step,
+        matched_events=matched,
+        value_differences=value_differences,
+        identical=first_divergence is None,
+        first_divergence=first_divergence,
+        hunk_count=hunk_count,
+        hunks=hunks,
+    )
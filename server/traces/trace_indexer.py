@@ -0,0 +1,151 @@
+import orjson
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Tuple
+
+from ..exceptions import NotFoundError
+from ..models import CodeFlowCheckpoint, CodeFlowState, CodeFlowStats, CodeFlowVariableSegment, VariableHistoryEntry
+from .trace_reader import iter_trace_events, iter_validated_trace_events
+from .trace_state import TraceState
+
+
+# Buffered variable_assign entries (over all variables) before they are flushed as segments
+VARIABLE_SEGMENT_ENTRIES = 100_000
+
+# Buffered checkpoints before they are written, each one holds a whole state snapshot
+CHECKPOINT_BATCH_SIZE = 100
+
+
+@dataclass
+class TraceIndex:
+    checkpoint_count: int = 0
+    variables: List[CodeFlowVariableSegment] = field(default_factory=list)
+    stats: CodeFlowStats = field(default_factory=CodeFlowStats)
+
+
+class CheckpointWriter:
+    """Hands the checkpoints to `write` in batches while the trace is read, so neither the
+    memory nor a single write grows with the length of the trace."""
+
+    def __init__(self, write: Callable[[List[CodeFlowCheckpoint]], None], batch_size: int = CHECKPOINT_BATCH_SIZE) -> None:
+        self.write = write
+        self.batch_size = batch_size
+        self.count = 0
+        self._pending: List[CodeFlowCheckpoint] = []
+
+    def add(self, checkpoint: CodeFlowCheckpoint) -> None:
+        self._pending.append(checkpoint)
+        self.count += 1
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            self.write(self._pending)
+            self._pending = []
+
+
+class VariableIndexWriter:
+    """Writes variable timelines as JSON lines, one line per (function, name) segment."""
+
+    def __init__(self, file: BinaryIO, segment_entries: int = VARIABLE_SEGMENT_ENTRIES) -> None:
+        self.file = file
+        self.segment_entries = segment_entries
+        self.segments: List[CodeFlowVariableSegment] = []
+        self._pending: Dict[Tuple[str, str], List[List[Any]]] = {}
+        self._types: Dict[Tuple[str, str], str] = {}
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._buffered = 0
+
+    def add(self, step: int, event: Dict[str, Any]) -> None:
+        payload = event["payload"]
+        key = (event["function"], payload["name"])
+        self._pending.setdefault(key, []).append([step, event["line"], event["pid"], payload["value"]])
+        self._types.setdefault(key, payload["type"])
+        self._buffered += 1
+        if self._buffered >= self.segment_entries:
+            self.flush()
+
+    def flush(self) -> None:
+        for key, entries in self._pending.items():
+            line = orjson.dumps(entries) + b"\n"
+            segment = self._counts.get(key, 0)
+            self.segments.append(CodeFlowVariableSegment(
+                function=key[0],
+                name=key[1],
+                type=self._types[key],
+                segment=segment,
+                byte_offset=self.file.tell(),
+                byte_length=len(line),
+                count=len(entries),
+            ))
+            self._counts[key] = segment + 1
+            self.file.write(line)
+        self._pending.clear()
+        self._buffered = 0
+
+
+def index_trace(
+    path: Path,
+    variables_path: Path,
+    checkpoint_interval: int,
+    write_checkpoints: Callable[[List[CodeFlowCheckpoint]], None],
+) -> TraceIndex:
+    index = TraceIndex()
+    state = TraceState()
+    stats = index.stats
+    checkpoints = CheckpointWriter(write_checkpoints)
+    with variables_path.open("wb") as variables_file:
+        variables = VariableIndexWriter(variables_file)
+        for step, (offset, event) in enumerate(iter_validated_trace_events(path)):
+            stats.event_count += 1
+            time = event["time"]
+            stats.time_start = time if stats.time_start is None else min(stats.time_start, time)
+            stats.time_end = time if stats.time_end is None else max(stats.time_end, time)
+            # A checkpoint holds the state *before* the event at `step` is applied
+            if step % checkpoint_interval == 0:
+                checkpoints.add(CodeFlowCheckpoint(step=step, byte_offset=offset, state=state.snapshot()))
+            state.apply(event)
+            if event["type"] == "variable_assign":
+                variables.add(step, event)
+        variables.flush()
+        checkpoints.flush()
+    index.checkpoint_count = checkpoints.count
+    index.variables = variables.segments
+    stats.size = path.stat().st_size
+    return index
+
+
+def seek_trace_state(path: Path, checkpoint: CodeFlowCheckpoint, step: int) -> CodeFlowState:
+    state = TraceState(checkpoint.state)
+    current = checkpoint.step
+    for _offset, event in iter_trace_events(path, checkpoint.byte_offset):
+        state.apply(event)
+        if current == step:
+            return CodeFlowState(step=step, event=event, processes=state.processes)
+        current += 1
+    raise NotFoundError(f"Step {step} out of range")
+
+
+def read_variable_history(
+    variables_path: Path,
+    segments: List[CodeFlowVariableSegment],
+    offset: int,
+    limit: int,
+) -> List[VariableHistoryEntry]:
+    # Segments before the offset are skipped by their count, without being read
+    history: List[VariableHistoryEntry] = []
+    with variables_path.open("rb") as f:
+        for segment in segments:
+            if len(history) >= limit:
+                break
+            if offset >= segment.count:
+                offset -= segment.count
+                continue
+            f.seek(segment.byte_offset)
+            entries = orjson.loads(f.read(segment.byte_length))
+            for step, line, pid, value in entries[offset:offset + limit - len(history)]:
+                history.append(VariableHistoryEntry(step=step, line=line, pid=pid, value=value))
+            offset = 0
+    return history
@@ -0,0 +1,128 @@
+import orjson
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+
+TraceEvent = Dict[str, Any]
+
+# Longest event line accepted when validating, it bounds the memory used per event
+MAX_EVENT_BYTES = 64 * 1024
+
+EVENT_FIELDS = {
+    "time": int,
+    "depth": int,
+    "pid": int,
+    "parent_pid": int,
+    "function": str,
+    "type": str,
+    "line": int,
+}
+
+PAYLOAD_FIELDS = {
+    "variable_declare": ("type", "name"),
+    "variable_assign": ("type", "name", "value"),
+    "function_call": ("function",),
+}
+
+
+class TraceFormatError(Exception):
+    pass
+
+
+def iter_trace_events(path: Path, offset: int = 0) -> Iterator[Tuple[int, TraceEvent]]:
+    # The runner writes one event per line (see outs-concat in the runner scripts.py):
+    # [
+    #   { ... },
+    #   { ... }
+    # ]
+    with path.open("rb") as f:
+        f.seek(offset)
+        position = offset
+        for line in f:
+            start = position
+            position += len(line)
+            text = line.strip()
+            if text in (b"", b"[", b"]"):
+                continue
+            if text.endswith(b","):
+                text = text[:-1]
+            try:
+                event = orjson.loads(text)
+            except orjson.JSONDecodeError as e:
+                raise TraceFormatError(f"Invalid event at byte {start}: {e}")
+            yield start, event
+
+
+def iter_validated_trace_events(path: Path, max_event_bytes: int = MAX_EVENT_BYTES) -> Iterator[Tuple[int, TraceEvent]]:
+    # Same as iter_trace_events() but it checks the whole document is a well formed
+    # array of events, reading a single line at a time
+    opened = False
+    closed = False
+    comma = False
+    events = 0
+    position = 0
+    number = 0
+    with path.open("rb") as f:
+        while True:
+            line = f.readline(max_event_bytes + 1)
+            if not line:
+                break
+            start = position
+            position += len(line)
+            number += 1
+            where = f"line {number} (byte {start})"
+            if len(line) > max_event_bytes and not line.endswith(b"\n"):
+                raise TraceFormatError(f"Event too long at {where}: more than {max_event_bytes} bytes")
+
+            text = line.strip()
+            if not text:
+                continue
+            if closed:
+                raise TraceFormatError(f"Unexpected data after ']' at {where}")
+            if not opened:
+                if text == b"[]":
+                    opened = closed = True
+                    continue
+                if text != b"[":
+                    raise TraceFormatError(f"Expected '[' at {where}")
+                opened = True
+                continue
+            if text == b"]":
+                if comma:
+                    raise TraceFormatError(f"Trailing ',' before ']' at {where}")
+                closed = True
+                continue
+            if events > 0 and not comma:
+                raise TraceFormatError(f"Missing ',' before {where}")
+
+            comma = text.endswith(b",")
+            if comma:
+                text = text[:-1]
+            try:
+                event = orjson.loads(text)
+            except orjson.JSONDecodeError as e:
+                raise TraceFormatError(f"Invalid JSON at {where}: {e}")
+            _validate_event(event, where)
+            events += 1
+            yield start, event
+
+    if not opened:
+        raise TraceFormatError("Empty trace")
+    if not closed:
+        raise TraceFormatError(f"Truncated trace: missing ']' after line {number} (byte {position})")
+
+
+def _validate_event(event: Any, where: str) -> None:
+    if not isinstance(event, dict):
+        raise TraceFormatError(f"Expected an event object at {where}")
+    for name, type in EVENT_FIELDS.items():
+        if not isinstance(event.get(name), type):
+            raise TraceFormatError(f"Invalid or missing '{name}' at {where}")
+    if "payload" not in event:
+        raise TraceFormatError(f"Missing 'payload' at {where}")
+    fields = PAYLOAD_FIELDS.get(event["type"])
+    if fields is not None:
+        payload = event["payload"]
+        if not isinstance(payload, dict) or any(name not in payload for name in fields):
+            raise TraceFormatError(f"Invalid '{event['type']}' payload at {where}")
@@ -0,0 +1,52 @@
+from typing import Any, Dict, List
+
+from .trace_reader import TraceEvent
+
+
+Frame = Dict[str, Any]
+
+
+class TraceState:
+    """Variables in scope per function frame and call stack of every process of a trace."""
+
+    def __init__(self, processes: Dict[str, List[Frame]] | None = None) -> None:
+        self.processes: Dict[str, List[Frame]] = processes if processes is not None else {}
+
+    def apply(self, event: TraceEvent) -> None:
+        pid = str(event["pid"])
+        function = event["function"]
+        type = event["type"]
+        stack = self.processes.setdefault(pid, [])
+
+        if type == "function_enter":
+            stack.append({"function": function, "line": event["line"], "variables": {}})
+            return
+        if type == "function_exit":
+            if stack and stack[-1]["function"] == function:
+                stack.pop()
+            return
+        if type == "exit":
+            stack.clear()
+            return
+
+        frame = self._frame(stack, function)
+        frame["line"] = event["line"]
+        if type == "variable_declare":
+            payload = event["payload"]
+            frame["variables"][payload["name"]] = {"type": payload["type"], "value": None}
+        elif type == "variable_assign":
+            payload = event["payload"]
+            frame["variables"][payload["name"]] = {"type": payload["type"], "value": payload["value"]}
+
+    def snapshot(self) -> Dict[str, List[Frame]]:
+        # Variable entries are replaced, never mutated, so copying the containers is enough
+        return {
+            pid: [{**frame, "variables": dict(frame["variables"])} for frame in stack]
+            for pid, stack in self.processes.items()
+        }
+
+    def _frame(self, stack: List[Frame], function: str) -> Frame:
+        # Child processes start in the middle of a function (after fork), without function_enter
+        if not stack or stack[-1]["function"] != function:
+            stack.append({"function": function, "line": 0, "variables": {}})
+        return stack[-1]
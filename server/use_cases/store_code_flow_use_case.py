@@ -1,22 +1,24 @@
 import c_inspectors
 import uuid
 
-from fastapi import Depends, UploadFile
+from fastapi import Request, UploadFile
 from pathlib import Path
 
-from ..exceptions import AlreadyExistsError, DomainError, UnexpectedError
-from ..jobs.process_code_flow_job import ProcessCodeFlowJob, get_process_code_flow_job
+from ..database.connection import pin_to_primary
+from ..exceptions import AlreadyExistsError, DomainError
+from ..jobs.process_code_flow_job import ProcessCodeFlowJob
 from ..mappers import CodeFlowShowMapper
 from ..models import CodeFlowShow, UserModel
-from ..repositories.code_flow_repository import CodeFlowInsert, CodeFlowRepository, get_code_flow_repository
-from ..resources import Resources
+from ..repositories.code_flow_repository import CodeFlowInsert, CodeFlowRepository
+from ..storage.artifact_storage import ArtifactStorage
 
 # TODO: https://www.slingacademy.com/article/how-to-run-background-tasks-in-fastapi/#:~:text=Define%20your%20task%20functions%20using%20the%20%40celery.task%20decorator%2C,terminals%20or%20processes%2C%20using%20the%20celery%20worker%20command.
 
 class StoreCodeFlowUseCase:
-    def __init__(self, repository: CodeFlowRepository, job: ProcessCodeFlowJob) -> None:
+    def __init__(self, repository: CodeFlowRepository, job: ProcessCodeFlowJob, storage: ArtifactStorage) -> None:
         self.repository = repository
         self.job = job
+        self.storage = storage
 
     async def execute(self, author: UserModel, code_file: UploadFile) -> CodeFlowShow:
         if code_file.filename is None:
@@ -28,17 +30,17 @@ class StoreCodeFlowUseCase:
             raise DomainError(
                 f"Invalid file extension: {code_path.suffix} (expected .c)")
 
+        pin_to_primary()
         data = await self.repository.get_by_user_id_and_name(author.id, code_file.filename)
         if data is not None:
             raise AlreadyExistsError(f"CodeFlow with name {code_file.filename} already exists")
 
         file_id = uuid.uuid4().hex
-        input_path = Resources.FILES / f"{file_id}_o.c"
-        output_path = Resources.FILES / f"{file_id}_t.c"
+        input_path = self.storage.path(f"{file_id}_o.c")
+        output_path = self.storage.path(f"{file_id}_t.c")
 
         try:
-            with input_path.open("wb") as f:
-                f.write(code_file.file.read())
+            self.storage.write_bytes(f"{file_id}_o.c", code_file.file.read())
             c_inspectors.ParserAndTransformFile(
                 input_path=input_path,
                 output_path=output_path,
@@ -52,15 +54,11 @@ class StoreCodeFlowUseCase:
             raise DomainError(f"Error processing file: {e}")
 
         try:
-            code_flow_id = await self.repository.insert(CodeFlowInsert(
+            data = await self.repository.insert(CodeFlowInsert(
                 name=code_file.filename,
                 file_id=file_id,
                 user_id=author.id,
             ))
-
-            data = await self.repository.get_by_id(code_flow_id)
-            if data is None:
-                raise UnexpectedError("CodeFlow is None after insert")
             return CodeFlowShowMapper.from_model(data)
         except Exception as e:
             if input_path.exists():
@@ -70,8 +68,5 @@ class StoreCodeFlowUseCase:
             raise DomainError(f"Error storing file: {e}")
 
 
-def get_store_code_flow_use_case(
-    repository: CodeFlowRepository = Depends(get_code_flow_repository),
-    job: ProcessCodeFlowJob = Depends(get_process_code_flow_job)
-) -> StoreCodeFlowUseCase:
-    return StoreCodeFlowUseCase(repository, job)
+async def get_store_code_flow_use_case(request: Request) -> StoreCodeFlowUseCase:
+    return request.app.state.container.store_code_flow_use_case
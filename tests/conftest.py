@@ -0,0 +1,63 @@
+import importlib.util
+import orjson
+import pytest
+
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+
+TraceWriter = Callable[..., Path]
+
+# Not a package, the runner image runs it as a script
+RUNNER_SCRIPTS = Path(__file__).parent.parent / "resources" / "linux-c-dev-tools" / "api-alpine-python" / "scripts.py"
+
+
+def trace_event(
+    time: int,
+    type: str = "printf",
+    payload: Optional[Dict[str, Any]] = None,
+    function: str = "main",
+    pid: int = 1,
+    line: int = 1,
+) -> Dict[str, Any]:
+    return {
+        "time": time,
+        "depth": 0,
+        "pid": pid,
+        "parent_pid": 0,
+        "function": function,
+        "type": type,
+        "line": line,
+        "payload": payload or {},
+    }
+
+
+def trace_bytes(events: List[Dict[str, Any]]) -> bytes:
+    # Same layout as outs-concat in the runner scripts.py, one event per line
+    lines = [orjson.dumps(event) for event in events]
+    return b"[\n" + b",\n".join(lines) + (b"\n" if lines else b"") + b"]\n"
+
+
+@pytest.fixture
+def write_trace(tmp_path: Path) -> TraceWriter:
+    def write(events: List[Dict[str, Any]], name: str = "trace.json") -> Path:
+        path = tmp_path / name
+        path.write_bytes(trace_bytes(events))
+        return path
+
+    return write
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def runner_scripts() -> ModuleType:
+    spec = importlib.util.spec_from_file_location("runner_scripts", RUNNER_SCRIPTS)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
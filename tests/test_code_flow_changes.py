@@ -0,0 +1,74 @@
+import asyncio
+import orjson
+import pytest
+
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict
+
+from server.database.init_database import init_database
+from server.database.sqlite_database import SQLiteDatabase, SQLiteProfile
+from server.env import env
+from server.repositories.code_flow_repository import MAX_CODE_FLOW_ID, CodeFlowRepository, now_ms
+from server.services.code_flow_service import CodeFlowService, decode_change_cursor
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def database(tmp_path: Path) -> AsyncIterator[SQLiteDatabase]:
+    database = SQLiteDatabase(f"sqlite+aiosqlite:///{tmp_path}/test.sqlite", SQLiteProfile(2, 5000, 1024, 0))
+    await database.connect()
+    await init_database(database)
+    try:
+        yield database
+    finally:
+        await database.disconnect()
+
+
+def service(database: SQLiteDatabase) -> CodeFlowService:
+    # code_flow_changes() only uses the repository
+    return CodeFlowService(CodeFlowRepository(database, database), *[None] * 7)  # type: ignore[arg-type]
+
+
+async def store(database: SQLiteDatabase, name: str, updated_at: int) -> int:
+    return await database.execute(
+        """INSERT INTO code_flow (name, file_id, processed, user_id, private, updated_at)
+        VALUES (:name, :name, 0, 1, 0, :updated_at)""",
+        {"name": name, "updated_at": updated_at})
+
+
+async def changes(service: CodeFlowService, since: str | None, limit: int = 500) -> Dict[str, Any]:
+    return orjson.loads(await service.code_flow_changes(None, since, limit))
+
+
+async def test_drained_cursor_round_trips_and_fits_an_int4_id(
+        database: SQLiteDatabase, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(env, "change_settle_ms", 0)
+    codeflows = service(database)
+    await store(database, "a.c", now_ms() - 60_000)
+
+    first = await changes(codeflows, None)
+
+    assert [it["name"] for it in first["changed"]] == ["a.c"] and not first["has_more"]
+    cursor = decode_change_cursor(first["next_cursor"])
+    assert cursor is not None and cursor.id == MAX_CODE_FLOW_ID <= 2 ** 31 - 1
+
+    await asyncio.sleep(0.01)
+    await store(database, "b.c", now_ms())
+    second = await changes(codeflows, first["next_cursor"])
+
+    assert [it["name"] for it in second["changed"]] == ["b.c"]
+
+
+async def test_cursor_of_a_full_page_resumes_after_its_last_row(database: SQLiteDatabase) -> None:
+    codeflows = service(database)
+    updated_at = now_ms() - 60_000
+    for name in ("a.c", "b.c", "c.c"):
+        await store(database, name, updated_at)
+
+    first = await changes(codeflows, None, limit=2)
+    second = await changes(codeflows, first["next_cursor"], limit=2)
+
+    assert first["has_more"] and not second["has_more"]
+    assert [it["name"] for it in first["changed"] + second["changed"]] == ["a.c", "b.c", "c.c"]
@@ -0,0 +1,74 @@
+import base64
+import orjson
+import pytest
+
+from server.exceptions import DomainError
+from server.repositories.code_flow_repository import CodeFlowChangeCursor, CodeFlowCursor
+from server.services.code_flow_service import (
+    decode_change_cursor,
+    decode_cursor,
+    decode_offset_cursor,
+    encode_change_cursor,
+    encode_cursor,
+    encode_offset_cursor,
+)
+
+
+def raw(values: object) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("name", ["a", "main.c", "ñandú 🐍", "a/b?c=d&e", ""])
+def test_cursor_round_trip(name: str) -> None:
+    cursor = CodeFlowCursor(name=name, id=42)
+
+    value = encode_cursor(cursor)
+
+    assert "=" not in value
+    assert decode_cursor(value) == cursor
+
+
+def test_change_cursor_round_trip() -> None:
+    cursor = CodeFlowChangeCursor(updated_at=1_700_000_000_000, id=7)
+
+    assert decode_change_cursor(encode_change_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize("offset", [0, 1, 10_000])
+def test_offset_cursor_round_trip(offset: int) -> None:
+    assert decode_offset_cursor(encode_offset_cursor(offset)) == offset
+
+
+def test_no_cursor() -> None:
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+    assert decode_change_cursor(None) is None
+    assert decode_offset_cursor(None) == 0
+
+
+@pytest.mark.parametrize("value", [
+    "not base64!",
+    "ñ",
+    raw("a"),
+    raw(["a"]),
+    raw(["a", 1, 2]),
+    raw([1, 2]),
+    raw(["a", "b"]),
+    raw({"name": "a", "id": 1}),
+    "YQ",
+])
+def test_invalid_cursor(value: str) -> None:
+    with pytest.raises(DomainError, match="Invalid cursor"):
+        decode_cursor(value)
+
+
+@pytest.mark.parametrize("value", [raw([1]), raw([1, "a"]), raw(["a", 1]), "x"])
+def test_invalid_change_cursor(value: str) -> None:
+    with pytest.raises(DomainError, match="Invalid cursor"):
+        decode_change_cursor(value)
+
+
+@pytest.mark.parametrize("value", [raw([-1]), raw([1.5]), raw(["1"]), raw([1, 2]), raw(1), "x"])
+def test_invalid_offset_cursor(value: str) -> None:
+    with pytest.raises(DomainError, match="Invalid cursor"):
+        decode_offset_cursor(value)
@@ -0,0 +1,179 @@
+import asyncio
+import pytest
+
+from pathlib import Path
+from typing import AsyncIterator
+
+from server.database.init_database import init_database
+from server.database.sqlite_database import SQLiteDatabase, SQLiteProfile
+from server.jobs.code_flow_queue import CodeFlowQueue
+from server.jobs.job_events import JobEventBroker
+from server.jobs.job_relay import MAX_MESSAGE_BYTES, JobRelay
+from server.jobs.live_trace import LiveTraceRegistry
+from server.models import CodeFlowJobEvent, CodeFlowJobStatus
+from server.repositories.code_flow_job_message_repository import CodeFlowJobMessageRepository
+from server.repositories.code_flow_job_repository import CodeFlowJobRepository
+from server.repositories.code_flow_repository import CodeFlowRepository
+
+
+pytestmark = pytest.mark.anyio
+
+LEASE_MS = 60_000
+
+
+@pytest.fixture
+async def database(tmp_path: Path) -> AsyncIterator[SQLiteDatabase]:
+    database = SQLiteDatabase(f"sqlite+aiosqlite:///{tmp_path}/test.sqlite", SQLiteProfile(2, 5000, 1024, 0))
+    await database.connect()
+    await init_database(database)
+    try:
+        yield database
+    finally:
+        await database.disconnect()
+
+
+async def store(database: SQLiteDatabase, name: str) -> int:
+    return await database.execute(
+        """INSERT INTO code_flow (name, file_id, processed, user_id, private) VALUES (:name, :name, 0, 1, 0)""",
+        {"name": name})
+
+
+def queue(database: SQLiteDatabase, worker: str, poll_interval: float = 0.05) -> CodeFlowQueue:
+    return CodeFlowQueue(
+        database, CodeFlowJobRepository(database), CodeFlowRepository(database, database), worker, poll_interval, 60)
+
+
+async def test_claim_in_queue_order_once(database: SQLiteDatabase) -> None:
+    jobs = CodeFlowJobRepository(database)
+    for id in (3, 1, 2):
+        await jobs.enqueue(id)
+
+    claimed = [await jobs.claim("a", LEASE_MS) for _ in range(3)]
+
+    # Queued in the same millisecond, the ids break the tie
+    assert sorted(claimed) == [1, 2, 3]
+    assert await jobs.claim("b", LEASE_MS) is None
+    assert await jobs.count() == 3
+
+
+async def test_expired_claims_are_claimed_again(database: SQLiteDatabase) -> None:
+    jobs = CodeFlowJobRepository(database)
+    await jobs.enqueue(1)
+    assert await jobs.claim("dead", LEASE_MS) == 1
+    assert await jobs.is_claimed(1, LEASE_MS)
+
+    await database.execute("UPDATE code_flow_job SET claimed_at = claimed_at - :lease", {"lease": LEASE_MS + 1})
+
+    assert not await jobs.is_claimed(1, LEASE_MS)
+    assert await jobs.claim("alive", LEASE_MS) == 1
+    assert await database.fetch_val("SELECT claimed_by FROM code_flow_job WHERE code_flow_id = 1") == "alive"
+
+
+async def test_complete_keeps_jobs_queued_again(database: SQLiteDatabase) -> None:
+    jobs = CodeFlowJobRepository(database)
+    await jobs.enqueue(1)
+    await jobs.claim("a", LEASE_MS)
+
+    await jobs.enqueue(1)
+    await jobs.complete(1, "a")
+
+    assert await jobs.count() == 1
+    assert await jobs.claim("b", LEASE_MS) == 1
+    await jobs.complete(1, "b")
+    assert await jobs.count() == 0
+
+
+async def test_queue_get_skips_deleted_code_flows(database: SQLiteDatabase) -> None:
+    id = await store(database, "a.c")
+    jobs = queue(database, "a")
+    await jobs.job_repository.enqueue(id + 100)
+    await asyncio.sleep(0.01)
+    await jobs.put(await jobs.repository.get_by_id(id))
+
+    data = await asyncio.wait_for(jobs.get(), 5)
+
+    assert data.id == id
+    assert await jobs.is_claimed(id)
+    await jobs.task_done(data)
+    assert await jobs.job_repository.count() == 0
+
+
+async def test_queue_put_wakes_up_the_worker_of_the_process(database: SQLiteDatabase) -> None:
+    id = await store(database, "a.c")
+    jobs = queue(database, "a", poll_interval=60)
+    waiting = asyncio.create_task(jobs.get())
+    await asyncio.sleep(0.05)
+
+    await jobs.put(await jobs.repository.get_by_id(id))
+
+    assert (await asyncio.wait_for(waiting, 5)).id == id
+
+
+def relay(database: SQLiteDatabase, origin: str) -> JobRelay:
+    return JobRelay(
+        database, CodeFlowJobMessageRepository(database), JobEventBroker(16), LiveTraceRegistry(100, 16), origin, 0.01)
+
+
+async def test_relay_publishes_the_events_of_the_other_processes(database: SQLiteDatabase) -> None:
+    worker, api = relay(database, "worker"), relay(database, "api")
+    tasks = [asyncio.create_task(worker.run()), asyncio.create_task(api.run())]
+    try:
+        await asyncio.sleep(0.05)
+        with api.event_broker.subscribe(lambda _event: True) as received, \
+                worker.event_broker.subscribe(lambda _event: True) as sent:
+            event = CodeFlowJobEvent(
+                code_flow_id=1, user_id=1, private=False, status=CodeFlowJobStatus.FAILED, flow_error="x" * 20_000)
+            await worker.publish(event)
+
+            assert await sent.get(1) == event
+            relayed = await received.get(1)
+            assert relayed is not None and relayed.status == CodeFlowJobStatus.FAILED
+            # Cut to fit a PostgreSQL notification
+            assert relayed.flow_error is not None and relayed.flow_error.endswith("...") and len(relayed.flow_error) < 8000
+            # The worker does not get its own event back
+            assert await sent.get(0.1) is None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def test_relay_mirrors_a_watched_live_trace(database: SQLiteDatabase) -> None:
+    worker, api = relay(database, "worker"), relay(database, "api")
+    tasks = [asyncio.create_task(worker.run()), asyncio.create_task(api.run())]
+    try:
+        await asyncio.sleep(0.05)
+        live = worker.live_traces.start(1)
+        mirror = api.live_traces.mirror(1)
+        assert not live.subscribed
+
+        await api.watch_live(1)
+        for _ in range(100):
+            if live.subscribed:
+                break
+            await asyncio.sleep(0.01)
+        assert live.watched
+
+        with mirror.subscribe() as subscription:
+            assert subscription.skipped is None
+            events = [{"time": time, "text": "x" * 1000} for time in range(20)]
+            await worker.publish_live(1, events)
+            await worker.finish_live(1)
+
+            received = []
+            while True:
+                item = await subscription.get(1)
+                assert item is not None
+                if not isinstance(item, list):
+                    break
+                received += item
+
+        assert received == events
+        assert api.live_traces.get(1) is None
+        sizes = await database.fetch_all(
+            "SELECT LENGTH(payload) AS size FROM code_flow_job_message WHERE payload LIKE :live", {"live": '{"type":"live"%'})
+        assert len(sizes) > 1 and max(row["size"] for row in sizes) <= MAX_MESSAGE_BYTES
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
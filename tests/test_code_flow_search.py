@@ -0,0 +1,52 @@
+import pytest
+
+from pathlib import Path
+from typing import AsyncIterator, List
+
+from server.database.init_database import init_database
+from server.database.sqlite_database import SQLiteDatabase, SQLiteProfile
+from server.repositories.code_flow_repository import CodeFlowFilter, CodeFlowRepository
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def database(tmp_path: Path) -> AsyncIterator[SQLiteDatabase]:
+    database = SQLiteDatabase(f"sqlite+aiosqlite:///{tmp_path}/test.sqlite", SQLiteProfile(2, 5000, 1024, 0))
+    await database.connect()
+    await init_database(database)
+    try:
+        user_id = await database.execute(
+            "INSERT INTO users (username, password, role) VALUES ('bob', '', 'student')")
+        for name in ("ab.c", "abc_main.c", "sort.c", "x%y.c"):
+            await database.execute(
+                """INSERT INTO code_flow (name, file_id, processed, user_id, private) VALUES (:name, :name, 0, :user_id, 0)""",
+                {"name": name, "user_id": user_id})
+        yield database
+    finally:
+        await database.disconnect()
+
+
+async def search(database: SQLiteDatabase, text: str) -> List[str]:
+    repository = CodeFlowRepository(database, database)
+    rows = await repository.search_records(text, CodeFlowFilter(), 50, 0)
+    assert await repository.search_count(text, CodeFlowFilter()) == len(rows)
+    return [row["name"] for row in rows]
+
+
+@pytest.mark.parametrize("text, names", [
+    ("sort", ["sort.c"]),
+    ("SORT", ["sort.c"]),
+    # Shorter than a trigram, alone and beside a longer term
+    ("ab", ["ab.c", "abc_main.c"]),
+    ("ab c", ["ab.c", "abc_main.c"]),
+    ("main ab", ["abc_main.c"]),
+    # Shorter names first
+    ("bo", ["ab.c", "x%y.c", "sort.c", "abc_main.c"]),
+    ("% .", ["x%y.c"]),
+    ("_m", ["abc_main.c"]),
+    ("zz", []),
+])
+async def test_search_matches_short_terms_as_substrings(database: SQLiteDatabase, text: str, names: List[str]) -> None:
+    assert await search(database, text) == names
@@ -0,0 +1,142 @@
+import io
+import json
+import orjson
+import pytest
+
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, Optional
+
+from .conftest import trace_event
+
+
+def write_outs(tmp_path: Path, processes: List[tuple]) -> Path:
+    # (file name, pid, parent pid, time of the first event)
+    outs = tmp_path / "outs"
+    outs.mkdir()
+    for name, pid, parent_pid, time in processes:
+        event = {**trace_event(time, pid=pid), "parent_pid": parent_pid}
+        (outs / name).write_bytes(orjson.dumps(event) + b"\n")
+    return outs
+
+
+def names(files: List[Path]) -> List[str]:
+    return [file.name for file in files]
+
+
+def test_ordered_outs_walks_the_fork_tree_depth_first(runner_scripts: ModuleType, tmp_path: Path) -> None:
+    outs = write_outs(tmp_path, [
+        ("a", 900, 1, 0),
+        ("b", 100, 900, 5),
+        ("c", 50, 900, 3),
+        ("d", 101, 100, 6),
+    ])
+
+    assert names(runner_scripts.ordered_outs(outs)) == ["a", "c", "b", "d"]
+
+
+def test_ordered_outs_breaks_ties_by_pid(runner_scripts: ModuleType, tmp_path: Path) -> None:
+    outs = write_outs(tmp_path, [("z", 1, 0, 0), ("x", 3, 1, 2), ("y", 2, 1, 2)])
+
+    assert names(runner_scripts.ordered_outs(outs)) == ["z", "y", "x"]
+
+
+def test_ordered_outs_keeps_unreadable_files_and_pid_cycles(runner_scripts: ModuleType, tmp_path: Path) -> None:
+    outs = write_outs(tmp_path, [("a", 1, 0, 0), ("b", 7, 8, 4), ("c", 8, 7, 3)])
+    (outs / "empty").write_bytes(b"")
+    (outs / "broken").write_bytes(b"{not json\n")
+
+    # The roots first, then the processes no root reaches
+    assert names(runner_scripts.ordered_outs(outs)) == ["a", "broken", "empty", "c", "b"]
+
+
+def condition(time: int) -> Dict[str, Any]:
+    return trace_event(time, "condition", {"value": 1}, line=3)
+
+
+def loop(iterations: int) -> List[Dict[str, Any]]:
+    # for (i = 0; i < iterations; i++) i = ...; then a printf after the loop
+    events = [trace_event(0, line=2)]
+    for i in range(iterations):
+        events += [condition(len(events)), trace_event(len(events) + 1, "variable_assign", {"value": str(i)}, line=4)]
+    events += [condition(len(events)), trace_event(len(events) + 1, line=5)]
+    return events
+
+
+def merge(runner_scripts: ModuleType, events: List[Dict[str, Any]], keep: Optional[int], **limits: Any) -> List[Dict[str, Any]]:
+    fout = io.StringIO()
+    fout.write("[")
+    writer = runner_scripts.TraceWriter(fout, **limits)
+    compactor = runner_scripts.LoopCompactor(writer, keep) if keep is not None else None
+    try:
+        for event in events:
+            line = json.dumps(event)
+            if compactor is None:
+                writer.write(line)
+            else:
+                compactor.add(line)
+        if compactor is not None:
+            compactor.close()
+    except runner_scripts.TraceLimitExceeded as e:
+        writer.truncate(str(e))
+    fout.write("\n]")
+    return json.loads(fout.getvalue())
+
+
+def test_loop_compactor_keeps_the_first_and_last_iterations(runner_scripts: ModuleType) -> None:
+    events = loop(10)
+
+    merged = merge(runner_scripts, events, 2)
+
+    compacted = merged[5]
+    assert compacted["type"] == "loop_compacted"
+    assert compacted["payload"] == {"iterations": 6, "events_per_iteration": 2}
+    assert compacted["time"] == events[5]["time"]
+    assert merged[:5] == events[:5]
+    assert merged[6:] == events[-6:]
+
+
+def test_loop_compactor_leaves_short_loops(runner_scripts: ModuleType) -> None:
+    events = loop(4)
+
+    assert merge(runner_scripts, events, 2) == events
+
+
+def test_loop_compactor_with_keep_0_compacts_two_or_more_iterations_only(runner_scripts: ModuleType) -> None:
+    once = loop(1)
+    assert merge(runner_scripts, once, 0) == once
+    assert merge(runner_scripts, loop(5), 2) == loop(5)
+
+    events = loop(3)
+    merged = merge(runner_scripts, events, 0)
+
+    assert merged[1]["type"] == "loop_compacted"
+    assert merged[1]["payload"] == {"iterations": 3, "events_per_iteration": 2}
+    assert [merged[0]] + merged[2:] == [events[0]] + events[-2:]
+
+
+def test_loop_compactor_ends_a_run_when_the_iterations_change(runner_scripts: ModuleType) -> None:
+    # The 5th iteration takes another branch, the runs before and after it are not longer than 2 * keep
+    events = loop(8)
+    events[10] = {**events[10], "line": 40}
+
+    assert merge(runner_scripts, events, 2) == events
+
+
+def test_loop_compactor_writes_iterations_longer_than_the_limit(runner_scripts: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(runner_scripts, "MAX_ITERATION_EVENTS", 3)
+    events = [trace_event(0, line=2), condition(1)] + [trace_event(2 + i, line=4) for i in range(10)] + [condition(12)]
+
+    assert merge(runner_scripts, events, 1) == events
+
+
+def test_trace_writer_truncates_to_a_valid_array(runner_scripts: ModuleType) -> None:
+    events = [trace_event(time) for time in range(10)]
+    size = len(json.dumps(events[0]))
+
+    merged = merge(runner_scripts, events, None, max_bytes=size * 3)
+
+    assert merged[:3] == events[:3]
+    assert merged[3]["type"] == "trace_truncated"
+    assert merged[3]["time"] == events[2]["time"]
+    assert len(merged) == 4
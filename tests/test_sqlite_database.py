@@ -0,0 +1,168 @@
+import asyncio
+import pytest
+import sqlite3
+
+from pathlib import Path
+from typing import AsyncIterator, List
+
+from server.database.sqlite_database import SQLiteDatabase, SQLiteProfile, _is_read
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def database(tmp_path: Path) -> AsyncIterator[SQLiteDatabase]:
+    database = SQLiteDatabase(f"sqlite+aiosqlite:///{tmp_path}/test.sqlite", SQLiteProfile(2, 5000, 1024, 0))
+    await database.connect()
+    await database.execute("CREATE TABLE item (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)")
+    try:
+        yield database
+    finally:
+        await database.disconnect()
+
+
+async def names(database: SQLiteDatabase) -> List[str]:
+    return [row["name"] for row in await database.fetch_all("SELECT name FROM item ORDER BY id")]
+
+
+@pytest.mark.parametrize("query, read", [
+    ("SELECT 1", True),
+    ("  select * FROM item", True),
+    ("EXPLAIN QUERY PLAN SELECT * FROM item", True),
+    ("WITH x AS (SELECT 1) SELECT * FROM x", True),
+    ("WITH x AS (SELECT 1) DELETE FROM item WHERE id IN x", False),
+    ("WITH x AS (SELECT 1) insert INTO item (name) SELECT 'a' FROM x", False),
+    ("INSERT INTO item (name) VALUES ('a')", False),
+    ("UPDATE item SET name = 'a'", False),
+    ("PRAGMA user_version", False),
+    ("CREATE TABLE t (id INTEGER)", False),
+])
+def test_is_read(query: str, read: bool) -> None:
+    assert _is_read(query) == read
+
+
+async def test_execute_returns_the_rowid_of_inserts_and_the_rowcount_of_the_others(database: SQLiteDatabase) -> None:
+    assert await database.execute("INSERT INTO item (name) VALUES (:name)", {"name": "a"}) == 1
+    assert await database.execute("INSERT INTO item (name) VALUES (:name)", {"name": "b"}) == 2
+    assert await database.execute("UPDATE item SET name = name || '!'") == 2
+    assert await names(database) == ["a!", "b!"]
+
+
+async def test_fetch_one_and_fetch_val(database: SQLiteDatabase) -> None:
+    await database.execute_many("INSERT INTO item (name) VALUES (:name)", [{"name": "a"}, {"name": "b"}])
+
+    row = await database.fetch_one("SELECT id, name FROM item WHERE name = :name", {"name": "b"})
+
+    assert row is not None and dict(row) == {"id": 2, "name": "b"} and row._mapping["name"] == "b"
+    assert await database.fetch_one("SELECT id FROM item WHERE name = 'x'") is None
+    assert await database.fetch_val("SELECT id, name FROM item WHERE id = 1", column="name") == "a"
+    assert await database.fetch_val("SELECT id, name FROM item WHERE id = 1", column=1) == "a"
+    assert await database.fetch_val("SELECT id FROM item WHERE name = 'x'") is None
+
+
+async def test_reads_go_to_the_read_only_connections(database: SQLiteDatabase) -> None:
+    # A write classified as a read would fail there, query_only is on
+    reader = await database._readers.get()
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            await reader.execute("INSERT INTO item (name) VALUES ('a')")
+    finally:
+        database._readers.put_nowait(reader)
+
+    rows = await database.fetch_all("WITH x AS (SELECT 'a' AS name) INSERT INTO item (name) SELECT name FROM x RETURNING id")
+    assert [row["id"] for row in rows] == [1]
+    assert await database.fetch_val("PRAGMA user_version = 3") is None
+    assert await database.fetch_val("PRAGMA user_version") == 3
+
+
+async def test_iterate_routes_like_fetch_all(database: SQLiteDatabase) -> None:
+    await database.execute_many("INSERT INTO item (name) VALUES (:name)", [{"name": "a"}, {"name": "b"}])
+
+    assert [row["name"] async for row in database.iterate("SELECT name FROM item ORDER BY id")] == ["a", "b"]
+    deleted = [row["id"] async for row in database.iterate("DELETE FROM item WHERE name = 'a' RETURNING id")]
+    assert deleted == [1]
+    assert await names(database) == ["b"]
+
+
+async def test_transaction_commits(database: SQLiteDatabase) -> None:
+    async with database.transaction():
+        await database.execute("INSERT INTO item (name) VALUES ('a')")
+        # Reads inside the transaction use its connection and see its writes
+        assert await names(database) == ["a"]
+
+    assert await names(database) == ["a"]
+
+
+async def test_transaction_rolls_back_with_the_nested_ones(database: SQLiteDatabase) -> None:
+    with pytest.raises(RuntimeError):
+        async with database.transaction():
+            await database.execute("INSERT INTO item (name) VALUES ('a')")
+            async with database.transaction():
+                await database.execute("INSERT INTO item (name) VALUES ('b')")
+            raise RuntimeError()
+
+    assert await names(database) == []
+
+
+async def test_other_tasks_read_beside_a_transaction_and_write_after_it(database: SQLiteDatabase) -> None:
+    inserted = asyncio.Event()
+    order: List[str] = []
+
+    async def transaction() -> None:
+        async with database.transaction():
+            await database.execute("INSERT INTO item (name) VALUES ('a')")
+            inserted.set()
+            await asyncio.sleep(0.1)
+            order.append("commit")
+
+    async def write() -> None:
+        await inserted.wait()
+        await database.execute("INSERT INTO item (name) VALUES ('b')")
+        order.append("write")
+
+    task = asyncio.create_task(transaction())
+    writer = asyncio.create_task(write())
+    await inserted.wait()
+    # Not blocked by the transaction and without its uncommitted row
+    assert await names(database) == []
+    await asyncio.gather(task, writer)
+
+    assert order == ["commit", "write"]
+    assert await names(database) == ["a", "b"]
+
+
+async def test_connection_holds_the_writer_for_its_block(database: SQLiteDatabase) -> None:
+    order: List[str] = []
+
+    async def write() -> None:
+        await database.execute("INSERT INTO item (name) VALUES ('b')")
+        order.append("write")
+
+    async with database.connection() as connection:
+        writer = asyncio.create_task(write())
+        await connection.execute("INSERT INTO item (name) VALUES ('a')")
+        await asyncio.sleep(0.05)
+        assert await connection.fetch_val("SELECT COUNT(*) FROM item") == 1
+        with pytest.raises(RuntimeError):
+            async with connection.transaction():
+                await connection.execute("INSERT INTO item (name) VALUES ('x')")
+                raise RuntimeError()
+        assert [row["name"] async for row in connection.iterate("SELECT name FROM item")] == ["a"]
+        assert connection.raw_connection is database._writer
+        order.append("block")
+    await writer
+
+    assert order == ["block", "write"]
+    assert await database.connection().fetch_all("SELECT name FROM item ORDER BY id") == [{"name": "a"}, {"name": "b"}]
+
+
+async def test_in_memory_database_uses_the_writer_only() -> None:
+    database = SQLiteDatabase("sqlite+aiosqlite:///:memory:", SQLiteProfile(2, 5000, 1024, 0))
+    await database.connect()
+    try:
+        await database.execute("CREATE TABLE item (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)")
+        await database.execute("INSERT INTO item (name) VALUES ('a')")
+        assert await names(database) == ["a"]
+    finally:
+        await database.disconnect()
@@ -0,0 +1,44 @@
+import pytest
+
+from server.services.static_file_service import parse_range
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes=0-9", (0, 10)),
+    ("bytes=10-", (10, 100)),
+    ("bytes=90-200", (90, 100)),
+    ("bytes=-10", (90, 100)),
+    ("bytes=-500", (0, 100)),
+    ("bytes=99-99", (99, 100)),
+    ("Bytes = 1 - 2", (1, 3)),
+])
+def test_single_range(value: str, expected: tuple) -> None:
+    assert parse_range(value, 100) == expected
+
+
+@pytest.mark.parametrize("value", [
+    "items=0-9",
+    "bytes=0-1,5-6",
+    "bytes=5-3",
+    "bytes=-",
+    "bytes=5",
+    "bytes=a-b",
+    "bytes=-1-2",
+    "bytes=٣-٥",
+    "bytes=0-²",
+    "bytes=１-",
+])
+def test_ignored_ranges(value: str) -> None:
+    assert parse_range(value, 100) is None
+
+
+@pytest.mark.parametrize("value, size", [
+    ("bytes=100-", 100),
+    ("bytes=100-200", 100),
+    ("bytes=-0", 100),
+    ("bytes=0-", 0),
+    ("bytes=-5", 0),
+])
+def test_unsatisfiable_ranges(value: str, size: int) -> None:
+    with pytest.raises(ValueError):
+        parse_range(value, size)
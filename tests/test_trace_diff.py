@@ -0,0 +1,97 @@
+from collections import deque
+from typing import Any, Dict, List
+
+from server.traces.trace_diff import _realign, diff_traces
+
+from .conftest import TraceWriter, trace_event
+
+
+def printf(line: int, text: str = "", pid: int = 1) -> Dict[str, Any]:
+    return trace_event(line, "printf", {"text": text}, pid=pid, line=line)
+
+
+def lines(*numbers: int) -> List[Dict[str, Any]]:
+    return [printf(line) for line in numbers]
+
+
+def test_runs_with_other_pids_are_identical(write_trace: TraceWriter) -> None:
+    a = write_trace(lines(1, 2, 3, 4), "a.json")
+    b = write_trace([printf(line, pid=7) for line in (1, 2, 3, 4)], "b.json")
+
+    diff = diff_traces(a, b, 1, 2)
+
+    assert diff.identical
+    assert (diff.a_events, diff.b_events, diff.matched_events, diff.hunk_count) == (4, 4, 4, 0)
+    assert diff.first_divergence is None
+
+
+def test_different_values_are_not_a_hunk(write_trace: TraceWriter) -> None:
+    a = write_trace([printf(1, "x"), printf(2, "a"), printf(3, "y")], "a.json")
+    b = write_trace([printf(1, "x"), printf(2, "b"), printf(3, "y")], "b.json")
+
+    diff = diff_traces(a, b, 1, 2)
+
+    assert not diff.identical
+    assert (diff.matched_events, diff.value_differences, diff.hunk_count) == (3, 1, 0)
+    assert diff.first_divergence is not None
+    assert (diff.first_divergence.kind, diff.first_divergence.a_step, diff.first_divergence.b_step) == ("value", 1, 1)
+
+
+def test_inserted_events_are_one_hunk_and_the_runs_realign(write_trace: TraceWriter) -> None:
+    a = write_trace(lines(1, 2, 3, 4, 5, 6, 7), "a.json")
+    b = write_trace(lines(1, 2, 90, 91, 3, 4, 5, 6, 7), "b.json")
+
+    diff = diff_traces(a, b, 1, 2, confirm=3)
+
+    assert [(it.a_start, it.a_count, it.b_start, it.b_count) for it in diff.hunks] == [(2, 0, 2, 2)]
+    assert diff.matched_events == 7
+    assert diff.first_divergence is not None
+    assert (diff.first_divergence.kind, diff.first_divergence.a_step, diff.first_divergence.b_step) == ("flow", 2, 2)
+
+
+def test_the_rest_of_a_longer_run_is_the_last_hunk(write_trace: TraceWriter) -> None:
+    a = write_trace(lines(1, 2), "a.json")
+    b = write_trace(lines(1, 2, 3, 4, 5), "b.json")
+
+    diff = diff_traces(a, b, 1, 2)
+
+    assert [(it.a_start, it.a_count, it.b_start, it.b_count) for it in diff.hunks] == [(2, 0, 2, 3)]
+    assert (diff.a_events, diff.b_events) == (2, 5)
+
+
+def test_hunks_beyond_the_limit_are_only_counted(write_trace: TraceWriter) -> None:
+    # Every other line differs, each difference is a hunk of its own
+    a = write_trace(lines(*[n if n % 2 else 1000 + n for n in range(1, 41)]), "a.json")
+    b = write_trace(lines(*[n if n % 2 else 2000 + n for n in range(1, 41)]), "b.json")
+
+    diff = diff_traces(a, b, 1, 2, confirm=1, max_hunks=5)
+
+    assert diff.hunk_count == 20
+    assert len(diff.hunks) == 5
+    assert diff.matched_events == 20
+
+
+def test_realign_takes_the_closest_confirmed_point() -> None:
+    a = deque(lines(10, 1, 2, 3))
+    b = deque(lines(20, 21, 1, 2, 3))
+
+    assert _realign(a, b, 3) == (1, 2)
+
+
+def test_realign_skips_points_that_are_not_confirmed() -> None:
+    # (1, 1) matches one event only, the runs realign after the 5
+    a = deque(lines(10, 1, 5, 6, 7))
+    b = deque(lines(20, 1, 9, 5, 6, 7))
+
+    assert _realign(a, b, 3) == (2, 3)
+
+
+def test_realign_confirms_with_the_events_left_at_the_end() -> None:
+    a = deque(lines(10, 1))
+    b = deque(lines(20, 21, 1))
+
+    assert _realign(a, b, 4) == (1, 2)
+
+
+def test_realign_without_a_common_point() -> None:
+    assert _realign(deque(lines(1, 2)), deque(lines(3, 4)), 2) is None
@@ -0,0 +1,100 @@
+import pytest
+
+from pathlib import Path
+from typing import List
+
+from server.exceptions import NotFoundError
+from server.models import CodeFlowCheckpoint
+from server.traces.trace_indexer import CheckpointWriter, VariableIndexWriter, index_trace, read_variable_history, seek_trace_state
+from server.traces.trace_state import TraceState
+
+from .conftest import TraceWriter, trace_event
+
+
+def program() -> list:
+    events = [
+        trace_event(0, "function_enter", line=1),
+        trace_event(1, "variable_declare", {"type": "int", "name": "i"}, line=2),
+    ]
+    for i in range(10):
+        events.append(trace_event(2 + i, "variable_assign", {"type": "int", "name": "i", "value": str(i)}, line=3))
+    events.append(trace_event(12, "function_exit", line=4))
+    return events
+
+
+def index(write_trace: TraceWriter, tmp_path: Path, interval: int) -> List[CodeFlowCheckpoint]:
+    checkpoints: List[CodeFlowCheckpoint] = []
+    index_trace(write_trace(program()), tmp_path / "variables.jsonl", interval, checkpoints.extend)
+    return checkpoints
+
+
+def expected_state(step: int) -> dict:
+    state = TraceState()
+    for event in program()[:step + 1]:
+        state.apply(event)
+    return state.processes
+
+
+@pytest.mark.parametrize("step", [0, 1, 2, 3, 4, 5, 6, 11, 12])
+def test_seek_trace_state_from_the_checkpoint_before_the_step(write_trace: TraceWriter, tmp_path: Path, step: int) -> None:
+    checkpoints = index(write_trace, tmp_path, 3)
+    checkpoint = [it for it in checkpoints if it.step <= step][-1]
+
+    state = seek_trace_state(tmp_path / "trace.json", checkpoint, step)
+
+    assert state.step == step
+    assert state.event == program()[step]
+    assert state.model_dump()["processes"] == expected_state(step)
+
+
+def test_checkpoints_hold_the_state_before_their_step(write_trace: TraceWriter, tmp_path: Path) -> None:
+    checkpoints = index(write_trace, tmp_path, 3)
+
+    assert [it.step for it in checkpoints] == [0, 3, 6, 9, 12]
+    assert checkpoints[0].state == {}
+    assert checkpoints[2].state == expected_state(5)
+
+
+def test_seek_trace_state_past_the_end(write_trace: TraceWriter, tmp_path: Path) -> None:
+    checkpoints = index(write_trace, tmp_path, 3)
+
+    with pytest.raises(NotFoundError):
+        seek_trace_state(tmp_path / "trace.json", checkpoints[-1], len(program()))
+
+
+def test_index_trace_stats_and_variables(write_trace: TraceWriter, tmp_path: Path) -> None:
+    result = index_trace(write_trace(program()), tmp_path / "variables.jsonl", 3, lambda _checkpoints: None)
+
+    assert result.checkpoint_count == 5
+    assert (result.stats.event_count, result.stats.time_start, result.stats.time_end) == (13, 0, 12)
+    history = read_variable_history(tmp_path / "variables.jsonl", result.variables, 0, 100)
+    assert [(it.step, it.value) for it in history] == [(2 + i, str(i)) for i in range(10)]
+
+
+@pytest.mark.parametrize("offset, limit", [(0, 3), (2, 4), (3, 3), (5, 10), (9, 1), (10, 5)])
+def test_read_variable_history_pages_over_the_segments(tmp_path: Path, offset: int, limit: int) -> None:
+    path = tmp_path / "variables.jsonl"
+    with path.open("wb") as f:
+        writer = VariableIndexWriter(f, segment_entries=3)
+        for event in program():
+            if event["type"] == "variable_assign":
+                writer.add(event["time"], event)
+        writer.flush()
+    assert [it.count for it in writer.segments] == [3, 3, 3, 1]
+
+    history = read_variable_history(path, writer.segments, offset, limit)
+
+    assert [it.value for it in history] == [str(i) for i in range(10)][offset:offset + limit]
+
+
+def test_checkpoint_writer_writes_full_batches_then_the_rest() -> None:
+    batches: List[List[int]] = []
+    writer = CheckpointWriter(lambda checkpoints: batches.append([it.step for it in checkpoints]), batch_size=2)
+
+    for step in range(5):
+        writer.add(CodeFlowCheckpoint(step=step, byte_offset=0, state={}))
+    writer.flush()
+    writer.flush()
+
+    assert batches == [[0, 1], [2, 3], [4]]
+    assert writer.count == 5
@@ -0,0 +1,107 @@
+import orjson
+import pytest
+import re
+
+from pathlib import Path
+from typing import Any, Dict, List
+
+from server.traces.trace_reader import TraceFormatError, iter_trace_events, iter_validated_trace_events
+
+from .conftest import TraceWriter, trace_bytes, trace_event
+
+
+def events() -> List[Dict[str, Any]]:
+    return [trace_event(time) for time in range(3)]
+
+
+def write(tmp_path: Path, content: bytes) -> Path:
+    path = tmp_path / "trace.json"
+    path.write_bytes(content)
+    return path
+
+
+def validated(path: Path, **kwargs: Any) -> List[Dict[str, Any]]:
+    return [event for _offset, event in iter_validated_trace_events(path, **kwargs)]
+
+
+def test_valid_trace_and_offsets(write_trace: TraceWriter) -> None:
+    path = write_trace(events())
+
+    result = list(iter_validated_trace_events(path))
+
+    assert [event for _offset, event in result] == events()
+    # The offsets are where iter_trace_events() resumes
+    assert list(iter_trace_events(path, result[1][0])) == result[1:]
+
+
+@pytest.mark.parametrize("content", [b"[]\n", b"[\n]\n", b"\n[\n\n]\n\n"])
+def test_empty_arrays(tmp_path: Path, content: bytes) -> None:
+    assert validated(write(tmp_path, content)) == []
+
+
+@pytest.mark.parametrize("content, message", [
+    (b"", "Empty trace"),
+    (b"[\n" + orjson.dumps(trace_event(0)) + b",\n", "Truncated trace"),
+    (b"[\n" + orjson.dumps(trace_event(0)) + b"\n", "Truncated trace"),
+    (b"[\n" + orjson.dumps(trace_event(0))[:20] + b"\n", "Invalid JSON at line 2"),
+    (b"{}\n", "Expected '['"),
+    (b"[]\n[]\n", "Unexpected data after ']'"),
+])
+def test_truncated_or_not_an_array(tmp_path: Path, content: bytes, message: str) -> None:
+    with pytest.raises(TraceFormatError, match=re.escape(message)):
+        validated(write(tmp_path, content))
+
+
+def test_missing_comma(tmp_path: Path) -> None:
+    content = trace_bytes(events()).replace(b",\n", b"\n", 1)
+
+    with pytest.raises(TraceFormatError, match="Missing ',' before line 3"):
+        validated(write(tmp_path, content))
+
+
+def test_trailing_comma(tmp_path: Path) -> None:
+    content = trace_bytes(events()).replace(b"\n]", b",\n]")
+
+    with pytest.raises(TraceFormatError, match="Trailing ','"):
+        validated(write(tmp_path, content))
+
+
+def test_oversize_event(write_trace: TraceWriter) -> None:
+    path = write_trace([trace_event(0), trace_event(1, payload={"text": "x" * 200})])
+
+    with pytest.raises(TraceFormatError, match="Event too long at line 3"):
+        validated(path, max_event_bytes=150)
+
+
+def test_event_at_the_size_limit(write_trace: TraceWriter) -> None:
+    event = trace_event(0, payload={"text": "x" * 100})
+    path = write_trace([event])
+
+    # The limit counts the line with its newline
+    assert validated(path, max_event_bytes=len(orjson.dumps(event)) + 1) == [event]
+
+
+@pytest.mark.parametrize("field", ["time", "pid", "parent_pid", "function", "type", "line", "payload"])
+def test_missing_field(write_trace: TraceWriter, field: str) -> None:
+    event = trace_event(0)
+    del event[field]
+
+    with pytest.raises(TraceFormatError, match=f"'{field}' at line 2"):
+        validated(write_trace([event]))
+
+
+def test_field_of_the_wrong_type(write_trace: TraceWriter) -> None:
+    with pytest.raises(TraceFormatError, match="'time'"):
+        validated(write_trace([{**trace_event(0), "time": "0"}]))
+
+
+def test_incomplete_payload(write_trace: TraceWriter) -> None:
+    event = trace_event(0, "variable_assign", {"type": "int", "name": "i"})
+
+    with pytest.raises(TraceFormatError, match="Invalid 'variable_assign' payload"):
+        validated(write_trace([event]))
+
+
+def test_not_an_event_object(tmp_path: Path) -> None:
+    with pytest.raises(TraceFormatError, match="Expected an event object"):
+        validated(write(tmp_path, b"[\n[1, 2]\n]\n"))